@@ -0,0 +1,398 @@
+#
+# Backfill
+#
+# Uploads every row from a directory of OLA dataLog files to the database,
+# like update_db_from_data_files.py but for whole SD cards:
+#
+#   - files are parsed in a pool of processes (with ola_bulk if numpy is
+#     available), a few files ahead of the uploads
+#   - rows the database already has (uploaded_keys) are not sent
+#   - rows go out in batches to /write_measurements (or one at a time if the
+#     server has no batch endpoint) with up to --in-flight requests at once
+#   - a batch that fails is retried with a growing wait, and if it still
+#     fails the run carries on with the other files instead of stopping
+#   - progress is kept in a checkpoint file (by default in the data
+#     directory) listing the files that are completely uploaded.  A run that
+#     is killed picks up where it stopped: finished files are skipped, and
+#     the rows already sent from the others are in uploaded_keys.
+#   - rows/s, bytes/s and the time left are printed as it goes
+#   - a wrong OLA clock can be corrected with --anchor and --reboot (see
+#     clock_drift.py; needs numpy).  The fitted correction is printed first.
+#     Use --restart after changing them, as the checkpoint does not know.
+#
+# Usage:
+#   python3 backfill.py fileDirectory [configFile] [--days-ago 365] [--workers 2]
+#                       [--in-flight 4] [--batch 200] [--checkpoint file] [--restart]
+#                       [--anchor [N:]LOGGED=TRUE ...] [--reboot [N:]TRUE ...] [--reset-jump-hours 24]
+# If configFile is omitted, uses the default config file in ~/bin.  Use the
+# config file from the gateway the files came from (SITE_ID, calibration).
+#
+
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from configobj import ConfigObj
+
+from calibration import load_calibration
+from clock_drift import ClockDriftError, fit_files, parse_anchor, parse_reboot
+from db_client import make_db_session, post_batch, BATCH_OK, BATCH_UNSUPPORTED
+from ola_data import parse_ola_line
+from uploaded_keys import UploadedKeys
+
+try:
+    import numpy as np
+    import ola_bulk     # needs numpy; files are parsed line by line without it
+except ImportError:
+    np = None
+    ola_bulk = None
+
+MAX_TRIES = 4           # attempts per batch before its file is left for the next run
+RETRY_WAIT = 5          # seconds before the first retry, doubled each time
+STATUS_INTERVAL = 10    # seconds between progress lines
+
+
+# Set up in each parse process
+worker = {}
+
+def init_worker(calibrationFile, drift):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # the main process stops the pool
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    worker['calibration'] = load_calibration(calibrationFile)
+    worker['drift'] = drift
+
+
+# Parse one data file in a worker process.  Returns the file name, its size and
+# modification time before it was read (it may still be growing) and a list of
+# (obsDateTime, seqNum, post_data) for the rows newer than since and than every
+# row before them in the file (where the clock went backwards, the rows are skipped
+# like update_db_from_data_files.py does).
+def parse_file(fn, since, siteID, place, default):
+    st = os.stat(fn)
+    table = worker['calibration']
+    result = []
+    if ola_bulk is not None:
+        rows, endOffset, data = ola_bulk.load_data_file(fn)
+        rows = rows[rows['valid']]
+        if worker['drift'] is not None:
+            rows['time'] = worker['drift'].correct(fn, rows['time'])
+        rows = rows[ola_bulk.newer_than(rows, since)]
+        pressure = table.pressures(siteID, rows['time'], rows['press'], rows['wtemp'], default).tolist()
+        times = rows['time'].tolist()
+        values = rows[['press', 'battVolts', 'obsNum', 'aX', 'aY', 'aZ', 'wtemp']].tolist()
+        for t, p, (press, battVolts, obsNum, aX, aY, aZ, wtemp) in zip(times, pressure, values):
+            result.append((t, obsNum, make_post_data(siteID, place, t, press, p, battVolts, obsNum, aX, aY, aZ, wtemp)))
+    else:
+        f = open(fn, 'rb')
+        newest = since
+        for fline in f:
+            fdata = parse_ola_line(fline)
+            if fdata is not None and fdata.obsDateTime > newest:
+                newest = fdata.obsDateTime
+                p = table.pressure(siteID, fdata.obsDateTime, fdata.press, fdata.wtemp, default)
+                result.append((fdata.obsDateTime, fdata.obsNum,
+                               make_post_data(siteID, place, fdata.obsDateTime, fdata.press, p, fdata.battVolts,
+                                              fdata.obsNum, fdata.aX, fdata.aY, fdata.aZ, fdata.wtemp)))
+        f.close()
+    return fn, [st.st_size, st.st_mtime], result
+
+
+# the json body for one observation, as sent to /write_measurement
+def make_post_data(siteID, place, obsDateTime, press, pressure, battVolts, obsNum, aX, aY, aZ, wtemp):
+    return {'place': place,
+            'sensor_ID': siteID,
+            'date': obsDateTime.astimezone().isoformat(),
+            'raw_pressure': press,
+            'pressure': pressure,
+            'voltage': battVolts,
+            'seqNum': obsNum,
+            'aX': aX,
+            'aY': aY,
+            'aZ': aZ,
+            'wtemp': wtemp,
+            'notes': " "}
+
+
+# Names, sizes and modification times of the files that are completely uploaded
+class Checkpoint:
+    def __init__(self, fileName, restart=False):
+        self.fileName = fileName
+        self.files = {}
+        if not restart:
+            try:
+                f = open(fileName, 'rt')
+                self.files = json.load(f)['files']
+                f.close()
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def is_done(self, fn):
+        st = os.stat(fn)
+        return self.files.get(os.path.basename(fn)) == [st.st_size, st.st_mtime]
+
+    # stamp is [size, mtime] from before the file was read, so anything added since is read next time
+    def mark_done(self, fn, stamp):
+        self.files[os.path.basename(fn)] = stamp
+
+    def save(self):
+        tmpName = self.fileName + '.tmp'
+        f = open(tmpName, 'wt')
+        json.dump({'files': self.files}, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmpName, self.fileName)
+
+
+class Backfill:
+    def __init__(self, config, checkpoint, uploaded, inFlight=4, batchSize=200):
+        self.dbUrl = config['DB_URL'].rstrip('/')
+        self.siteID = config['SITE_ID']
+        self.session = make_db_session(auth=(config.get('API_USER', ''), config.get('API_PASS', '')),
+                                       pool_size=inFlight)
+        self.checkpoint = checkpoint
+        self.uploaded = uploaded
+        self.batchSize = batchSize
+        self.slots = threading.Semaphore(inFlight)
+        self.pool = ThreadPoolExecutor(max_workers=inFlight, thread_name_prefix='upload')
+        self.lock = threading.Lock()
+        self.batchSupported = True
+        self.fileState = {}     # file -> {'batches': not finished, 'failed': bool, 'size': bytes,
+                                #          'stamp': [size, mtime] when parsed, 'credited': bytes}
+        self.failedFiles = []
+
+        # progress
+        self.startTime = time.time()
+        self.lastStatus = self.startTime
+        self.totalBytes = 0
+        self.doneBytes = 0      # bytes of the files finished, and of the others in proportion to the rows done
+        self.runBytes = 0       # the part of doneBytes done by this run
+        self.numSent = 0
+        self.numSkipped = 0
+
+    # Post rows, a list of post_data.  Returns how many, from the start of the list, were written.
+    def post_rows(self, rows):
+        if self.batchSupported and len(rows) > 1:
+            try:
+                result = post_batch(self.session, self.dbUrl + "/write_measurements", rows)
+            except Exception as ex:
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                message = template.format(type(ex).__name__, ex.args)
+                print(message)
+                return 0
+            if result == BATCH_OK:
+                return len(rows)
+            if result == BATCH_UNSUPPORTED:
+                print("Server does not accept batches.  Posting one row at a time.")
+                self.batchSupported = False
+        numWritten = 0
+        for post_data in rows:
+            try:
+                r = self.session.post(url=self.dbUrl + "/write_measurement", json=post_data, timeout=10)
+                r.raise_for_status()
+            except Exception as ex:
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                message = template.format(type(ex).__name__, ex.args)
+                print(message)
+                break
+            numWritten = numWritten + 1
+        return numWritten
+
+    # Runs on an upload thread.  batch is a list of (obsDateTime, seqNum, post_data).
+    def send_batch(self, fn, batch, bytesPerRow):
+        try:
+            remaining = batch
+            wait = RETRY_WAIT
+            for attempt in range(MAX_TRIES):
+                numWritten = self.post_rows([row[2] for row in remaining])
+                self.uploaded.add_many(self.siteID, [(row[0], row[1]) for row in remaining[:numWritten]])
+                with self.lock:
+                    self.numSent = self.numSent + numWritten
+                    self.credit(fn, numWritten * bytesPerRow)
+                remaining = remaining[numWritten:]
+                if not remaining:
+                    break
+                if attempt < MAX_TRIES - 1:
+                    print("Upload failed (" + os.path.basename(fn) + ").  Retrying in " + str(wait) + " s.")
+                    time.sleep(wait)
+                    wait = wait * 2
+            self.file_progress(fn, failed=bool(remaining))
+        finally:
+            self.slots.release()
+        self.status()
+
+    # Count bytes of fn as done (called with the lock held)
+    def credit(self, fn, numBytes):
+        self.fileState[fn]['credited'] = self.fileState[fn]['credited'] + numBytes
+        self.doneBytes = self.doneBytes + numBytes
+        self.runBytes = self.runBytes + numBytes
+
+    # One more batch of fn has finished (or the file had nothing to send)
+    def file_progress(self, fn, failed=False, finished=True):
+        with self.lock:
+            state = self.fileState[fn]
+            if finished:
+                state['batches'] = state['batches'] - 1
+            state['failed'] = state['failed'] or failed
+            if state['batches'] > 0:
+                return
+            if state['failed']:
+                self.failedFiles.append(os.path.basename(fn))
+                del self.fileState[fn]
+                return
+            self.credit(fn, state['size'] - state['credited'])     # header lines, old rows
+            stamp = state['stamp']
+            del self.fileState[fn]
+        self.uploaded.save()    # the keys first, so a finished file always has its keys saved
+        with self.lock:
+            self.checkpoint.mark_done(fn, stamp)
+            self.checkpoint.save()
+
+    # Queue the rows of one parsed file for upload
+    def upload_file(self, fn, stamp, rows):
+        size = stamp[0]
+        unseen = self.uploaded.unseen(self.siteID, [(t, seq, (t, seq, body)) for t, seq, body in rows])
+        batches = [unseen[i:i+self.batchSize] for i in range(0, len(unseen), self.batchSize)]
+        bytesPerRow = size / len(rows) if rows else 0
+        with self.lock:
+            self.numSkipped = self.numSkipped + len(rows) - len(unseen)
+            self.fileState[fn] = {'batches': len(batches), 'failed': False, 'size': size,
+                                  'stamp': stamp, 'credited': 0}
+            self.credit(fn, (len(rows) - len(unseen)) * bytesPerRow)
+        if not batches:
+            self.file_progress(fn, finished=False)
+        for batch in batches:
+            self.slots.acquire()    # no more than inFlight batches at once
+            self.pool.submit(self.send_batch, fn, batch, bytesPerRow)
+
+    def status(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.lastStatus < STATUS_INTERVAL:
+                return
+            self.lastStatus = now
+            elapsed = max(now - self.startTime, 0.001)
+            byteRate = self.runBytes / elapsed
+            left = self.totalBytes - self.doneBytes
+            eta = str(timedelta(seconds=int(left / byteRate))) if byteRate > 0 else 'unknown'
+            print('%d rows sent (%.0f rows/s), %d already in the database, %.1f of %.1f MB (%.0f kB/s), %s left'
+                  % (self.numSent, self.numSent / elapsed, self.numSkipped, self.doneBytes / 1e6,
+                     self.totalBytes / 1e6, byteRate / 1e3, eta), flush=True)
+
+    def finish(self):
+        self.pool.shutdown(wait=True)
+        self.uploaded.save()
+        self.checkpoint.save()
+
+
+def run(fileDir, config, daysAgo, workers, inFlight, batchSize, checkpointFile, restart, driftPoints=None):
+    section = config['dataHandler']
+    if section['DB_URL'].lower().startswith('no'):
+        print("DB_URL is " + section['DB_URL'] + " - nothing to upload to.")
+        return False
+    since = datetime.today() - timedelta(days=daysAgo)
+    default = (float(section['SENSOR_OFFSET']), float(section['SENSOR_TEMP_FACTOR']))
+    checkpoint = Checkpoint(checkpointFile, restart)
+    uploaded = UploadedKeys(section.get('UPLOADED_KEYS_DIR', '/home/pi/data/uploaded_keys/'))
+    backfill = Backfill(section, checkpoint, uploaded, inFlight, batchSize)
+
+    flist = sorted(glob.glob(os.path.join(fileDir, 'dataLog?????.TXT')))
+    drift = None
+    if driftPoints is not None:
+        # fitted to every file, finished or not, so the segments are numbered the same each run
+        try:
+            drift = fit_files(flist, *driftPoints)
+        except ClockDriftError as ex:
+            print("Could not fit the clock correction:")
+            for problem in ex.args[0]:
+                print("    " + problem)
+            return False
+        for line in drift.summary():
+            print(line)
+    todo = [fn for fn in flist if not checkpoint.is_done(fn)]
+    backfill.totalBytes = sum(os.path.getsize(fn) for fn in flist)
+    backfill.doneBytes = backfill.totalBytes - sum(os.path.getsize(fn) for fn in todo)
+    print("Uploading rows after " + str(since) + " from " + str(len(todo)) + " of " + str(len(flist)) +
+          " files (" + str(len(flist) - len(todo)) + " already done)", flush=True)
+
+    parsePool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                    initargs=(section.get('CALIBRATION_FILE', ''), drift))
+    try:
+        parsing = deque()
+        files = iter(todo)
+        while True:
+            while len(parsing) < 2 * workers:   # keep a few files parsed ahead of the uploads
+                fn = next(files, None)
+                if fn is None:
+                    break
+                parsing.append(parsePool.submit(parse_file, fn, since, section['SITE_ID'], section['PLACE'], default))
+            if not parsing:
+                break
+            fn, stamp, rows = parsing.popleft().result()
+            backfill.upload_file(fn, stamp, rows)
+            backfill.status()
+    finally:
+        parsePool.shutdown(wait=False, cancel_futures=True)
+        backfill.finish()
+    backfill.status(force=True)
+    if backfill.failedFiles:
+        print("Not all rows could be sent from: " + ", ".join(backfill.failedFiles) + ".  Run again to retry them.")
+        return False
+    print("Backfill complete.")
+    return True
+
+
+# if we catch a signal from the OS, stop (the checkpoint and keys are saved on the way out)
+def signal_handler(sig, frame):
+    print('Intercepted a signal - Stopping!', flush=True)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload dataLog files to the database, in parallel and resumably')
+    parser.add_argument('fileDirectory', help='directory with dataLog?????.TXT files')
+    parser.add_argument('configFile', nargs='?', default='/home/pi/bin/config.ini')
+    parser.add_argument('--days-ago', type=int, default=365, help='only rows newer than this many days')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help='processes parsing files')
+    parser.add_argument('--in-flight', type=int, default=4, help='upload requests at once')
+    parser.add_argument('--batch', type=int, default=200, help='rows per request')
+    parser.add_argument('--checkpoint', help='progress file (default fileDirectory/backfill_checkpoint.json)')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and go through every file')
+    parser.add_argument('--anchor', action='append', default=[],
+                        help='[N:]LOGGED=TRUE, the OLA clock read LOGGED at true time TRUE')
+    parser.add_argument('--reboot', action='append', default=[], help='[N:]TRUE, the OLA restarted at true time TRUE')
+    parser.add_argument('--reset-jump-hours', type=float, default=24,
+                        help='a backwards step in the logged time larger than this is a clock reset')
+    args = parser.parse_args()
+
+    driftPoints = None     # (anchors, reboots, reset jump)
+    if args.anchor or args.reboot:
+        if ola_bulk is None:
+            print("Correcting the clock needs numpy.")
+            sys.exit(1)
+        try:
+            driftPoints = ([parse_anchor(a) for a in args.anchor], [parse_reboot(r) for r in args.reboot],
+                     timedelta(hours=args.reset_jump_hours))
+        except ClockDriftError as ex:
+            print(ex.args[0][0])
+            sys.exit(1)
+
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    config = ConfigObj(args.configFile, file_error=True)
+    checkpointFile = args.checkpoint or os.path.join(args.fileDirectory, 'backfill_checkpoint.json')
+    ok = run(args.fileDirectory, config, args.days_ago, max(1, args.workers), max(1, args.in_flight),
+             max(1, args.batch), checkpointFile, args.restart, driftPoints)
+    sys.exit(0 if ok else 1)
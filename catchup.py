@@ -0,0 +1,77 @@
+#
+# Catch-up pipeline
+#
+# Parse stage that runs while files are still coming in from the OLA.  The
+# ZModem receiver reports each file as bytes land on disk (and again when it is
+# complete); this thread reads the new rows from it and hands them on, so they
+# are on their way to the database while later files are still transferring.
+# The uploader thread is the stage after this one.
+#
+# Notices for a file that pile up while the thread is busy are merged into one,
+# so a slow parse never holds up the transfer.
+#
+
+import queue
+import threading
+import time
+
+
+class CatchupPipeline(threading.Thread):
+    # process(path, final, restart) reads whatever is new in path and returns how
+    # many rows it passed on.  final is True once the file is completely received,
+    # restart if the file was started over and everything known about it is stale.
+    def __init__(self, process, log=print):
+        threading.Thread.__init__(self, name='catchup', daemon=True)
+        self.process = process
+        self.log = log
+        self.queue = queue.Queue()
+        self.numRows = 0
+        self.numFiles = 0
+        self.numErrors = 0
+        self.startTime = time.time()
+
+    # path has new data on disk
+    def notify(self, path, final=False, restart=False):
+        self.queue.put((path, final, restart))
+
+    # Process everything that has been notified and stop.  Returns the number of rows passed on.
+    def finish(self):
+        self.queue.put(None)
+        self.join()
+        self.log('Catch-up pipeline: ' + str(self.numRows) + ' rows from ' + str(self.numFiles) +
+                 ' files in ' + str(round(time.time() - self.startTime, 1)) + ' s' +
+                 (', ' + str(self.numErrors) + ' errors' if self.numErrors else ''))
+        return self.numRows
+
+    # Next batch of notices with repeats for the same file merged, in order.  None when done.
+    def next_notices(self):
+        items = [self.queue.get()]
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        notices = {}
+        for item in items:
+            if item is None:
+                break
+            path, final, restart = item
+            wasFinal, wasRestart = notices.get(path, (False, False))
+            notices[path] = (wasFinal or final, wasRestart or restart)
+        done = None in items
+        return [(path, final, restart) for path, (final, restart) in notices.items()], done
+
+    def run(self):
+        done = False
+        while not done:
+            notices, done = self.next_notices()
+            for path, final, restart in notices:
+                try:
+                    self.numRows = self.numRows + self.process(path, final, restart)
+                except Exception as ex:
+                    self.numErrors = self.numErrors + 1
+                    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                    message = template.format(type(ex).__name__, ex.args)
+                    self.log(message)
+                if final:
+                    self.numFiles = self.numFiles + 1
@@ -0,0 +1,253 @@
+#
+# Clock drift
+#
+# Corrects the times of rows logged by an OLA whose clock was wrong, for the
+# backfill tools.  Instead of one fixed timedelta edited into the source, the
+# correction is fitted from points given on the command line:
+#
+#   anchor   [N:]LOGGED=TRUE   the OLA clock read LOGGED when the true time
+#                              was TRUE (e.g. read when the sensor was
+#                              retrieved, or a row matched to a known event)
+#   reboot   [N:]TRUE          segment N started (the OLA restarted) at TRUE
+#
+# The rows are split into segments wherever the logged time goes backwards by
+# more than resetJump (default a day), which is what a reset clock looks like:
+# segment 0 is everything before the first reset, segment 1 the rows after it,
+# and so on.  Each segment gets its own correction, an offset (true - logged)
+# that is a function of the logged time:
+#   - no points: left as logged (and reported)
+#   - one point: a constant offset
+#   - two or more: straight lines between the points (drift), carried on with
+#     the slope of the first/last pair before the first point and after the
+#     last one
+# An anchor without N: goes to the segment whose logged times include LOGGED,
+# or if none do, to the nearest one.  Reboots without N: are given to segments
+# 1, 2, ... in order.  summary() shows what went where.
+#
+# The correction is applied to whole columns of datetime64 at once.  Fitting
+# needs every row's logged time in file order; files are handed over one at a
+# time in order (scan()), and then each file's first segment number is known,
+# so files can be corrected independently (in parallel) with correct().
+#
+# Running this file checks the fit on a synthetic drifting, resetting clock:
+#   python3 clock_drift.py
+#
+
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+RESET_JUMP = timedelta(days=1)
+
+
+class ClockDriftError(Exception):
+    pass
+
+
+def _parse_time(s):
+    try:
+        return datetime.fromisoformat(s.strip())
+    except ValueError:
+        raise ClockDriftError(['not a time: ' + repr(s)])
+
+
+def _split_segment(s):
+    head, sep, rest = s.partition(':')
+    if sep and head.strip().isdigit():
+        return int(head), rest
+    return None, s
+
+
+# '[N:]LOGGED=TRUE' -> (N or None, logged, true)
+def parse_anchor(s):
+    segment, rest = _split_segment(s)
+    logged, sep, true = rest.partition('=')
+    if not sep:
+        raise ClockDriftError(['anchor must be [N:]LOGGED=TRUE: ' + repr(s)])
+    return segment, _parse_time(logged), _parse_time(true)
+
+
+# '[N:]TRUE' -> (N or None, true)
+def parse_reboot(s):
+    segment, rest = _split_segment(s)
+    return segment, _parse_time(rest)
+
+
+def _us(t):
+    return np.datetime64(t, 'us').astype(np.int64)
+
+
+# us since 1970 -> datetime64 to the second, for printing
+def _seconds(us):
+    return np.datetime64(int(us), 'us').astype('datetime64[s]')
+
+
+class ClockDriftModel:
+    def __init__(self, anchors=(), reboots=(), resetJump=RESET_JUMP):
+        self.anchors = list(anchors)
+        self.reboots = list(reboots)
+        self.resetJump = resetJump // timedelta(microseconds=1)
+        self.segments = []      # [first logged, last logged, min, max, rows] per segment, in us
+        self.fileSegments = {}  # file -> number of its first segment
+        self.last = None        # logged time of the last row scanned
+        self.fits = None
+
+    # Add the logged times (datetime64, valid rows in file order) of the next file
+    def scan(self, fn, times):
+        times = np.asarray(times, dtype='datetime64[us]').astype(np.int64)
+        if len(times) == 0:
+            self.fileSegments[fn] = max(len(self.segments) - 1, 0)
+            return
+        if self.last is None or times[0] < self.last - self.resetJump:
+            self.segments.append([int(times[0]), int(times[0]), int(times[0]), int(times[0]), 0])
+        self.fileSegments[fn] = len(self.segments) - 1
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(times) < -self.resetJump) + 1, [len(times)]))
+        for i, (a, b) in enumerate(zip(starts[:-1], starts[1:])):
+            if i > 0:
+                self.segments.append([int(times[a]), int(times[a]), int(times[a]), int(times[a]), 0])
+            seg = self.segments[-1]
+            seg[1] = int(times[b-1])
+            seg[2] = min(seg[2], int(times[a:b].min()))
+            seg[3] = max(seg[3], int(times[a:b].max()))
+            seg[4] = seg[4] + int(b - a)
+        self.last = int(times[-1])
+
+    # Work out the correction for each segment once every file has been scanned
+    def fit(self):
+        problems = []
+        points = [[] for seg in self.segments]
+        self.placed = []
+        for segment, logged, true in self.anchors:
+            x = int(_us(logged))
+            if segment is None:
+                inside = [i for i, seg in enumerate(self.segments) if seg[2] <= x <= seg[3]]
+                if len(inside) > 1:
+                    problems.append('anchor at logged ' + str(logged) + ' is inside segments ' +
+                                    ', '.join(map(str, inside)) + ' - say which with N:')
+                    continue
+                if inside:
+                    segment = inside[0]
+                elif self.segments:
+                    segment = min(range(len(self.segments)),
+                                  key=lambda i: min(abs(self.segments[i][2] - x), abs(self.segments[i][3] - x)))
+            if segment is None or segment >= len(self.segments):
+                problems.append('anchor at logged ' + str(logged) + ': no segment ' + str(segment))
+                continue
+            points[segment].append((x, int(_us(true)) - x))
+            self.placed.append(('anchor', segment, logged, true))
+        for i, (segment, true) in enumerate(self.reboots):
+            if segment is None:
+                segment = i + 1
+            if segment >= len(self.segments):
+                problems.append('reboot at ' + str(true) + ': there is no segment ' + str(segment))
+                continue
+            x = self.segments[segment][0]
+            points[segment].append((x, int(_us(true)) - x))
+            self.placed.append(('reboot', segment, None, true))
+        self.fits = []
+        for segment, pts in enumerate(points):
+            pts.sort()
+            for a, b in zip(pts, pts[1:]):
+                if a[0] == b[0]:
+                    problems.append('segment ' + str(segment) + ' has two points at logged ' +
+                                    str(_seconds(a[0])))
+            self.fits.append((np.array([p[0] for p in pts], dtype=np.float64),
+                              np.array([p[1] for p in pts], dtype=np.float64)))
+        if problems:
+            raise ClockDriftError(problems)
+
+    # Offset in us (true - logged) for logged times x (us, float) in one segment
+    def _offsets(self, segment, x):
+        xs, ys = self.fits[segment] if segment < len(self.fits) else (np.zeros(0), np.zeros(0))
+        if len(xs) == 0:
+            return np.zeros(len(x))
+        if len(xs) == 1:
+            return np.full(len(x), ys[0])
+        y = np.interp(x, xs, ys)
+        before = x < xs[0]
+        y[before] = ys[0] + (x[before] - xs[0]) * (ys[1] - ys[0]) / (xs[1] - xs[0])
+        after = x > xs[-1]
+        y[after] = ys[-1] + (x[after] - xs[-1]) * (ys[-1] - ys[-2]) / (xs[-1] - xs[-2])
+        return y
+
+    # Corrected times for the logged times (datetime64, valid rows in order) of a scanned file
+    def correct(self, fn, times):
+        times = np.asarray(times, dtype='datetime64[us]')
+        x = times.astype(np.int64)
+        if len(x) == 0:
+            return times
+        segment = np.full(len(x), self.fileSegments[fn])
+        segment[1:] = segment[1:] + np.cumsum(np.diff(x) < -self.resetJump)
+        offsets = np.zeros(len(x))
+        for s in np.unique(segment):
+            inSegment = segment == s
+            offsets[inSegment] = self._offsets(int(s), x[inSegment].astype(np.float64))
+        return times + np.round(offsets).astype('timedelta64[us]')
+
+    # Lines describing the segments and their corrections
+    def summary(self):
+        lines = []
+        for i, seg in enumerate(self.segments):
+            first, last = np.array([seg[2], seg[3]], dtype=np.float64)
+            y = self._offsets(i, np.array([first, last]))
+            corrected = np.array([first + y[0], last + y[1]]).round().astype(np.int64)
+            how = {0: 'not corrected', 1: 'constant offset'}.get(len(self.fits[i][0]), 'drift through ' +
+                                                                 str(len(self.fits[i][0])) + ' points')
+            lines.append('segment %d: %d rows logged %s to %s -> %s to %s (%s)'
+                         % (i, seg[4], _seconds(seg[2]), _seconds(seg[3]), _seconds(corrected[0]), _seconds(corrected[1]), how))
+        for kind, segment, logged, true in self.placed:
+            lines.append('  %s %s-> %s used for segment %d' % (kind, (str(logged) + ' ') if logged else '', true, segment))
+        return lines
+
+
+# Fit a model to a list of dataLog files (in order) with ola_bulk
+def fit_files(flist, anchors=(), reboots=(), resetJump=RESET_JUMP):
+    import ola_bulk
+    model = ClockDriftModel(anchors, reboots, resetJump)
+    for fn in flist:
+        rows, endOffset, data = ola_bulk.load_data_file(fn)
+        model.scan(fn, rows['time'][rows['valid']])
+    model.fit()
+    return model
+
+
+def self_check():
+    # 3 days at one row a minute, clock running 30 s/day fast and 2 h slow to start with,
+    # then a reset to 2000-01-01 that runs for 2 days at 10 s/day slow
+    true0 = datetime(2026, 3, 1)
+    minutes = np.arange(3 * 1440)
+    trueA = np.datetime64(true0, 'us') + (minutes * 60000000).astype('timedelta64[us]')
+    driftA = (-2 * 3600 + minutes / 1440 * 30) * 1e6
+    loggedA = trueA + np.round(driftA).astype('timedelta64[us]')
+    true1 = datetime(2026, 3, 4, 12)
+    minutes = np.arange(2 * 1440)
+    trueB = np.datetime64(true1, 'us') + (minutes * 60000000).astype('timedelta64[us]')
+    loggedB = np.datetime64('2000-01-01', 'us') + (minutes * (60000000 - 60000000 * 10 // 86400)).astype('timedelta64[us]')
+
+    def logged_at(logged, true, i):
+        return logged[i].astype(datetime), true[i].astype(datetime)
+
+    a0 = logged_at(loggedA, trueA, 10)
+    a1 = logged_at(loggedA, trueA, 4000)
+    b1 = logged_at(loggedB, trueB, 2000)
+    model = ClockDriftModel([parse_anchor(str(a0[0]) + '=' + str(a0[1])),
+                             parse_anchor(str(a1[0]) + '=' + str(a1[1])),
+                             parse_anchor('1:' + str(b1[0]) + '=' + str(b1[1]))],
+                            [parse_reboot(str(true1))])
+    # split over files, with the reset in the middle of one
+    files = [('f0', loggedA[:2000]), ('f1', np.concatenate((loggedA[2000:], loggedB[:100]))), ('f2', loggedB[100:])]
+    for fn, times in files:
+        model.scan(fn, times)
+    model.fit()
+    corrected = np.concatenate([model.correct(fn, times) for fn, times in files])
+    err = np.abs((corrected - np.concatenate((trueA, trueB))).astype(np.int64)) / 1e6
+    for line in model.summary():
+        print(line)
+    ok = len(model.segments) == 2 and err.max() < 1.0
+    print('largest error %.3f s, %s' % (err.max(), 'check passed' if ok else 'CHECK FAILED'))
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
@@ -0,0 +1,224 @@
+#
+# Daily log
+#
+# Writes the lines received from the OLA to one file per day in LOGGED_FILE_DIR
+# (YYYYMMDD.txt, by the Pi's date as before).  The day's file is kept open
+# instead of being opened, appended to and closed for every line:
+#
+#   - each line is flushed to the OS as it is written, so anything reading the
+#     file (the logged-file catch-up) sees it straight away,
+#   - the file is fsync'd at most every syncInterval seconds (and when it is
+#     rotated or closed), so the SD card is not asked to commit every sample,
+#   - the file is rotated at midnight, on the first write of the new day.
+#
+# Next to each file is a small index, YYYYMMDD.txt.idx, with one
+#   <obsDateTime ISO> <byte offset>
+# line for the first line written in each INDEX_STEP of observation time.
+# index_offset() uses it to find a place to start in the day's file that is
+# at or before a given time, and the catch-up seeks (bisects) from there.
+# The index is only a hint: an entry that does not match the file is ignored.
+#
+# Running this file compares writing with the old open/append/close with the
+# writer, and checks index lookups against a straight scan:
+#   python3 daily_log.py [numLines]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import file_bisect
+from ola_data import decode_timestamp
+
+INDEX_STEP = 600            # seconds of observation time between index entries
+INDEX_SUFFIX = '.idx'
+
+
+class DailyLogWriter:
+    def __init__(self, directory, syncInterval=30):
+        self.directory = directory
+        self.syncInterval = syncInterval
+        self.day = None
+        self.f = None
+        self.idx = None
+        self.offset = 0
+        self.nextIndexTime = None
+        self.lastSync = time.monotonic()
+        self.dirty = False
+        self.numSyncs = 0
+
+    def file_name(self, day):
+        return os.path.join(self.directory, day + '.txt')
+
+    def open(self, day):
+        self.close()
+        fn = self.file_name(day)
+        self.f = open(fn, 'ab')
+        self.offset = self.f.tell()
+        self.idx = open(fn + INDEX_SUFFIX, 'a+t')
+        self.idx.seek(0)
+        entries = read_index(self.idx)
+        self.nextIndexTime = None
+        if entries:
+            self.nextIndexTime = _step_after(entries[-1][0])
+        self.day = day
+
+    # Append one line (a str ending in a newline) observed at obsDateTime
+    def write(self, line, obsDateTime=None):
+        day = datetime.today().strftime('%Y%m%d')
+        if day != self.day:
+            self.open(day)
+        if obsDateTime is not None and (self.nextIndexTime is None or obsDateTime >= self.nextIndexTime):
+            self.idx.write(obsDateTime.isoformat() + ' ' + str(self.offset) + '\n')
+            self.idx.flush()
+            self.nextIndexTime = _step_after(obsDateTime)
+        data = line.encode('utf-8')
+        self.f.write(data)
+        self.f.flush()
+        self.offset = self.offset + len(data)
+        self.dirty = True
+        self.sync_if_due()
+
+    # fsync if there is something unsynced and syncInterval has passed
+    def sync_if_due(self):
+        if self.dirty and time.monotonic() - self.lastSync >= self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        if self.f is not None and self.dirty:
+            os.fsync(self.f.fileno())   # data before the index that points into it
+            os.fsync(self.idx.fileno())
+            self.numSyncs = self.numSyncs + 1
+        self.dirty = False
+        self.lastSync = time.monotonic()
+
+    def close(self):
+        if self.f is None:
+            return
+        self.sync()
+        self.f.close()
+        self.idx.close()
+        self.f = None
+        self.idx = None
+        self.day = None
+
+
+# Start of the index step after t
+def _step_after(t):
+    midnight = t.replace(hour=0, minute=0, second=0, microsecond=0)
+    step = int((t - midnight).total_seconds()) // INDEX_STEP + 1
+    return midnight + timedelta(seconds=step * INDEX_STEP)
+
+
+# [(obsDateTime, offset)] from an open index file, skipping anything unreadable
+def read_index(f):
+    entries = []
+    for line in f:
+        try:
+            t, offset = line.split()
+            entries.append((datetime.fromisoformat(t), int(offset)))
+        except ValueError:
+            continue    # partial last line after a crash
+    return entries
+
+
+# Offset of a line in the logged file fn that is at or before when, to start a
+# search from.  0 if there is no index or nothing suitable in it.
+def index_offset(fn, when):
+    try:
+        f = open(fn + INDEX_SUFFIX, 'rt')
+        entries = read_index(f)
+        f.close()
+    except OSError:
+        return 0
+    best = 0
+    bestTime = None
+    for t, offset in entries:
+        if t > when:
+            break
+        best, bestTime = offset, t
+    if best == 0:
+        return 0
+    # check the entry really points at that line in this file
+    try:
+        f = open(fn, 'rb')
+        f.seek(best - 1)
+        line = f.readline()
+        if line == b'\n':
+            line = f.readline()
+        else:
+            line = b''
+        f.close()
+        d, t = line.decode('ascii').split(',')[:2]
+        if decode_timestamp(d, t) == bestTime:
+            return best
+    except (OSError, ValueError, UnicodeDecodeError):
+        pass
+    return 0
+
+
+# The writing this replaces
+def _append_and_close(directory, line):
+    fn = directory + "/" + datetime.today().strftime('%Y%m%d') + ".txt"
+    outfile = open(fn, "a")
+    outfile.write(line)
+    outfile.close()
+
+
+def _line(t, n):
+    return '%s,%s.%02d,12.1,0.01,0.02,0.98,21.5,1013.2,18.0,%d\r\n' % (t.strftime('%m/%d/%Y'), t.strftime('%H:%M:%S'),
+                                                                   t.microsecond // 10000, n)
+
+
+def benchmark(numLines=20000):
+    start = datetime(2026, 10, 17, 0, 0, 5)
+    times = [start + timedelta(seconds=4 * i, milliseconds=10 * (i % 100)) for i in range(numLines)]
+    for name in ('open/append/close (old)', 'DailyLogWriter'):
+        directory = tempfile.mkdtemp()
+        writer = DailyLogWriter(directory, syncInterval=30)
+        t0 = time.perf_counter()
+        for n, t in enumerate(times):
+            if name == 'DailyLogWriter':
+                writer.write(_line(t, n), t)
+            else:
+                _append_and_close(directory, _line(t, n))
+        writer.close()
+        print('%-25s %d lines in %6.3f s' % (name, numLines, time.perf_counter() - t0))
+        shutil.rmtree(directory)
+
+    # index lookups against a straight scan
+    directory = tempfile.mkdtemp()
+    writer = DailyLogWriter(directory)
+    for n, t in enumerate(times[:numLines // 2]):
+        writer.write(_line(t, n), t)
+    writer.close()
+    writer = DailyLogWriter(directory)     # reopened part way through the day
+    for n, t in enumerate(times[numLines // 2:], numLines // 2):
+        writer.write(_line(t, n), t)
+    writer.close()
+    fn = writer.file_name(datetime.today().strftime('%Y%m%d'))
+    bad = 0
+    used = 0
+    for when in (start - timedelta(seconds=1), start, times[1], times[numLines // 3] + timedelta(seconds=1),
+                 times[numLines // 2], times[-1], times[-1] + timedelta(days=1)):
+        fromOffset = index_offset(fn, when)
+        if fromOffset > 0:
+            used = used + 1
+        got = file_bisect.offset_after(fn, when, fromOffset)
+        if got != file_bisect.offset_after(fn, when):
+            bad = bad + 1
+            print('mismatch for', when)
+    f = open(fn + INDEX_SUFFIX)
+    numEntries = len(read_index(f))
+    f.close()
+    print('index: %d entries for %d lines, %d of 7 lookups started from it, %d wrong'
+          % (numEntries, numLines, used, bad))
+    shutil.rmtree(directory)
+    return bad == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000) else 1)
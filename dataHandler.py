@@ -8,7 +8,9 @@
 #     Download files that are either larger or new.
 #     Scan the new files and insert new data in the database. (Ordered by date-time
 #         since sample number might have reset.)
-# Else save to a local file and insert this line in database.
+# Else save to a local file and queue this line for the database.  Queued lines
+#  wait in an on-disk outbox and are posted by a separate uploader thread, so a
+#  slow or unreachable server never holds up reading the serial port.
 #
 # Written March 2021 by Tony Whipple
 #
@@ -27,8 +29,33 @@ from os.path import exists
 import glob
 from datetime import datetime
 from datetime import timedelta
-from configobj import ConfigObj
+from settings import load_settings, SettingsError, ConfigWatch
+from calibration import load_calibration, CalibrationTable, CalibrationError
+from ola_data import OLAdata, parse_ola_line
 import traceback
+from db_client import make_db_session, post_batch, BATCH_OK, BATCH_UNSUPPORTED
+from outbox import Outbox
+from uploader import Uploader
+from upload_manifest import UploadManifest
+import file_bisect
+from sync_cursor import SyncCursor, server_time_to_local
+import serial_wait
+import zmodem
+from catchup import CatchupPipeline
+from ola_listing import ListingSnapshot
+import ola_delete
+from wake_window import WakeScheduler, SEND_INTERVAL
+from daily_log import DailyLogWriter, index_offset
+from gap_index import GapIndex
+from uploaded_keys import UploadedKeys
+try:
+    import ola_bulk     # needs numpy; catch-up falls back to parsing line by line without it
+except ImportError:
+    ola_bulk = None
+try:
+    import obs_archive  # needs numpy; there is no binary archive without it
+except ImportError:
+    obs_archive = None
 
 # override print so each statement is timestamped
 old_print = print
@@ -36,6 +63,97 @@ def timestamped_print(*args, **kwargs):
   old_print(datetime.now(), *args, **kwargs)
 print = timestamped_print
 
+# config.ini is read into settings (see settings.py) when the program starts, and again
+# on SIGHUP or when the file changes, without closing the serial port
+CONFIG_FILE = "/home/pi/bin/config.ini"
+settings = None
+config_watch = None
+reload_requested = False
+
+# Calibration history from CALIBRATION_FILE, read again along with config.ini or when it changes
+calibration = None
+calibration_watch = None
+
+def get_calibration():
+    global calibration, calibration_watch
+    if calibration is None:
+        calibration = CalibrationTable()    # without a (good) table, config.ini's values are used
+        calibration_watch = ConfigWatch(settings.CALIBRATION_FILE)
+        reload_calibration()
+    return calibration
+
+# Read the calibration table again.  If it does not check out the current one stays.
+def reload_calibration():
+    global calibration
+    try:
+        newCalibration = load_calibration(settings.CALIBRATION_FILE)
+    except CalibrationError as ex:
+        print("Calibration table not loaded - keeping the current one:")
+        for problem in ex.args[0]:
+            print("    " + problem)
+        return False
+    calibration = newCalibration
+    if len(calibration):
+        print("Calibration table " + settings.CALIBRATION_FILE + " has " + str(len(calibration)) + " ranges")
+    return True
+
+# Calibration (offset, temperature factor) from config.ini, used outside the table's ranges
+def default_calibration():
+    return settings.SENSOR_OFFSET, settings.SENSOR_TEMP_FACTOR
+
+# SIGHUP asks for config.ini to be read again.  The main loop does the work.
+def request_reload(sig, frame):
+    global reload_requested
+    reload_requested = True
+
+# Read config.ini again and swap in the new settings.  If it does not check out the
+# current settings stay.  Anything built from settings that changed is rebuilt on next use.
+def reload_settings():
+    global settings, db_session, sync_cursor, logged_file_writer, obs_archive_writer, calibration_watch, gap_index, uploaded_keys
+    try:
+        newSettings = load_settings(CONFIG_FILE)
+    except SettingsError as ex:
+        print("Config file not reloaded - keeping the current settings:")
+        for problem in ex.args[0]:
+            print("    " + problem)
+        return False
+    changed = newSettings.changed(settings)
+    settings = newSettings      # one assignment, so other threads see either all old or all new
+    if calibration is not None:
+        if 'CALIBRATION_FILE' in changed:
+            calibration_watch = ConfigWatch(settings.CALIBRATION_FILE)
+        reload_calibration()    # the table may have been edited too
+    if not changed:
+        print("Config file reloaded, nothing changed")
+        return True
+    print("Config file reloaded, changed: " + ", ".join(changed))
+    if 'API_USER' in changed or 'API_PASS' in changed:
+        db_session = None
+    if 'SYNC_CURSOR_FILE' in changed or 'SYNC_RECONCILE_INTERVAL' in changed:
+        if sync_cursor is not None:
+            sync_cursor.save()
+        sync_cursor = None
+    if logged_file_writer is not None and ('LOGGED_FILE_DIR' in changed or 'LOGGED_FILE_SYNC_INTERVAL' in changed):
+        logged_file_writer.close()
+        logged_file_writer = None
+    if obs_archive_writer is not None and ('ARCHIVE_DIR' in changed or 'ARCHIVE_FLUSH_INTERVAL' in changed):
+        obs_archive_writer.flush()
+        obs_archive_writer = None
+    if gap_index is not None and 'GAP_INDEX_FILE' in changed:
+        gap_index.save()
+        gap_index = GapIndex(settings.GAP_INDEX_FILE)
+    if uploaded_keys is not None and 'UPLOADED_KEYS_DIR' in changed:
+        uploaded_keys.save()
+        uploaded_keys = None
+    if uploader is not None:
+        uploader.batchSize = settings.DB_BATCH_SIZE
+        for key in ('OUTBOX_FILE', 'UPLOAD_WORKERS'):
+            if key in changed:
+                print(key + " takes effect when dataHandler is restarted")
+    if not settings.NO_LOGGING:
+        start_uploader()    # in case logging has just been turned on
+    return True
+
 # if we catch a signal from the OS, clean up and exit
 def signal_handler(sig, frame):
     # ignore additional signals
@@ -48,68 +166,112 @@ def signal_handler(sig, frame):
     signal.signal(signal.SIGFPE, signal.SIG_IGN)
     signal.signal(signal.SIGSEGV, signal.SIG_IGN)
     print('Intercepted a signal - Stopping!', flush=True)
+    if logged_file_writer is not None:
+        logged_file_writer.close()
+    if obs_archive_writer is not None:
+        obs_archive_writer.flush()
+    if gap_index is not None:
+        gap_index.save()
+    if uploaded_keys is not None:
+        uploaded_keys.save()
+    if sync_cursor is not None:
+        sync_cursor.save()
     ser.close()
     sys.exit(0)
     
 
-# Class to contain the OLA data.  Attempts to parse the data.
-# If parsing fails, self.inString will be set to empty    
-class OLAdata:
-    def __init__(self, inData):
-        self.obsNum=-999
-        if inData=='':
-            self.inString=''
-        else:
-            # Parse the incoming data into vars if it looks like data
-            self.inString = inData.decode()
-            self.parseData()
+# Long-lived, pooled HTTP session shared by all database calls so that
+# connections are kept alive and reused between observations.
+db_session = None
+
+def get_db_session():
+    global db_session
+    if db_session is None:
+        db_session = make_db_session(auth=(settings.API_USER, settings.API_PASS))
+    return db_session
+
+# Cleared if the server tells us it has no batch endpoint so we stop trying.
+batch_supported = True
+
+# Durable queue of observations waiting to be uploaded, and the thread that drains it
+outbox = None
+uploader = None
+
+# Newest observation known to be in the database, kept locally so catch-up does
+# not have to ask the server first
+sync_cursor = None
+
+def get_sync_cursor():
+    global sync_cursor
+    if sync_cursor is None:
+        sync_cursor = SyncCursor(settings.SYNC_CURSOR_FILE, settings.SYNC_RECONCILE_INTERVAL, log=print)
+    return sync_cursor
+
+# The day's logged file, kept open between observations
+logged_file_writer = None
+
+def get_logged_file_writer():
+    global logged_file_writer
+    if logged_file_writer is None:
+        logged_file_writer = DailyLogWriter(settings.LOGGED_FILE_DIR, settings.LOGGED_FILE_SYNC_INTERVAL)
+    return logged_file_writer
+
+# Compact binary copy of the observations (None if numpy is not available)
+obs_archive_writer = None
+
+def get_obs_archive():
+    global obs_archive_writer
+    if obs_archive_writer is None and obs_archive is not None:
+        obs_archive_writer = obs_archive.ObsArchive(settings.ARCHIVE_DIR, flushInterval=settings.ARCHIVE_FLUSH_INTERVAL)
+    return obs_archive_writer
+
+# Add observations to the binary archive.  Never lets an archive problem get in
+# the way of logging - the text files have everything anyway.
+def archive_observations(observations):
+    try:
+        archive = get_obs_archive()
+        if archive is not None:
+            archive.add(observations)
+    except Exception as ex:
+        print("Exception writing the observation archive")
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(ex).__name__, ex.args)
+        print(message)
+
+# Which sequence numbers are in local files and which are in the database
+gap_index = None
+
+def get_gap_index():
+    global gap_index
+    if gap_index is None:
+        gap_index = GapIndex(settings.GAP_INDEX_FILE)
+    return gap_index
+
+# Keys of the observations the database has confirmed, so backfills can skip them
+uploaded_keys = None
+
+def get_uploaded_keys():
+    global uploaded_keys
+    if uploaded_keys is None:
+        uploaded_keys = UploadedKeys(settings.UPLOADED_KEYS_DIR)
+    return uploaded_keys
+
+# Record rows the database has confirmed, given as (obsDateTime, seqNum)
+def record_uploaded(rows):
+    index = get_gap_index()
+    for obsDateTime, seqNum in rows:
+        index.add_upstream(seqNum, obsDateTime)
+    get_uploaded_keys().add_many(settings.SITE_ID, rows)
+
+# Record rows acknowledged by the uploader thread, given as (sensorID, post_data)
+def record_acked_rows(rows):
+    record_uploaded([(datetime.fromisoformat(post_data['date']).astimezone().replace(tzinfo=None), post_data['seqNum'])
+                     for sensorID, post_data in rows if sensorID == settings.SITE_ID])
+
+# Learns when the OLA wakes up to sample, so the menu can be asked for then
+# instead of hammering on bluetooth until it answers
+wake_scheduler = WakeScheduler()
 
-    # If the inData look like real data populate the variables
-    # otherwise leave them uninitialized.
-    
-#   This version of parseData was for the micro-pressure sensor     
-#    def parseData(self):
-#        l = self.inString.split(',')
-#        if len(l)==10:     # num elements+1, split makes a token out of the trailing crlf
-#            # If any exception, clear the input.  If it was a bad transmission
-#            # the check sequential step should catch it.
-#            try:
-#                self.obsDateTime = datetime.strptime(l[0]+' '+l[1], "%m/%d/%Y %H:%M:%S.%f")
-#                self.battVolts = float(l[2])
-#                self.aX = float(l[3])
-#                self.aY = float(l[4])
-#                self.aZ = float(l[5])
-#                self.temp = float(l[6])
-#                self.press = float(l[7])
-#                self.obsNum = int(l[8])
-#                #print(vars(self))
-#            except:
-#                self.inString = ''# Clear inString if this fails parsing
-#        else:
-#            self.inString = ''    # Clear inString if this fails parsing
-
-#   This version of parseData is for the Bar02 sensor
-    def parseData(self):
-        l = self.inString.split(',')
-        if len(l)==11:     # num elements+1, split makes a token out of the trailing crlf
-            # If any exception, clear the input.  If it was a bad transmission
-            # the check sequential step should catch it.
-            try:
-                self.obsDateTime = datetime.strptime(l[0]+' '+l[1], "%m/%d/%Y %H:%M:%S.%f")
-                self.battVolts = float(l[2])
-                self.aX = float(l[3])
-                self.aY = float(l[4])
-                self.aZ = float(l[5])
-                self.temp = float(l[6])
-                self.press = float(l[7])
-                self.wtemp = float(l[8])
-                self.obsNum = int(l[9])
-                #print(vars(self))
-            except:
-                self.inString = ''# Clear inString if this fails parsing
-        else:
-            self.inString = ''    # Clear inString if this fails parsing
-            
 
 # Checks that the observation time that we just received is within range of the system time
 # and resets the clock if necessary.
@@ -175,75 +337,274 @@ def check_sequential(newData, prevData):
     else:
         return False
 
+# When a line arrives out of sequence, look the rows in between up in the gap index.
+# If every one of them is either in the database already or in a local file, the
+# ones from local files are queued for upload and True is returned.  Otherwise
+# (or if the OLA has started its numbering over) returns False, and the files
+# have to be downloaded from the OLA.
+def fill_gap_locally(prevData, newData):
+    if not prevData.inString or newData.obsNum <= prevData.obsNum or newData.obsDateTime <= prevData.obsDateTime:
+        return False
+    fromLocal, absent = get_gap_index().missing(prevData.obsNum, prevData.obsDateTime,
+                                                newData.obsNum, newData.obsDateTime)
+    if absent:
+        numAbsent = sum(hi - lo + 1 for lo, hi in absent)
+        print(str(numAbsent) + " missing rows are not in any local file (seqNum " +
+              ", ".join(str(lo) if lo == hi else str(lo) + "-" + str(hi) for lo, hi in absent[:5]) +
+              ("..." if len(absent) > 5 else "") + ")", flush=True)
+        return False
+    try:
+        rows = []
+        for lo, hi, source in fromLocal:
+            found = rows_from_local_file(source, lo, hi, prevData.obsDateTime, newData.obsDateTime)
+            if len(found) != hi - lo + 1:
+                print("Expected seqNum " + str(lo) + "-" + str(hi) + " in " + source + " but found " +
+                      str(len(found)) + " of them", flush=True)
+                return False
+            rows.extend(found)
+        if rows and not settings.NO_LOGGING:
+            # the outbox is durable, so rows still waiting in it are not queued twice
+            waiting = outbox.waiting_seqnums(settings.SITE_ID, prevData.obsDateTime, newData.obsDateTime)
+            rows = [fdata for fdata in rows if fdata.obsNum not in waiting]
+            rows.sort(key=lambda fdata: fdata.obsNum)
+            outbox.enqueue_many([(settings.SITE_ID, fdata.obsDateTime, fdata.obsNum, make_post_data(fdata))
+                                 for fdata in rows])
+            uploader.wake()
+    except Exception as ex:
+        print("Exception filling gap from local files")
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(ex).__name__, ex.args)
+        print(message)
+        return False
+    print("Filled gap of " + str(newData.obsNum - prevData.obsNum - 1) + " rows without the OLA (" +
+          str(len(rows)) + " queued from local files)", flush=True)
+    return True
+
+# Rows with seqNum lo to hi from a logged or downloaded data file, between times after and before
+def rows_from_local_file(fn, lo, hi, after, before):
+    rows = []
+    f = open(fn, "rb")
+    f.seek(file_bisect.offset_after(fn, after, index_offset(fn, after)))
+    for fline in f:
+        fdata = parse_ola_line(fline)
+        if fdata is None:    # not a data line
+            continue
+        if fdata.obsDateTime >= before:
+            break
+        if fdata.obsDateTime > after and lo <= fdata.obsNum <= hi:
+            rows.append(fdata)
+    f.close()
+    return rows
+
 # writes data received through bluetooth to a logged data file (separate from downloaded files)
 def write_local_file(newData):
-    # write the data to a local file
-    
-    fn = config['dataHandler']['LOGGED_FILE_DIR']+"/" + datetime.today().strftime('%Y%m%d') + ".txt"
-    outfile = open(fn, "a")
-    outfile.write(newData.inString)
-    outfile.close()
+    # write the data to the day's local file
+    writer = get_logged_file_writer()
+    writer.write(newData.inString, newData.obsDateTime)
+    get_gap_index().add_local(newData.obsNum, newData.obsDateTime, writer.file_name(writer.day))
+    archive_observations([newData])
+
+
+# build the json body for one observation as expected by /write_measurement
+def make_post_data(newData, pressure=None):
+    # database access is through http "post" for example:
+    # https://api-sunnydayflood.cloudapps.unc.edu/write_water_level?key=jjRa6S550zvTxMF&place=Carolina%20Beach
+    #%2C%20North%20Carolina&sensor_id=CB_02&dttm=20210223050000&level=-.25&voltage=4.8&notes=test 
+    #
+    if pressure is None:
+        # Calibrate pressure value while writing to database
+        pressure = get_calibration().pressure(settings.SITE_ID, newData.obsDateTime, newData.press, newData.wtemp,
+                                              default_calibration())
+    post_data = { #OLD API 'key':config['dataHandler']['API_KEY'],
+                  'place':settings.PLACE,
+                  'sensor_ID':settings.SITE_ID,
+#OLD API                  'dttm':newData.obsDateTime.strftime('%Y%m%d%H%M%S'),
+                  'date':newData.obsDateTime.astimezone().isoformat(),
+                  'raw_pressure':newData.press,
+                  'pressure':pressure,
+                  'voltage':newData.battVolts,
+                  'seqNum':newData.obsNum,
+                  'aX':newData.aX,
+                  'aY':newData.aY,
+                  'aZ':newData.aZ,
+                  'wtemp':newData.wtemp,
+                  'notes':" " }
+    return post_data
 
 
 # write the observation to the cloud database
 def write_database(newData):
-    no_logging = config['dataHandler']['DB_URL'].lower().startswith('no')   # if operating without a database
-    numTries=0  #number of tries to post
-    MAX_TRIES = 2
+    no_logging = settings.NO_LOGGING   # if operating without a database
     
     if no_logging == True:
         success=True
     else:
-        # database access is through http "post" for example:
-        # https://api-sunnydayflood.cloudapps.unc.edu/write_water_level?key=jjRa6S550zvTxMF&place=Carolina%20Beach
-        #%2C%20North%20Carolina&sensor_id=CB_02&dttm=20210223050000&level=-.25&voltage=4.8&notes=test 
-        #
-        db_url = config['dataHandler']['DB_URL'] + "/write_measurement"
-#OLD API        db_url = config['dataHandler']['DB_URL'] + "/write_water_level"
-    #    db_url = config['dataHandler']['DB_URL'] + "/bite_water_level"     # for testing, this makes the write fail
-        post_data = { #OLD API 'key':config['dataHandler']['API_KEY'],
-                      'place':config['dataHandler']['PLACE'],
-                      'sensor_ID':config['dataHandler']['SITE_ID'],
-#OLD API                      'dttm':newData.obsDateTime.strftime('%Y%m%d%H%M%S'),
-                      'date':newData.obsDateTime.astimezone().isoformat(),
-
-                      # Calibrate pressure value while writing to database
-                      'raw_pressure':newData.press,
-                      'pressure':newData.press - float(config['dataHandler']['SENSOR_OFFSET']) - (float(config['dataHandler']['SENSOR_TEMP_FACTOR']) * newData.wtemp),
-                      'voltage':newData.battVolts,
-                      'seqNum':newData.obsNum,
-                      'aX':newData.aX,
-                      'aY':newData.aY,
-                      'aZ':newData.aZ,
-                      'wtemp':newData.wtemp,
-                      'notes':" " }
-#OLD API        xdata = urllib.parse.urlencode(post_data, quote_via=urllib.parse.quote)
-
-        while numTries < MAX_TRIES:
-            try:
-    #OLD API            r=requests.post(url=db_url, params=xdata, timeout=10)
-                r=requests.post(url=db_url, json=post_data, timeout=10, auth=(config['dataHandler']['API_USER'], config['dataHandler']['API_PASS']))
-                #old_print(r.url)
-                #old_print(r.text)
-                r.raise_for_status()    # throw an exception if the status is bad
-                success = True
-                break
-            except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
-                # In order to resync the database, check to see if the next sequence number is in the data files,
-                # if so try to put it in after the next observation.  If not, we might need to get the data files
-                # and use date to keep up-to-date
-                print("Exception posting to database.  Database out of sync.")
-                success = False
-                numTries = numTries + 1
-                if numTries < MAX_TRIES:
-                    print("Trying to post another time")
+        success = post_measurement(make_post_data(newData))
+        if success:
+            get_sync_cursor().advance(settings.SITE_ID, newData.obsDateTime, newData.obsNum)
+            record_uploaded([(newData.obsDateTime, newData.obsNum)])
+        else:
+            get_sync_cursor().mark_stale(settings.SITE_ID)
+    return success
+
+
+# post one already-built observation to the cloud database
+def post_measurement(post_data):
+    numTries=0  #number of tries to post
+    MAX_TRIES = 2
+    db_url = settings.DB_URL + "/write_measurement"
+#OLD API    db_url = config['dataHandler']['DB_URL'] + "/write_water_level"
+#    db_url = config['dataHandler']['DB_URL'] + "/bite_water_level"     # for testing, this makes the write fail
+#OLD API    xdata = urllib.parse.urlencode(post_data, quote_via=urllib.parse.quote)
+
+    while numTries < MAX_TRIES:
+        try:
+#OLD API            r=requests.post(url=db_url, params=xdata, timeout=10)
+            r=get_db_session().post(url=db_url, json=post_data, timeout=10)
+            #old_print(r.url)
+            #old_print(r.text)
+            r.raise_for_status()    # throw an exception if the status is bad
+            success = True
+            break
+        except Exception as ex:
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            print(message)
+            # In order to resync the database, check to see if the next sequence number is in the data files,
+            # if so try to put it in after the next observation.  If not, we might need to get the data files
+            # and use date to keep up-to-date
+            print("Exception posting to database.  Database out of sync.")
+            success = False
+            numTries = numTries + 1
+            if numTries < MAX_TRIES:
+                print("Trying to post another time")
               
     return success
 
 
+# write a list of observations to the cloud database in as few requests as possible.
+# Returns the number of observations (from the start of the list, in order) that
+# were written.  pressures, if given, are the already calibrated pressures.
+def write_database_batch(dataList, pressures=None):
+    no_logging = settings.NO_LOGGING   # if operating without a database
+    if no_logging:
+        return len(dataList)
+    if pressures is None:
+        pressures = [None] * len(dataList)
+    return post_measurements([make_post_data(d, p) for d, p in zip(dataList, pressures)])
+
+
+# post a list of already-built observations.  If the server rejects a batch,
+# the rows are posted one at a time.  Returns the number written, in order.
+def post_measurements(postList):
+    global batch_supported
+    if len(postList) == 0:
+        return 0
+
+    if batch_supported and len(postList) > 1:
+        db_url = settings.DB_URL + "/write_measurements"
+        try:
+            result = post_batch(get_db_session(), db_url, postList)
+        except Exception as ex:
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            print(message)
+            print("Exception posting batch to database.")
+            get_sync_cursor().mark_stale(settings.SITE_ID)
+            return 0    # no response at all - posting rows one by one will not do better
+        if result == BATCH_OK:
+            return len(postList)
+        if result == BATCH_UNSUPPORTED:
+            print("Server does not accept batches.  Posting one row at a time from now on.")
+            batch_supported = False
+        else:
+            print("Server rejected batch of " + str(len(postList)) + ".  Posting one row at a time.")
+
+    # per-row fallback
+    numWritten = 0
+    for post_data in postList:
+        if post_measurement(post_data) == False:
+            get_sync_cursor().mark_stale(settings.SITE_ID)
+            break
+        numWritten = numWritten + 1
+    return numWritten
+
+
+# Put the observation in the outbox for the uploader thread to send.  This never
+# waits on the network.  Returns False only if the outbox itself could not be written.
+def queue_for_database(newData):
+    no_logging = settings.NO_LOGGING   # if operating without a database
+    if no_logging:
+        return True
+    try:
+        outbox.enqueue(settings.SITE_ID, newData.obsDateTime, newData.obsNum, make_post_data(newData))
+    except Exception as ex:
+        print("Exception adding observation to the outbox.")
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(ex).__name__, ex.args)
+        print(message)
+        return False
+    if not uploader.is_alive():
+        print("The uploader has stopped.  Starting it again.")
+        start_uploader()
+    uploader.wake()
+    return True
+
+
+# Open the outbox and start the uploader thread that drains it (again if it has stopped)
+def start_uploader():
+    global outbox, uploader
+    if uploader is not None and uploader.is_alive():
+        return
+    outboxFile = settings.OUTBOX_FILE
+    get_gap_index()     # before the uploader thread needs them
+    get_uploaded_keys()
+    if outbox is None:
+        outbox = Outbox(outboxFile)
+    print("Outbox " + outboxFile + " has " + str(outbox.depth()) + " rows waiting.")
+    uploader = Uploader(outbox, post_measurements,
+                        batchSize=settings.DB_BATCH_SIZE,
+                        concurrency=settings.UPLOAD_WORKERS, log=print,
+                        on_ack=lambda sensorID, post_data: get_sync_cursor().advance(
+                            sensorID, datetime.fromisoformat(post_data['date']), post_data['seqNum']),
+                        on_ack_rows=record_acked_rows)
+    uploader.start()
+
+
+# Time (local) and seqNum of the newest observation in the database, or None if
+# that is not known.  Comes from the local sync cursor; the server is only asked
+# when the cursor is due to be checked (periodically and after upload errors).
+# If the server cannot be reached the cursor is used as it is.
+def get_latest_synced(caller):
+    siteID = settings.SITE_ID
+    cursor = get_sync_cursor()
+    if cursor.needs_reconcile(siteID):
+#OLD API        db_url = config['dataHandler']['DB_URL'] + "/latest_water_level"
+#        get_data = { 'key':config['dataHandler']['API_KEY'],
+#                     'sensor_id':config['dataHandler']['SITE_ID'] }
+        db_url = settings.DB_URL + "/get_latest_measurement"
+        get_data = { 'sensor_ID':siteID }
+        try:
+            rd = get_db_session().get(url=db_url, params=get_data, timeout=10)
+            print(rd.url)
+            print(rd.text)
+            rd.raise_for_status()
+            j = rd.json()
+            if j == [None]:
+                print("Server did not find a latest measurement for " + siteID)
+            else:
+#OLD API                lastDate = datetime.strptime(j[0]["date"], "%Y-%m-%d %H:%M:%S")
+                cursor.reconcile(siteID, server_time_to_local(j[0]["date"]), j[0]["seqNum"])
+        except Exception as ex:
+            print("Exception getting latest measurement during " + caller)
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            print(message)
+            if cursor.get(siteID) is not None:
+                print("Using the local sync cursor.")
+    return cursor.get(siteID)
+
+
 # If logging to the database got out of sync, we will try reading through the logged data files
 # to re-sync.
 def update_db_from_logged_files():
@@ -255,36 +616,14 @@ def update_db_from_logged_files():
     
     print("Attempting to catch database up from logged files.")
     
-#OLD API    db_url = config['dataHandler']['DB_URL'] + "/latest_water_level"
-#    get_data = { 'key':config['dataHandler']['API_KEY'],
-#                 'sensor_id':config['dataHandler']['SITE_ID'] }
-    db_url = config['dataHandler']['DB_URL'] + "/get_latest_measurement"
-    get_data = { 'sensor_ID':config['dataHandler']['SITE_ID'] }
-    try:
-#OLD API        rd = requests.get(url=db_url, params=get_data)
-        rd = requests.get(url=db_url, params=get_data, auth=(config['dataHandler']['API_USER'], config['dataHandler']['API_PASS']))
-        print(rd.url)
-        print(rd.text)
-        j = rd.json()
-    except Exception as ex:
-        try:
-            print("Exception getting latest measurement during update_db_from_logged_files")
-            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            print(message)
-            success = False
-            return success
-        except:
-            pass
-        
-#OLD API        lastDate = datetime.strptime(j[0]["date"], "%Y-%m-%d %H:%M:%S")
-    lastDate = datetime.strptime(j[0]["date"], "%Y-%m-%dT%H:%M:%S+00:00")
-    UTCtoEST = timedelta(hours=5)
-    lastDate = lastDate - UTCtoEST
+    latest = get_latest_synced("update_db_from_logged_files")
+    if latest is None:
+        print("Could not find the latest measurement.  Failed attempt to catch database up from logged files.")
+        return success
+    lastDate, lastSeqNum = latest
     print(lastDate)
-    lastSeqNum = j[0]["seqNum"]
     # get a list of logged files with this date or greater
-    flist = glob.glob(config['dataHandler']['LOGGED_FILE_DIR']+'/20??????.txt')
+    flist = glob.glob(settings.LOGGED_FILE_DIR+'/20??????.txt')
     flist.sort()   # sort the file list ascending
     for fn in flist:
         try:
@@ -297,9 +636,16 @@ def update_db_from_logged_files():
             # open the file and look for the first date that is greater
             # if that is tne next sequence number, insert it and loop to end
             # if not, we tried, we failed.  Will have to download files from OLA
-            f = open(fn, "rt")
+            # skip straight to the first line after lastDate
+            startOffset = file_bisect.offset_after(fn, lastDate+one_second, index_offset(fn, lastDate+one_second))
+            if startOffset > 0:
+                success = False     # older rows, which the line by line check would have rejected
+            f = open(fn, "rb")
+            f.seek(startOffset)
             for fline in f:
-                fdata = OLAdata(fline.encode("ascii", "ignore"))
+                fdata = parse_ola_line(fline)
+                if fdata is None:    # not a data line
+                    continue
                 if fdata.obsDateTime > (lastDate+one_second):
                     if fdata.obsNum == (lastSeqNum+1):
                         if write_database(fdata) == True:
@@ -325,10 +671,15 @@ def update_db_from_logged_files():
         print("\nFailed attempt to catch database up from logged files.")
     return success
 
+# The record of how far into each downloaded file the database has been caught up
+def open_upload_manifest():
+    return UploadManifest(settings.UPLOAD_MANIFEST_FILE)
+
+
 # If we recently downloaded data files and need to re-sync the data, we will
 # read through the data files to re-sync.
 def update_db_from_data_files():
-    no_logging = config['dataHandler']['DB_URL'].lower().startswith('no')   # if operating without a database
+    no_logging = settings.NO_LOGGING   # if operating without a database
     success = False
     one_second = timedelta(seconds=1)
     # This is a modification of update_db_from_logged_files.
@@ -343,82 +694,70 @@ def update_db_from_data_files():
         print("  NOT ACTUALLY LOGGING TO DATABASE  ")
         print()
     
-#OLD API    db_url = config['dataHandler']['DB_URL'] + "/latest_water_level"
-#    get_data = { 'key':config['dataHandler']['API_KEY'],
-#                 'sensor_id':config['dataHandler']['SITE_ID'] }
-    db_url = config['dataHandler']['DB_URL'] + "/get_latest_measurement"
-    get_data = { 'sensor_ID':config['dataHandler']['SITE_ID'] }
     if not no_logging:
-        try:
-#OLD API            rd=requests.get(url=db_url, params=get_data, timeout=10)
-            rd=requests.get(url=db_url, params=get_data, timeout=10, auth=(config['dataHandler']['API_USER'], config['dataHandler']['API_PASS']))
-            print(rd.url)
-            print(rd.text)
-            j = rd.json()
-            if j == [None]:
-                print(" ")
-                print("Server did not find a latest measurement for " + config['dataHandler']['SITE_ID'])
-                print("Could not update database.")
-                print(" ")
-                return prevData
-        except Exception as ex:
-            try: # suppress nested exceptions
-                print("Exception getting latest measurement during update_db_from_data_files")
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
-                success = False
-                return prevData
-            except:
-                pass
-            
-#OLD API        lastDate = datetime.strptime(j[0]["date"], "%Y-%m-%d %H:%M:%S")
-        lastDate = datetime.strptime(j[0]["date"], "%Y-%m-%dT%H:%M:%S+00:00")
-        UTCtoEST = timedelta(hours=5)
-        lastDate = lastDate - UTCtoEST
+        latest = get_latest_synced("update_db_from_data_files")
+        if latest is None:
+            print(" ")
+            print("No latest measurement for " + settings.SITE_ID)
+            print("Could not update database.")
+            print(" ")
+            return prevData
+        lastDate = latest[0]
     else:
         lastDate = datetime.now()-timedelta(days=1)
     print(lastDate)
 
+    # Rows newer than lastDate are written DB_BATCH_SIZE at a time
+    batchSize = max(1, settings.DB_BATCH_SIZE)
+
+    # The manifest remembers how far into each file we have already caught up
+    manifest = None
+    if not no_logging:
+        manifest = open_upload_manifest()
+
     # get a list of data files - since the dates in them are unknown, have to open them all
-    flist = glob.glob(config['dataHandler']['DOWNLOADED_FILE_DIR']+'/dataLog?????.TXT')
+    # (except the ones the manifest says are finished)
+    flist = glob.glob(settings.DOWNLOADED_FILE_DIR+'/dataLog?????.TXT')
     flist.sort()   # sort the file list ascending
-    for fn in flist:
-        # open the file and look for the first date that is greater
-        # ignoring seqNum going by date only. insert it and loop to end
+    if manifest is not None:
+        manifest.prune([os.path.basename(fn) for fn in flist])
+    for i, fn in enumerate(flist):
+        name = os.path.basename(fn)
+        st = os.stat(fn)
+        startOffset = 0
+        if manifest is not None:
+            startOffset = manifest.start_offset(name, st.st_size, st.st_mtime)
+            if startOffset is None:
+                success = True
+                continue    # nothing new in this one
+        # skip the rows that are not newer than what the database already has
+        startOffset = file_bisect.offset_after(fn, lastDate+one_second, startOffset)
+
+        # look for the rows with a date that is greater,
+        # ignoring seqNum going by date only. insert them
         # if not, we tried, we failed.  Will have to try again
-        f = open(fn, "rt")
-        while True: 	# a loop that we can break out of so that fline can be within the try
-            try:
-                fline = f.readline()
-                if not fline: # EOF
-                    success = True  # if we hit EOF, we have read all the files even if no data to send
-                    break
-                
-                fdata = OLAdata(fline.encode("ascii", "ignore"))           
-                if fdata.inString != '':    # if the line fails parsing we will skip it.
-                    if fdata.obsDateTime > (lastDate+one_second):
-                        if no_logging or write_database(fdata) == True:
-                            lastDate = fdata.obsDateTime
-                            prevData = fdata
-                            success = True
-                            print('Successfully wrote: ', end='')
-                            old_print(fdata.inString, end='', flush=True)
-                        else:
-                            success = False
-                            f.close()
-                            print("\nWrite database failed.  Failed attempt to catch database up from downloaded data files.")
-                            return prevData   # if we fail, get out and try again later
-                    else:
-                        success = False
-            except UnicodeDecodeError as ex:
-                print("Unicode decoding error: ", ex)
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                print(message)
-                continue	# to the next line
-                        
-        f.close()
+        newRows, lastDate, endOffset = new_rows_from_data_file(fn, lastDate, startOffset)
+        success = True  # we have read the whole file even if no data to send
+        lastWritten = None
+        while newRows:
+            batch = newRows[:batchSize]
+            del newRows[:batchSize]
+            prevData, numWritten = write_pending_rows(batch, prevData)
+            if numWritten > 0:
+                lastWritten = batch[numWritten-1]
+            if numWritten < len(batch):
+                if manifest is not None and lastWritten is not None:
+                    manifest.record(name, st.st_size, st.st_mtime, lastWritten[2], lastWritten[0].obsDateTime)
+                    manifest.save()
+                print("\nWrite database failed.  Failed attempt to catch database up from downloaded data files.")
+                return prevData   # if we fail, get out and try again later
+
+        if manifest is not None:
+            # The OLA only writes to its newest file, so an older one that we have read to the end is done
+            complete = (i < len(flist)-1) and (endOffset == st.st_size)
+            manifest.record(name, st.st_size, st.st_mtime, endOffset,
+                            lastWritten[0].obsDateTime if lastWritten else None, complete)
+            manifest.save()
             
     if success == True:
         print("\nSuccessfully caught database up using downloaded data files.")
@@ -427,8 +766,68 @@ def update_db_from_data_files():
     return prevData
 
 
+# Read one downloaded data file from byte position startOffset and return the rows
+# more than a second newer than lastDate (and newer than the rows before them)
+# as a list of (OLAdata, calibrated pressure, file offset at the end of the row),
+# along with the new lastDate and the offset just past the last complete line.
+# Uses the bulk loader when numpy is available.
+def new_rows_from_data_file(fn, lastDate, startOffset=0):
+    one_second = timedelta(seconds=1)
+    table = get_calibration()
+    default = default_calibration()
+    newRows = []
+
+    if ola_bulk is not None:
+        rows, endOffset, data = ola_bulk.load_data_file(fn, startOffset)
+        rows = rows[ola_bulk.newer_than(rows, lastDate, one_second)]
+        pressure = table.pressures(settings.SITE_ID, rows['time'], rows['press'], rows['wtemp'], default)
+        newRows = list(zip(ola_bulk.to_oladata(rows, data, startOffset), pressure.tolist(), rows['end'].tolist()))
+    else:
+        f = open(fn, "rb")
+        f.seek(startOffset)
+        endOffset = startOffset
+        newest = lastDate + one_second    # rows have to be later than this and than every row before them
+        for fline in f:
+            if not fline.endswith(b'\n'):
+                break   # partial last line - leave it for next time
+            endOffset = endOffset + len(fline)
+            fdata = parse_ola_line(fline)
+            if fdata is not None:    # if the line fails parsing we will skip it.
+                if fdata.obsDateTime > newest:
+                    newest = fdata.obsDateTime
+                    newRows.append((fdata, table.pressure(settings.SITE_ID, fdata.obsDateTime, fdata.press, fdata.wtemp, default),
+                                    endOffset))
+        f.close()
+
+    if newRows:
+        lastDate = newRows[-1][0].obsDateTime
+        archive_observations([row[0] for row in newRows])
+        index = get_gap_index()
+        for row in newRows:
+            index.add_local(row[0].obsNum, row[0].obsDateTime, fn)
+    return newRows, lastDate, endOffset
+
+
+# Write a batch of catch-up rows, (OLAdata, pressure, offset) tuples, to the database.
+# Returns the most recent row that made it into the database (or prevData if none
+# did) and how many of them were written.
+def write_pending_rows(batch, prevData):
+    numWritten = write_database_batch([row[0] for row in batch], [row[1] for row in batch])
+    for row in batch[:numWritten]:
+        print('Successfully wrote: ', end='')
+        old_print(row[0].inString, end='', flush=True)
+    if numWritten > 0:
+        prevData = batch[numWritten-1][0]
+        if not settings.NO_LOGGING:
+            get_sync_cursor().advance(settings.SITE_ID, prevData.obsDateTime, prevData.obsNum)
+            record_uploaded([(row[0].obsDateTime, row[0].obsNum) for row in batch[:numWritten]])
+    return prevData, numWritten
+
+
 # Command sequence to access the OLA and download the necessary data files.
-def download_data_files(ss):
+# If since is given (the last row before a gap), only files the OLA has written
+# to since then are downloaded.
+def download_data_files(ss, since=None):
 # Download any data files from the OLA that we dont have or are a different size
 # returns the most recent observation
 #
@@ -447,10 +846,10 @@ def download_data_files(ss):
 #
 
     prevData = OLAdata('')
-    fileDir = config['dataHandler']['DOWNLOADED_FILE_DIR']
+    fileDir = settings.DOWNLOADED_FILE_DIR
         
-    # Errors in the transmission of the OLA file list are costly. Try up to 5 times to get 
-    # two identical copies in a row before we call it a good transmission.
+    # Errors in the transmission of the OLA file list are costly.  Every entry has to be
+    # confirmed, by the last good listing or by a second read, before we use it.
     if get_OLA_menu(ss)==False:
         return prevData    # failed to get menu 
     try:
@@ -468,14 +867,11 @@ def download_data_files(ss):
     time.sleep(2)
 
     try:
-        ola_fdict = get_OLA_file_list(ss)   # the file list is sorted in date order
-        for i in range(5):
-            ola_fdict2= get_OLA_file_list(ss)
-            if ola_fdict == ola_fdict2: # good to go
-                break
-            if i==4:
-                return prevData    # we failed
-            ola_fdict = ola_fdict2
+        ola_listing = get_confirmed_OLA_file_list(ss)   # the file list is sorted in date order
+        if ola_listing is None:
+            return prevData    # we failed
+        ola_fdict = {name: size for name, (date, size) in ola_listing.items()}
+        ola_fdict2 = ola_fdict.copy()
     except Exception as ex:
         print("Exception waiting for ZModem menu")
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
@@ -486,6 +882,10 @@ def download_data_files(ss):
         exit_zmodem(ss)
         return prevData
 
+    # The OLA is only writing to the newest file in its list.  When we already have the
+    # start of it, only the part added since then is transferred (and later uploaded).
+    activeFile = list(ola_fdict.keys())[-1] if ola_fdict else None
+
 
     # The next two lines get the local file list and sorts them in date order
     os.chdir(fileDir)
@@ -505,7 +905,7 @@ def download_data_files(ss):
     # remaining less than the latest local file,
     # the file numbers might have reset (or some other problem has happened).
     # Archive all the files that we have before we download the list.
-    if len(flist)>0 and list(ola_fdict.keys())[0] < flist[-1]:    # because the filenames are identical except for number, they can be compared
+    if ola_fdict and len(flist)>0 and list(ola_fdict.keys())[0] < flist[-1]:    # because the filenames are identical except for number, they can be compared
         print('WARNING: Archiving data files due to repeat download of finished file. (New OLA? File numbers reset?)')
         archive_dir = fileDir + '/Archived-' + datetime.today().strftime('%Y%m%d%H%M%S')
         os.chdir(fileDir)    # need to be here for zmodem receive
@@ -519,18 +919,46 @@ def download_data_files(ss):
     for fn in k.keys():
         if fn > list(ola_fdict.keys())[-1]:
             ola_fdict.pop(fn, None)
+
+    # For a gap, files last written before it started cannot have any of it.  The
+    # listing is to the minute, so allow one.  Anything else missing is picked up
+    # by the next full download (at startup).
+    if since is not None:
+        cutoff = (since - timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')
+        older = [fn for fn in ola_fdict if ola_listing[fn][0] < cutoff]
+        for fn in older:
+            ola_fdict.pop(fn, None)
+        if older:
+            print("Gap since " + str(since) + ": skipping " + str(len(older)) + " older OLA files", flush=True)
     
+    # Rows go to the outbox as the files land on disk, starting with what we already
+    # have, while later files are still transferring
+    pipeline, catchup = start_catchup_pipeline(activeFile)
+    on_progress = pipeline.notify if pipeline is not None else None
+
     # Send the files in ola_fdict
     try:
         for fn in ola_fdict:
-            print("Sending: " + fn, flush=True)
+            localSize = os.path.getsize(fn) if os.path.isfile(fn) else 0
+            if fn == activeFile and 0 < localSize < ola_fdict[fn]:
+                print("Tail sync of active file " + fn + ": " + str(ola_fdict[fn] - localSize) +
+                      " new bytes after byte " + str(localSize), flush=True)
+            else:
+                print("Sending: " + fn, flush=True)
             time.sleep(1)
             ss.sendline('sz '+ fn)
             time.sleep(1)
-            result = os.system("rz -r -U > /dev/rfcomm0 < /dev/rfcomm0")
-            # result>>8 gives the exit status pf the process.  If the file transfer fails, get out
-            if (result >> 8) != 0:
-                break
+            # receive on the open port (resuming a partial file, like rz -r)
+            receiver = zmodem.ZModemReceiver(ser, fileDir, log=print, on_progress=on_progress)
+            received = receiver.receive()
+            for r in receiver.files:
+                if pipeline is None and localSize > 0 and r['start'] < localSize:
+                    # what we had was not the start of this file - upload it from the beginning
+                    manifest = open_upload_manifest()
+                    manifest.forget(r['name'])
+                    manifest.save()
+            if not received:
+                break   # If the file transfer fails, get out
     except Exception as ex:
         print("Exception during file transfer")
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
@@ -539,6 +967,8 @@ def download_data_files(ss):
         print("debug information:")
         print(str(ss))
         print(ss.before)
+        if pipeline is not None:
+            pipeline.finish()
         return prevData
         
     # At this point ola_fdict2 has the files that are already downloaded.  Delete files
@@ -548,6 +978,13 @@ def download_data_files(ss):
     if flist:
         delete_excess_OLA_files(ss, ola_fdict2, flist[-1])
     
+    if pipeline is not None:
+        # everything new is in the outbox and the uploader takes it from here, so we
+        # can leave the ZModem menu without missing the next sample
+        pipeline.finish()
+        exit_zmodem(ss)
+        return catchup['prevData']
+
     # update the database with the new data and set prevData to most recent
     prevData = update_db_from_data_files()
     # would be better if we could exit zmodem before the previous step, but doing
@@ -556,9 +993,93 @@ def download_data_files(ss):
     return prevData
 
 
+# Start the parse stage of the download pipeline, and give it the files we
+# already have.  Returns (pipeline, catchup state), or (None, None) when rows
+# cannot go through the outbox (no database, or nothing known about what it has).
+def start_catchup_pipeline(activeFile):
+    if uploader is None:
+        return None, None
+    latest = get_latest_synced("download_data_files")
+    if latest is None:
+        return None, None
+    catchup = {'lastDate': latest[0],
+               'prevData': OLAdata(''),
+               'manifest': open_upload_manifest(),
+               'activeFile': activeFile}
+    pipeline = CatchupPipeline(lambda fn, final, restart: queue_rows_from_data_file(fn, final, restart, catchup), log=print)
+    pipeline.start()
+    flist = glob.glob(settings.DOWNLOADED_FILE_DIR+'/dataLog?????.TXT')
+    flist.sort()
+    catchup['manifest'].prune([os.path.basename(fn) for fn in flist])
+    for fn in flist:
+        pipeline.notify(fn, True)
+    return pipeline, catchup
+
+
+# Parse stage of the download pipeline, run on the pipeline thread each time a
+# data file has new bytes on disk.  Rows newer than the database that have not
+# been read before go into the outbox.  Returns how many.
+def queue_rows_from_data_file(fn, final, restart, catchup):
+    manifest = catchup['manifest']
+    name = os.path.basename(fn)
+    if restart:
+        manifest.forget(name)   # what we had was not the start of this file
+    st = os.stat(fn)
+    startOffset = manifest.start_offset(name, st.st_size, st.st_mtime)
+    if startOffset is None:
+        return 0
+    startOffset = file_bisect.offset_after(fn, catchup['lastDate']+timedelta(seconds=1), startOffset)
+    newRows, lastDate, endOffset = new_rows_from_data_file(fn, catchup['lastDate'], startOffset)
+    catchup['lastDate'] = max(catchup['lastDate'], lastDate)
+    toQueue = []
+    if newRows:
+        # the live rows are queued as they arrive, and they are in the active file too
+        waiting = outbox.waiting_seqnums(settings.SITE_ID, newRows[0][0].obsDateTime - timedelta(seconds=1),
+                                         newRows[-1][0].obsDateTime + timedelta(seconds=1))
+        toQueue = [(fdata, pressure) for fdata, pressure, end in newRows if fdata.obsNum not in waiting]
+        outbox.enqueue_many([(settings.SITE_ID, fdata.obsDateTime, fdata.obsNum, make_post_data(fdata, pressure))
+                             for fdata, pressure in toQueue])
+        uploader.wake()
+        newest = newRows[-1][0]
+        if not catchup['prevData'].inString or newest.obsDateTime > catchup['prevData'].obsDateTime:
+            catchup['prevData'] = newest
+    # The OLA only writes to its active file, so any other one that we have read to the end is done
+    complete = final and name != catchup['activeFile'] and endOffset == st.st_size
+    manifest.record(name, st.st_size, st.st_mtime, endOffset,
+                    newRows[-1][0].obsDateTime if newRows else None, complete)
+    manifest.save()
+    return len(toQueue)
+
+
+# Read the OLA file list until every entry in it is confirmed, either by the last good
+# listing (saved in OLA_LISTING_FILE) or by coming out the same in two reads in a row.
+# Usually only the active file has changed and one read is enough.  Gives up after 6 reads.
+# Returns a dictionary of files and (date, size) sorted in date order, or None.
+def get_confirmed_OLA_file_list(ss):
+    snapshot = ListingSnapshot(settings.OLA_LISTING_FILE)
+    listing = read_OLA_listing(ss)
+    previous = None
+    for i in range(6):
+        unconfirmed = snapshot.unconfirmed(listing, previous, settings.MAX_FILES_ON_OLA)
+        if not unconfirmed:
+            snapshot.update(listing)
+            return listing
+        print(str(len(unconfirmed)) + " OLA file list entries need checking (" + ", ".join(unconfirmed[:5]) +
+              ("..." if len(unconfirmed) > 5 else "") + ").  Reading the list again.")
+        if i < 5:
+            previous = listing
+            listing = read_OLA_listing(ss)
+    return None
+
+
 # Procedure for retrieving the list of files on the OLA
 def get_OLA_file_list(ss):
 # get a dictionary of files and file sizes from the OLA sorted in date order
+    return {name: size for name, (date, size) in read_OLA_listing(ss).items()}
+
+
+# get a dictionary of files and (date, size) from the OLA sorted in date order
+def read_OLA_listing(ss):
     fileDict = {}    # declare empty dictionary
     dtDict = {}
     
@@ -576,7 +1097,7 @@ def get_OLA_file_list(ss):
             if ll.find(b'dataLog') != -1:
                 lls = ll.split()
                 dtDict.update({ lls[3].decode() : datetime.strptime(lls[0].decode()+" "+lls[1].decode(), '%Y-%m-%d %H:%M')})
-                fileDict.update({ lls[3].decode() : int(lls[2]) })
+                fileDict.update({ lls[3].decode() : (dtDict[lls[3].decode()].strftime('%Y-%m-%d %H:%M'), int(lls[2])) })
         fileDict = {k:v for k,v in sorted(fileDict.items(), key=lambda x : dtDict[x[0]] )}
     except Exception as ex:
         raise ex
@@ -586,25 +1107,22 @@ def get_OLA_file_list(ss):
 
 
 # Delete files with numbers less than the (current filenum)-(MAX_FILES_ON_OLA).
+# Deleting is done in bulk, and only once DELETE_MIN_BACKLOG files have piled up,
+# so most visits to the menu don't spend any time on it.
 def delete_excess_OLA_files(ss, ola_fdict_candidates, current_file):
-    delThroughFn = subtract_from_filename(current_file, config['dataHandler']['MAX_FILES_ON_OLA'])
-
-    if delThroughFn != "fnError":
-        for fn in ola_fdict_candidates:
-            if fn <= delThroughFn:
-                try:
-                    print("Deleting OLA file " + fn, flush=True)
-                    ss.sendline('del ' + fn)
-                    ss.expect('deleted', timeout=10)
-                    time.sleep(1)
-                except Exception as ex:
-                    print("Exception while deleting old OLA files")
-                    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                    message = template.format(type(ex).__name__, ex.args)
-                    print(message)
-                    print("debug information:")
-                    print(str(ss))   
-    return  # no return value - either it worked or we will try again next time
+    delThroughFn = subtract_from_filename(current_file, settings.MAX_FILES_ON_OLA)
+    if delThroughFn == "fnError":
+        return
+
+    names = [fn for fn in ola_fdict_candidates if fn <= delThroughFn]
+    if len(names) < settings.DELETE_MIN_BACKLOG:
+        return
+    print("Deleting " + str(len(names)) + " OLA files through " + delThroughFn, flush=True)
+    deleted, failed = ola_delete.bulk_delete(ss, names, log=print)
+    if failed:
+        print("debug information:")
+        print(str(ss))
+    return  # no return value - whatever was not deleted will be tried again next time
 
 
 # Subtracts a number from a filename containing a number,
@@ -652,6 +1170,9 @@ def exit_zmodem(ss):
 # otherwise it will hammer on the OLA until it wakes up for the next observation.
 def get_OLA_menu(ss):
     count=0
+    startTime = time.time()
+    how = 'awake'       # until the first try fails
+    window = None
     try:
         ss.sendline(' ')    # before print to be fast
     except Exception:       # and handle any exceptions below
@@ -660,19 +1181,36 @@ def get_OLA_menu(ss):
     found=1    # will become 0 when found
     while found==1:
         try:
-            if count > 40:
-                ss.sendline('x')    # in case we need to drop out of the sd card menu
-                count=0
+            if how == 'awake' and count > 0:
+                # The OLA is asleep.  If we know when it next wakes, wait for that quietly
+                # (or for it to send something) and then ask quickly through the window.
+                window = wake_scheduler.next_window()
+                if window is None:
+                    how = 'hammer'
+                else:
+                    how = 'hit'
+                    old_print(".", flush=True)
+                    print("Waiting " + str(round(max(0, window[0] - time.time()), 1)) + " s for the OLA to wake")
+                    while time.time() < window[0]:
+                        if serial_wait.wait_readable(ser, window[0] - time.time()):
+                            break   # it is talking already
+            if how == 'hit' and time.time() > window[1]:
+                how = 'miss'
+                old_print(".", flush=True)
+                print("Missed the wake window - falling back to asking every 0.3 s")
+            if how != 'hit':
+                if count > 40:
+                    ss.sendline('x')    # in case we need to drop out of the sd card menu
+                    count=0
+                count=count+1
             ss.sendline(' ')
-            found=ss.expect(['Menu: Main Menu', pexpect.TIMEOUT], timeout=0.3)
-            count=count+1
+            found=ss.expect(['Menu: Main Menu', pexpect.TIMEOUT], timeout=SEND_INTERVAL if how == 'hit' else 0.3)
             
         except pexpect.exceptions.EOF as e:
             old_print(".", flush=True)
             print("Caught EOF error - waiting for port to re-appear")
             ser.close()
-            while not exists('/dev/rfcomm0'):
-                time.sleep(3)
+            serial_wait.wait_for_device('/dev/rfcomm0')
             ss = reconnect()
             time.sleep(1)
             continue
@@ -685,9 +1223,12 @@ def get_OLA_menu(ss):
             print("debug information:")
             print(str(ss))
             return False  # if we get an exception we are done
-        old_print(".", end='', flush=True)
+        if how != 'hit':
+            old_print(".", end='', flush=True)
     old_print(".", flush=True)
-    print("Found Main Menu")
+    wake_scheduler.record(how, time.time() - startTime)
+    print("Found Main Menu in " + str(round(time.time() - startTime, 1)) + " s (" + how + "); " +
+          wake_scheduler.summary())
     time.sleep(1)
     return True
 
@@ -723,6 +1264,7 @@ def reconnect():
     return fdpexpect.fdspawn(ser, maxread=65536)            
             
 def main():
+    global reload_requested
     newData = OLAdata('')       # initialize empty
     prevData= OLAdata('')
     keepPrevData = True         # init to true so first loop doesn't overwrite prevData
@@ -730,12 +1272,11 @@ def main():
     BT_ERROR = False
     was_bt_err = False
     want_file_download = True
-    RESTLESS = 0.0001   # sleep time in seconds (RasPi 4 will sleep about .0002 for its minimum)
-    MELLOW = 1
-    sleep_time = RESTLESS
+    gap_since = None            # time of the last row before a gap, to download only the files after it
+    IDLE_WAIT = 1       # longest time in seconds to wait for serial data before checking the timers
     data_delay_start_time = time.time() # time how long since data in case we are stuck in the file transfer menu
-    MAX_DATA_DELAY = config['dataHandler']['MAX_DATA_DELAY']
-    no_logging = config['dataHandler']['DB_URL'].lower().startswith('no')
+    if not settings.NO_LOGGING:
+        start_uploader()
     ss = fdpexpect.fdspawn(ser, maxread=65536)    # set up to use ss with pexpect
     #ss.logfile = sys.stdout.buffer     # enable this line to see the output (python3)
     firstTime = True
@@ -754,7 +1295,7 @@ def main():
                     print("Closing serial port.", flush=True)
                     ser.close()
                     time.sleep(3) # these used to be 10 s each.
-                if exists('/dev/rfcomm0'):
+                if serial_wait.wait_for_device('/dev/rfcomm0', 3):
                     ss=reconnect()
                     time.sleep(3)
             except:
@@ -779,26 +1320,26 @@ def main():
             continue    # Start the loop over and wait for port to re-appear
         
         
-        # If we need the menu, we have to be fast.  Sleep time will be set to minimum, and as soon
-        # as we see the first character show up, we try sending a char.  Maybe,
+        # If we need the menu, we have to be fast.  We wait on the port in the kernel (poll) so
+        # we wake up as soon as the first character shows up, and we try sending a char.  Maybe,
         # if we are fast enough that will get into the menu without hammering on bluetooth.
-        # At 115200, chars come every ~.0001 s: min resolution on the pi is about .0002.
+        # At 115200, chars come every ~.0001 s.
         # If this fails, we will be in the regular get_OLA_menu routine that hammers on bluetooth
         # until it succeeds.
         #
         if nchars > 0:
             data_delay_start_time = time.time() # we received something so reset the timer
             if want_file_download == True:
-                prevData = download_data_files(ss)
+                prevData = download_data_files(ss, gap_since)
                 data_delay_start_time = time.time() # this could have taken a long time
                 keepPrevData = True    # keep us from overwriting prevData
-                sleep_time = MELLOW
                 print('prevData set to: ', end='')
                 if not prevData.inString:
                     want_file_download = True
                     old_print('(null)')
                 else:
                     want_file_download = False
+                    gap_since = None
                     old_print(prevData.inString, end='', flush=True)
                 continue
             try:
@@ -824,24 +1365,45 @@ def main():
                 continue    # don't sleep if we have a lot of lines to get rid of
             else:
                 keepPrevData = False
+                if ser.in_waiting == 0:     # only time the newest line; one that sat in the buffer arrived late
+                    wake_scheduler.observe(newData.obsDateTime, newData.obsNum)
                 check_clock(newData, ss)    # just received this - clock should be current
-                if check_sequential(newData, prevData)==False:
+                sequential = check_sequential(newData, prevData)
+                if sequential==False and fill_gap_locally(prevData, newData)==True:
+                    sequential = True   # the rows in between are in the database or on their way
+                if sequential==False:
                     print('Sequence number not sequential. Downloading data files to catch up.', flush=True)
                     want_file_download = True
-                    sleep_time = RESTLESS
+                    if prevData.inString and gap_since is None:
+                        gap_since = prevData.obsDateTime
                     keepPrevData = True  # whether it really failed or not, we want to keep prevData
-                if check_sequential(newData, prevData)==True:  # check again, not else
+                if sequential==True:  # check again, not else
                     write_local_file(newData)
-                    if DB_OUT_OF_SYNC == True:     # this can happen if the db write fails
+                    if DB_OUT_OF_SYNC == True:     # this can happen if the outbox could not be written
                         if update_db_from_logged_files() == True:
                             DB_OUT_OF_SYNC = False
                     if DB_OUT_OF_SYNC == False:    # check again - don't use else!
-                        # write the incoming data to local file and database
-                        DB_OUT_OF_SYNC = not write_database(newData)
+                        # queue the incoming data for the uploader thread
+                        DB_OUT_OF_SYNC = not queue_for_database(newData)
         
-        # no chars
-        time.sleep(sleep_time)
-        if time.time() - data_delay_start_time > float(MAX_DATA_DELAY):
+        # no chars - sleep until some arrive
+        serial_wait.wait_readable(ser, IDLE_WAIT)
+        if logged_file_writer is not None:
+            logged_file_writer.sync_if_due()
+        if obs_archive_writer is not None:
+            obs_archive_writer.flush_if_due()
+        if gap_index is not None:
+            gap_index.save_if_due()
+        if uploaded_keys is not None:
+            uploaded_keys.save_if_due()
+        if sync_cursor is not None:
+            sync_cursor.save_if_due()
+        if reload_requested or config_watch.changed():
+            reload_requested = False
+            reload_settings()
+        elif calibration_watch is not None and calibration_watch.changed():
+            reload_calibration()
+        if time.time() - data_delay_start_time > settings.MAX_DATA_DELAY:
             exit_zmodem(ss)
             data_delay_start_time = time.time()
 
@@ -850,11 +1412,30 @@ if __name__ == "__main__":
 
     while True:
         try:
-            config = ConfigObj("/home/pi/bin/config.ini")  # Read the config file (current directory)
+            settings = load_settings(CONFIG_FILE)     # Read and check the config file
+            config_watch = ConfigWatch(CONFIG_FILE)
+            calibration = None          # read on first use, with the (possibly new) CALIBRATION_FILE
+            calibration_watch = None
+            db_session = None   # rebuilt on first use with the (possibly new) credentials
+            if sync_cursor is not None:
+                sync_cursor.save()
+            sync_cursor = None
+            if logged_file_writer is not None:
+                logged_file_writer.close()  # reopened on first use, LOGGED_FILE_DIR may have changed
+            logged_file_writer = None
+            if obs_archive_writer is not None:
+                obs_archive_writer.flush()
+            obs_archive_writer = None
+            if gap_index is not None:
+                gap_index.save()    # reopened on first use, GAP_INDEX_FILE may have changed
+            gap_index = None
+            if uploaded_keys is not None:
+                uploaded_keys.save()
+            uploaded_keys = None
             
             # catch some signals and perform an orderly shutdown
             signal.signal(signal.SIGTERM, signal_handler)
-            signal.signal(signal.SIGHUP, signal_handler)
+            signal.signal(signal.SIGHUP, request_reload)     # re-read config.ini
             signal.signal(signal.SIGINT, signal_handler)
             signal.signal(signal.SIGQUIT, signal_handler)
             signal.signal(signal.SIGILL, signal_handler)
@@ -864,9 +1445,8 @@ if __name__ == "__main__":
             
             device_file = '/dev/rfcomm0'
             print('Attempting to open ' + device_file, end='')
-            while not exists(device_file):
+            while not serial_wait.wait_for_device(device_file, 3):
                 old_print('.', end='')
-                time.sleep(3)
             old_print(' ')
                 
             ser = serial.Serial(device_file, 115200, timeout=3) # changed timeout from 1 to 3 on 20220711
@@ -0,0 +1,57 @@
+#
+# Database client
+#
+# Shared HTTP plumbing for talking to the SunnyD database API.
+# A single requests.Session is kept for the life of the program so that
+# the DNS lookup, TCP connect and TLS handshake are paid once and the
+# connection is reused for every observation (keep-alive).  This matters
+# over the cellular link where a fresh handshake costs several hundred ms.
+#
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Number of pooled connections to keep per host.  We only talk to one host,
+# but the uploader may have a few requests in flight at once.
+POOL_SIZE = 4
+
+# Retry policy for the transport layer only.  Connection failures (including
+# a pooled socket that the server or the cell network has silently dropped)
+# are retried with a fresh connection.  Read timeouts and bad status codes are
+# NOT retried here - the callers have their own retry and out-of-sync logic.
+RETRY_POLICY = Retry(total=3, connect=3, read=0, redirect=0, status=0,
+                     backoff_factor=0.5, raise_on_status=False)
+
+
+# Build a session with a keep-alive connection pool.  urllib3 checks whether
+# a pooled connection has been dropped before reusing it, and reconnects if so.
+def make_db_session(auth=None, pool_size=POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=RETRY_POLICY, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    if auth is not None:
+        session.auth = auth
+    return session
+
+
+# Results of post_batch
+BATCH_OK = 0            # every row in the batch was accepted
+BATCH_REJECTED = 1      # the server answered but refused the batch
+BATCH_UNSUPPORTED = 2   # the server has no batch endpoint (or does not allow POST to it)
+
+# Post a list of measurement dictionaries (the same shape as sent to
+# /write_measurement) to the batch endpoint in a single request.
+# Connection problems and timeouts are raised to the caller; an answer from the
+# server is classified so the caller can decide whether to fall back to posting
+# one row at a time.
+def post_batch(session, db_url, rows, timeout=30):
+    r = session.post(url=db_url, json=rows, timeout=timeout)
+    if r.status_code in (404, 405, 501):
+        return BATCH_UNSUPPORTED
+    if r.status_code >= 400:
+        return BATCH_REJECTED
+    return BATCH_OK
@@ -0,0 +1,145 @@
+#
+# Database stand-in
+#
+# A small local HTTP server that answers the same requests as the SunnyD
+# database API so that uploads can be tested without a network connection.
+#
+#   /write_measurement       POST one measurement (json dictionary)
+#   /write_measurements      POST a list of measurements in one request
+#   /get_latest_measurement  GET ?sensor_ID=XX_00 returns the newest row
+#
+# Duplicate rows (same sensor_ID and date) are ignored the way the real
+# database ignores them.  Credentials are accepted but not checked.
+#
+# Usage:
+#   python3 db_standin.py [--port 8080] [--db file.sqlite] [--no-batch] [--reject-every N]
+# then set DB_URL = http://localhost:8080 in config.ini
+#
+
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class MeasurementStore:
+    def __init__(self, dbFile=':memory:'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbFile, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS measurement ('
+                        ' sensor_ID TEXT, date_utc TEXT, seqNum INTEGER, body TEXT,'
+                        ' PRIMARY KEY (sensor_ID, date_utc))')
+        self.db.commit()
+        self.numRequests = 0
+
+    # insert rows, ignoring duplicates.  Raises ValueError on a malformed row.
+    def insert(self, rows):
+        parsed = []
+        for row in rows:
+            dt = datetime.fromisoformat(row['date'])
+            if dt.tzinfo is None:
+                dt = dt.astimezone()
+            dateUTC = dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+            parsed.append((row['sensor_ID'], dateUTC, int(row['seqNum']), json.dumps(row)))
+        with self.lock:
+            self.db.executemany('INSERT OR IGNORE INTO measurement VALUES (?,?,?,?)', parsed)
+            self.db.commit()
+
+    def latest(self, sensorID):
+        with self.lock:
+            row = self.db.execute('SELECT date_utc, seqNum FROM measurement WHERE sensor_ID=?'
+                                  ' ORDER BY date_utc DESC LIMIT 1', (sensorID,)).fetchone()
+        if row is None:
+            return [None]
+        return [{'sensor_ID': sensorID, 'date': row[0], 'seqNum': row[1]}]
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM measurement').fetchone()[0]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real server
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    store = None
+    allowBatch = True
+    rejectEvery = 0                 # reject every Nth write request (0 = never)
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/get_latest_measurement':
+            sensorID = parse_qs(url.query).get('sensor_ID', [''])[0]
+            self.reply(200, self.store.latest(sensorID))
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            self.reply(400, {'error': 'bad json'})
+            return
+
+        if url.path == '/write_measurement':
+            rows = [body]
+        elif url.path == '/write_measurements' and self.allowBatch:
+            rows = body
+        else:
+            self.reply(404, {'error': 'not found'})
+            return
+
+        self.store.numRequests = self.store.numRequests + 1
+        if self.rejectEvery and self.store.numRequests % self.rejectEvery == 0:
+            self.reply(500, {'error': 'rejected for testing'})
+            return
+        try:
+            self.store.insert(rows)
+        except (KeyError, TypeError, ValueError) as ex:
+            self.reply(422, {'error': repr(ex)})
+            return
+        self.reply(200, {'written': len(rows)})
+
+    def log_message(self, format, *args):
+        pass    # one line per request would swamp the output during a catch-up
+
+
+# Start a stand-in server in a background thread.  Returns the server; call
+# server.shutdown() to stop it.  Port 0 picks a free port (server.server_port).
+def start_standin(port=0, dbFile=':memory:', allowBatch=True, rejectEvery=0):
+    handler = type('Handler', (StandinHandler,), {'store': MeasurementStore(dbFile),
+                                                 'allowBatch': allowBatch,
+                                                 'rejectEvery': rejectEvery})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.store = handler.store
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the SunnyD database API')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db', default=':memory:', help='sqlite file to keep rows in (default: memory only)')
+    parser.add_argument('--no-batch', action='store_true', help='answer 404 to /write_measurements')
+    parser.add_argument('--reject-every', type=int, default=0, help='fail every Nth write request')
+    args = parser.parse_args()
+
+    server = start_standin(args.port, args.db, not args.no_batch, args.reject_every)
+    print('Database stand-in listening on http://127.0.0.1:' + str(server.server_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(str(server.store.count()) + ' measurements stored')
+        server.shutdown()
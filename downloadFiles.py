@@ -8,6 +8,20 @@
 #
 # Written Oct 2024 by Tony Whipple
 #
+# Which files to get comes from the command line, or from the OLA's own file list:
+#   python3 downloadFiles.py --range 80 266        files dataLog00080.TXT to dataLog00266.TXT
+#   python3 downloadFiles.py --files dataLog00080.TXT dataLog00093.TXT
+#   python3 downloadFiles.py                       everything in the OLA file list
+# Add --listing to --range or --files to also read the OLA file list for the sizes
+# (and leave out files that are not on the OLA).
+#
+# Progress is kept in a state file (--state, see download_state.py): which files
+# are done, how much of the others is on disk and how often they have failed.  A
+# restarted download carries on from there, partial files are resumed, and a file
+# that keeps failing is put behind the others instead of being retried forever
+# (--max-failures N gives up on it after N failures in a row).  The program
+# exits when every file is done.
+#
 
 import serial
 import pexpect
@@ -24,14 +38,16 @@ import glob
 from datetime import datetime
 from datetime import timedelta
 from configobj import ConfigObj
+from ola_data import OLAdata
+import serial_wait
+import zmodem
 import traceback
+import argparse
+from download_state import DownloadState
 
-
-# 
-# SET THESE UP BEFORE RUNNING
-#
-startFile = 80
-endFile = 266
+# Leave the ZModem menu after this many files in a row got nothing through, and
+# try again when the OLA next wakes up
+MAX_FAILED_IN_A_ROW = 3
 
 
 
@@ -57,44 +73,6 @@ def signal_handler(sig, frame):
     sys.exit(0)
     
 
-# Class to contain the OLA data.  Attempts to parse the data.
-# If parsing fails, self.inString will be set to empty    
-class OLAdata:
-    def __init__(self, inData):
-        self.obsNum=-999
-        if inData=='':
-            self.inString=''
-        else:
-            # Parse the incoming data into vars if it looks like data
-            self.inString = inData.decode()
-            self.parseData()
-
-    # If the inData look like real data populate the variables
-    # otherwise leave them uninitialized.
-    
-#   This version of parseData is for the Bar02 sensor
-    def parseData(self):
-        l = self.inString.split(',')
-        if len(l)==11:     # num elements+1, split makes a token out of the trailing crlf
-            # If any exception, clear the input.  If it was a bad transmission
-            # the check sequential step should catch it.
-            try:
-                self.obsDateTime = datetime.strptime(l[0]+' '+l[1], "%m/%d/%Y %H:%M:%S.%f")
-                self.battVolts = float(l[2])
-                self.aX = float(l[3])
-                self.aY = float(l[4])
-                self.aZ = float(l[5])
-                self.temp = float(l[6])
-                self.press = float(l[7])
-                self.wtemp = float(l[8])
-                self.obsNum = int(l[9])
-                #print(vars(self))
-            except:
-                self.inString = ''# Clear inString if this fails parsing
-        else:
-            self.inString = ''    # Clear inString if this fails parsing
-            
-
 # Command sequence to access the OLA and download the necessary data files.
 def download_data_files(ss):
 # Download any data files from the OLA that we dont have or are a different size
@@ -113,13 +91,11 @@ def download_data_files(ss):
 # put a huge load on the batteries of the sensor.  Therefore I am changing the algorithm
 # to be for only files with a number less than or equal the current file number.
 #
-    global startFile
+    global listing_read
     
     prevData = OLAdata('')
     fileDir = config['dataHandler']['DOWNLOADED_FILE_DIR']
         
-    # Errors in the transmission of the OLA file list are costly. Try up to 5 times to get 
-    # two identical copies in a row before we call it a good transmission.
     if get_OLA_menu(ss)==False:
         return prevData    # failed to get menu 
     try:
@@ -136,42 +112,56 @@ def download_data_files(ss):
         return prevData
     time.sleep(2)
 
-    try:
-        ola_fdict = get_OLA_file_list(ss)   # the file list is sorted in date order
-    except Exception as ex:
-        print("Exception waiting for ZModem menu")
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        message = template.format(type(ex).__name__, ex.args)
-        print(message)
-        print("debug information:")
-        print(str(ss))
-        exit_zmodem(ss)
-        return prevData
+    # The OLA file list is only read once (it takes a while over a bad link)
+    if args.listing and not listing_read:
+        try:
+            listing = get_OLA_file_list(ss)
+        except Exception as ex:
+            print("Exception reading the OLA file list")
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            print(message)
+            print("debug information:")
+            print(str(ss))
+            exit_zmodem(ss)
+            return prevData
+        names = wanted_files()
+        if names is None:
+            names = list(listing.keys())
+        names = [fn for fn in names if fn in listing]   # anything else is not on the OLA
+        state.drop([fn for fn, entry in state.files.items() if fn not in listing and not entry['done']])
+        state.add(names, {fn: size for fn, (date, size) in listing.items()})
+        state.save()
+        listing_read = True
+        print("OLA file list read.  " + state.summary(), flush=True)
 
+    os.chdir(fileDir)    # need to be here for zmodem receive
 
-    # The next two lines get the local file list and sorts them in date order
-    os.chdir(fileDir)
-    flist = sorted(filter(os.path.isfile, os.listdir(fileDir)), key=os.path.getmtime)
-                                
-    # Send the files in ola_fdict
+    # Send the files, best first, one attempt each until the link stops getting anything through
     try:
-        for fn in ola_fdict:
-            # result>>8 gives the exit status of the process.  If the file transfer fails, get out
-            print("Sending: " + fn, flush=True)
+        failedInRow = 0
+        while failedInRow < MAX_FAILED_IN_A_ROW:
+            fn = state.next_file()
+            if fn is None:
+                break
+            entry = state.files[fn]
+            print("Sending: " + fn + " (" + str(entry['have']) + " of " + str(entry['size'] or '?') +
+                  " bytes on disk, " + str(entry['failures']) + " failures in a row)", flush=True)
             time.sleep(1)
             ss.sendline('sz '+ fn)
             time.sleep(1)
-            result = os.system("rz -r -U > /dev/rfcomm0 < /dev/rfcomm0")
-            while (result >> 8) != 0:
-                print("Sending: " + fn, flush=True)
-                time.sleep(1)
-                ss.sendline('sz '+ fn)  # try twice - might work
-                time.sleep(1)
-                ss.sendline('sz '+ fn)
-                time.sleep(1)
-                result = os.system("rz -r -U > /dev/rfcomm0 < /dev/rfcomm0")
-                
-            startFile = startFile + 1   # if we succeeded, go on to the next file
+            # receive on the open port, resuming any partial file
+            receiver = zmodem.ZModemReceiver(ser, fileDir, log=print)
+            receiver.receive()
+            result = next((r for r in receiver.files if r['name'] == fn), None)
+            entry = state.record(fn, result)
+            print(state.summary(), flush=True)
+            if entry['failures'] == 0:
+                failedInRow = 0
+            else:
+                failedInRow = failedInRow + 1
+        if failedInRow >= MAX_FAILED_IN_A_ROW:
+            print("Nothing is getting through.  Leaving the menu to try again later.", flush=True)
     except Exception as ex:
         print("Exception during file transfer")
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
@@ -186,20 +176,32 @@ def download_data_files(ss):
     return prevData
 
 
+# The files asked for on the command line, or None for everything on the OLA
+def wanted_files():
+    if args.range:
+        return ['dataLog' + str(i).zfill(5) + '.TXT' for i in range(args.range[0], args.range[1]+1)]
+    if args.files:
+        return args.files
+    return None
+
+
 # Procedure for retrieving the list of files on the OLA
-#
-# In this version we will not try to get a file list from the OLA,
-# but rather just construct one based on a numeric range.
-#
 def get_OLA_file_list(ss):
-# get a dictionary of files and file sizes from the OLA sorted in date order
-    global startFile
-    global endFile
+# get a dictionary of files and (date, size) from the OLA sorted in date order
     fileDict = {}    # declare empty dictionary
     dtDict = {}
     
-    for i in range(startFile, endFile+1): # range goes from startFile up to but not including the last argument
-        fileDict.update( {'dataLog' + str(i).zfill(5) + '.TXT' : 0} )
+    ss.sendline('dir')
+    ss.expect('End of Directory', timeout=90)
+    # Now parse the before to look for dataLog?????.txt and the token before it which is size
+    blines = ss.before.splitlines()
+    for ll in blines:
+        old_print(ll)   # print the directory listing - mainly for debugging whether we got a good transmission
+        if ll.find(b'dataLog') != -1:
+            lls = ll.split()
+            dtDict.update({ lls[3].decode() : datetime.strptime(lls[0].decode()+" "+lls[1].decode(), '%Y-%m-%d %H:%M')})
+            fileDict.update({ lls[3].decode() : (dtDict[lls[3].decode()].strftime('%Y-%m-%d %H:%M'), int(lls[2])) })
+    fileDict = {k:v for k,v in sorted(fileDict.items(), key=lambda x : dtDict[x[0]] )}
     
     return fileDict
 
@@ -243,8 +245,7 @@ def get_OLA_menu(ss):
         except pexpect.exceptions.EOF as e:
             print("Caught EOF error - waiting for port to re-appear")
             ser.close()
-            while not exists('/dev/rfcomm0'):
-                time.sleep(3)
+            serial_wait.wait_for_device('/dev/rfcomm0')
             ser.open()
             time.sleep(1)
             continue
@@ -269,9 +270,7 @@ def main():
     BT_ERROR = False
     was_bt_err = False
     want_file_download = True
-    RESTLESS = 0.0001   # sleep time in seconds (RasPi 4 will sleep about .0002 for its minimum)
-    MELLOW = 1
-    sleep_time = RESTLESS
+    IDLE_WAIT = 1       # longest time in seconds to wait for serial data before checking the timer
     data_delay_start_time = time.time() # time how long since data in case we are stuck in the file transfer menu
     MAX_DATA_DELAY = config['dataHandler']['MAX_DATA_DELAY']
     no_logging = config['dataHandler']['DB_URL'].lower().startswith('no')
@@ -292,7 +291,7 @@ def main():
                     print("Closing serial port.", flush=True)
                     ser.close()
                     time.sleep(3) # these used to be 10 s each.
-                if exists('/dev/rfcomm0'):
+                if serial_wait.wait_for_device('/dev/rfcomm0', 3):
                     ser.open()
                     time.sleep(3)
             except:
@@ -307,10 +306,9 @@ def main():
         was_bt_err = BT_ERROR
         
         
-        # If we need the menu, we have to be fast.  Sleep time will be set to minimum, and as soon
-        # as we see the first character show up, we try sending a char.  Maybe,
+        # If we need the menu, we have to be fast.  The wait below returns as soon as
+        # the first character shows up, and we try sending a char.  Maybe,
         # if we are fast enough that will get into the menu without hammering on bluetooth.
-        # At 115200, chars come every ~.0001 s: min resolution on the pi is about .0002.
         # If this fails, we will be in the regular get_OLA_menu routine that hammers on bluetooth
         # until it succeeds.
         #
@@ -320,8 +318,12 @@ def main():
                 prevData = download_data_files(ss)
                 data_delay_start_time = time.time() # this could have taken a long time
                 want_file_download = False
+                if listing_read or not args.listing:
+                    if state.next_file() is None:
+                        print("All files downloaded.  " + state.summary(), flush=True)
+                        ser.close()
+                        sys.exit(0)
                 keepPrevData = True    # keep us from overwriting prevData
-                sleep_time = MELLOW
                 print('prevData set to: ', end='')
                 if not prevData.inString:
                     old_print('(null)')
@@ -341,10 +343,9 @@ def main():
             if len(incomingLine)==0:   # line was only garbage
                 continue
             want_file_download = True
-            sleep_time = RESTLESS
         
-        # no chars
-        time.sleep(sleep_time)
+        # no chars - sleep until some arrive
+        serial_wait.wait_readable(ser, IDLE_WAIT)
         if time.time() - data_delay_start_time > float(MAX_DATA_DELAY):
             exit_zmodem(ss)
             data_delay_start_time = time.time()
@@ -352,9 +353,29 @@ def main():
 # Call main if necessary
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='Download data files from the OLA, resuming where the last run stopped')
+    parser.add_argument('--range', nargs=2, type=int, metavar=('FIRST', 'LAST'), help='file numbers to download')
+    parser.add_argument('--files', nargs='+', metavar='NAME', help='file names to download')
+    parser.add_argument('--listing', action='store_true',
+                        help='read the OLA file list (always done when neither --range nor --files is given)')
+    parser.add_argument('--state', default='/home/pi/data/download_state.json',
+                        help='progress file (keep it out of DOWNLOADED_FILE_DIR)')
+    parser.add_argument('--max-failures', type=int, default=0,
+                        help='give up on a file after this many failures in a row (0: never)')
+    args = parser.parse_args()
+    if args.range is None and args.files is None:
+        args.listing = True
+    listing_read = False
+
     while True:
         try:
             config = ConfigObj("/home/pi/bin/config.ini")  # Read the config file (current directory)
+            state = DownloadState(args.state, config['dataHandler']['DOWNLOADED_FILE_DIR'], args.max_failures)
+            names = wanted_files()
+            if names is not None and not args.listing:   # otherwise they are added once the listing is read
+                state.add(names)
+                state.save()
+            print(state.summary(), flush=True)
             
             # catch some signals and perform an orderly shutdown
             signal.signal(signal.SIGTERM, signal_handler)
@@ -368,9 +389,8 @@ if __name__ == "__main__":
             
             device_file = '/dev/rfcomm0'
             print('Attempting to open ' + device_file, end='')
-            while not exists(device_file):
+            while not serial_wait.wait_for_device(device_file, 3):
                 old_print('.', end='')
-                time.sleep(3)
             old_print(' ')
                 
             ser = serial.Serial(device_file, 115200, timeout=3) # changed timeout from 1 to 3 on 20220711
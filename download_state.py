@@ -0,0 +1,169 @@
+#
+# Download state
+#
+# Progress of downloadFiles.py through a list of OLA files, kept on disk so a
+# restarted download carries on where it was.  For each file:
+#
+#   size       size on the OLA (from its listing or from the transfer), or None
+#   have       bytes on disk after the last attempt (ZModem resumes from there)
+#   done       completely received
+#   attempts   transfers tried
+#   failures   attempts in a row that got nothing new
+#
+# next_file() picks what to try next: files that have been failing least
+# first, then partial files (to finish them), then in name order.  A file that
+# fails goes behind everything that is doing better, so one file the link
+# cannot get through does not hold up the rest, but it is still retried once
+# the others are done or failing too.  Files that fail maxFailures times in a
+# row are given up on (0 means never).
+#
+# The state is a small JSON file, rewritten atomically after every attempt.
+#
+# Running this file checks the ordering with a simulated flaky link:
+#   python3 download_state.py
+#
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+class DownloadState:
+    def __init__(self, fileName, directory, maxFailures=0):
+        self.fileName = fileName
+        self.directory = directory
+        self.maxFailures = maxFailures
+        try:
+            f = open(fileName, 'rt')
+            self.files = json.load(f)
+            f.close()
+        except (OSError, ValueError):
+            self.files = {}
+
+    # Make sure names are in the list.  sizes, if given, is {name: size} from the OLA listing.
+    def add(self, names, sizes=None):
+        for name in names:
+            entry = self.files.setdefault(name, {'size': None, 'have': 0, 'done': False,
+                                                 'attempts': 0, 'failures': 0})
+            size = sizes.get(name) if sizes else None
+            if size is not None and size != entry['size']:
+                entry['size'] = size
+                entry['done'] = False   # it has grown (the active file), or we did not know
+            self._check_disk(name)
+
+    # Forget names that turned out not to be there to get (not on the OLA)
+    def drop(self, names):
+        for name in names:
+            self.files.pop(name, None)
+
+    # Bring 'have' (and 'done', when the size is known) up to date with the file on disk
+    def _check_disk(self, name):
+        entry = self.files[name]
+        path = os.path.join(self.directory, name)
+        entry['have'] = os.path.getsize(path) if os.path.isfile(path) else 0
+        if entry['size'] is not None:
+            entry['done'] = entry['have'] == entry['size']
+        return entry
+
+    def given_up(self, entry):
+        return self.maxFailures > 0 and entry['failures'] >= self.maxFailures
+
+    # Files still to get, best first
+    def remaining(self):
+        todo = [(entry['failures'], entry['have'] == 0, name)
+                for name, entry in self.files.items() if not entry['done'] and not self.given_up(entry)]
+        return [name for failures, empty, name in sorted(todo)]
+
+    def next_file(self):
+        todo = self.remaining()
+        return todo[0] if todo else None
+
+    # Account for one attempt at name.  result is the ZModem receiver's result for
+    # the file, or None if the transfer never started.
+    def record(self, name, result):
+        entry = self.files[name]
+        before = entry['have']
+        entry['attempts'] = entry['attempts'] + 1
+        entry['lastAttempt'] = time.time()
+        if result is not None and result['size'] is not None:
+            entry['size'] = result['size']
+        self._check_disk(name)
+        if result is not None and result['complete']:
+            entry['done'] = True
+        if entry['done'] or entry['have'] > before:
+            entry['failures'] = 0   # getting somewhere
+        else:
+            entry['failures'] = entry['failures'] + 1
+        self.save()
+        return entry
+
+    def save(self):
+        dirName = os.path.dirname(self.fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        tmpName = self.fileName + '.tmp'
+        f = open(tmpName, 'wt')
+        json.dump(self.files, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmpName, self.fileName)
+
+    def summary(self):
+        numDone = sum(1 for entry in self.files.values() if entry['done'])
+        gaveUp = [name for name, entry in self.files.items() if not entry['done'] and self.given_up(entry)]
+        partial = sum(1 for entry in self.files.values() if not entry['done'] and entry['have'] > 0)
+        total = sum(entry['size'] for entry in self.files.values() if entry['size'] is not None)
+        have = sum(entry['have'] for entry in self.files.values())
+        line = ('%d of %d files done, %d partial, %.1f kB on disk' % (numDone, len(self.files), partial, have / 1e3))
+        if total:
+            line = line + (' of %.1f kB known' % (total / 1e3))
+        if gaveUp:
+            line = line + ', gave up on ' + ', '.join(sorted(gaveUp))
+        return line
+
+
+# Simulate a link that drops transfers part way, and one file that never comes
+def self_check():
+    rnd = random.Random(1)
+    directory = tempfile.mkdtemp()
+    sizes = {'dataLog%05d.TXT' % i: 20000 + 1000 * i for i in range(80, 90)}
+    sizes['dataLog00085.TXT'] = None   # in the range but not on the OLA
+    stateFile = os.path.join(directory, 'state.json')
+    state = DownloadState(stateFile, directory, maxFailures=5)
+    state.add(sorted(sizes))
+    order = []
+    for attempt in range(200):
+        if attempt == 20:   # restart part way through
+            state = DownloadState(stateFile, directory, maxFailures=5)
+        name = state.next_file()
+        if name is None:
+            break
+        order.append(name)
+        path = os.path.join(directory, name)
+        if sizes[name] is None:
+            state.record(name, None)
+            continue
+        have = os.path.getsize(path) if os.path.isfile(path) else 0
+        got = min(sizes[name] - have, rnd.choice([0, 0, 3000, 8000, 30000]))
+        f = open(path, 'ab')
+        f.write(b'x' * got)
+        f.close()
+        state.record(name, {'size': sizes[name], 'complete': have + got == sizes[name]})
+    ok = state.remaining() == [] and all(state.files[n]['done'] for n in sizes if sizes[n] is not None)
+    ok = ok and not state.files['dataLog00085.TXT']['done'] and order.count('dataLog00085.TXT') == 5
+    # the missing file is not tried a second time before every other file has had a go
+    first = order.index('dataLog00085.TXT')
+    second = order.index('dataLog00085.TXT', first + 1)
+    ok = ok and set(order[:second]) == set(sizes)
+    lastGood = max(i for i, n in enumerate(order) if n != 'dataLog00085.TXT')
+    print(state.summary())
+    print('%d attempts, last useful one at %d, %s' % (len(order), lastGood, 'check passed' if ok else 'CHECK FAILED'))
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
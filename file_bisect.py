@@ -0,0 +1,177 @@
+#
+# File bisect
+#
+# Finds where to start reading a dataLog or daily logged file for a given time
+# without reading the whole file.  Rows are written in time order, so the file
+# is memory-mapped and binary searched on the leading date,time of each line.
+# A probe at an arbitrary byte is realigned to the start of the next line, and
+# lines that do not start with a valid timestamp (header lines, a line garbled
+# over BLE, a partial line at the end) are stepped over to the next good one.
+# Once the search is down to a few kilobytes the rest is a short linear scan.
+#
+# If the clock jumped backwards somewhere in a file the answer is one of the
+# places where time passes the given value, so callers still check each row
+# they read as they always have.
+#
+# Running this file checks the search against a straight scan of synthetic
+# files:
+#   python3 file_bisect.py
+#
+
+import mmap
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from ola_data import decode_timestamp
+
+SCAN_SIZE = 4096    # below this many bytes, just read the lines
+
+
+# Start of the first line that begins at or after pos
+def _line_start(mm, pos):
+    if pos <= 0:
+        return 0
+    i = mm.find(b'\n', pos - 1)
+    if i < 0:
+        return len(mm)
+    return i + 1
+
+
+# Timestamp at the start of the line beginning at pos, or None if there isn't one
+def _line_time(mm, pos, end):
+    lineEnd = mm.find(b'\n', pos, end)
+    if lineEnd < 0:
+        return None     # no end of line yet
+    secondComma = mm.find(b',', mm.find(b',', pos, lineEnd) + 1, lineEnd)
+    if secondComma < 0:
+        return None
+    try:
+        d, t = mm[pos:secondComma].decode('ascii').split(',')
+        return decode_timestamp(d, t)
+    except ValueError:
+        return None
+
+
+# First line at or after line start pos (and before end) with a valid timestamp.
+# Returns (time, line start, line end), or (None, end, end) if there isn't one.
+def _next_timed_line(mm, pos, end):
+    while pos < end:
+        lineEnd = mm.find(b'\n', pos, end)
+        if lineEnd < 0:
+            break
+        t = _line_time(mm, pos, end)
+        if t is not None:
+            return t, pos, lineEnd + 1
+        pos = lineEnd + 1
+    return None, end, end
+
+
+# Byte offset of the first line, at or after start, whose timestamp is later
+# than when (a datetime).  If there is no such line, returns the end of the
+# last complete line, so a partial line still being written is not skipped.
+# start must be the start of a line.
+def offset_after(fn, when, start=0):
+    size = os.path.getsize(fn)
+    if size <= start:
+        return size
+    f = open(fn, 'rb')
+    try:
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    try:
+        return _search(mm, when, start, max(start, mm.rfind(b'\n', start) + 1))
+    finally:
+        mm.close()
+
+
+def _search(mm, when, lo, hi):
+    # lo is always a line start with nothing later than when before it.
+    # The answer is somewhere in [lo, hi].
+    while hi - lo > SCAN_SIZE:
+        mid = _line_start(mm, (lo + hi) // 2)
+        if mid >= hi:
+            break
+        t, lineStart, lineEnd = _next_timed_line(mm, mid, hi)
+        if t is None or t > when:
+            hi = mid
+        else:
+            lo = lineEnd
+    # short linear scan for the first later line
+    while lo < hi:
+        t, lineStart, lineEnd = _next_timed_line(mm, lo, hi)
+        if t is None:
+            return hi
+        if t > when:
+            return lineStart
+        lo = lineEnd
+    return hi
+
+
+# The straight scan offset_after replaces, to check it against
+def reference_offset_after(fn, when, start=0):
+    f = open(fn, 'rb')
+    f.seek(start)
+    pos = start
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        try:
+            l = line.decode('ascii').split(',')
+            if len(l) > 2 and decode_timestamp(l[0], l[1]) > when:
+                break
+        except ValueError:
+            pass
+        pos = pos + len(line)
+    f.close()
+    return pos
+
+
+# Synthetic file in dataLog layout with garbage sprinkled in
+def write_synthetic_file(fn, numLines, firstTime, rnd):
+    f = open(fn, 'wb')
+    f.write(b'Date,Time,batt,aX,aY,aZ,temp,press,wtemp,seq,\r\n')
+    times = []
+    t = firstTime
+    for i in range(numLines):
+        t = t + timedelta(seconds=rnd.choice((60, 60, 60, 0, 360)))
+        r = rnd.random()
+        if r < 0.02:
+            f.write(b'12/3\xff/2026,,garbled\r\n')
+        elif r < 0.03:
+            f.write(b'\r\n')
+        f.write((t.strftime('%m/%d/%Y,%H:%M:%S.') + '%02d' % (i % 100) +
+                 ',4.12,0.01,0.02,0.98,22.50,1013.25,21.30,%d,\r\n' % i).encode())
+        times.append(t)
+    f.write(b'10/19/2026,02:01:00')    # partial last line
+    f.close()
+    return times
+
+
+def self_check(numFiles=20):
+    rnd = random.Random(1)
+    fn = os.path.join(tempfile.mkdtemp(), 'dataLog00000.TXT')
+    numChecked = 0
+    for n in range(numFiles):
+        numLines = rnd.choice((0, 1, 5, 100, 5000))
+        first = datetime(2026, 10, 1) + timedelta(seconds=rnd.randrange(86400))
+        times = write_synthetic_file(fn, numLines, first, rnd)
+        probes = [first - timedelta(days=1), first + timedelta(days=30)] + \
+                 [rnd.choice(times) + timedelta(microseconds=rnd.choice((-1, 0, 1))) for i in range(min(50, len(times)))]
+        for when in probes:
+            got = offset_after(fn, when)
+            expected = reference_offset_after(fn, when)
+            if got != expected:
+                print('MISMATCH', numLines, when, got, expected)
+                return False
+            numChecked = numChecked + 1
+    os.remove(fn)
+    print('offset_after agrees with a straight scan for', numChecked, 'searches')
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
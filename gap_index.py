@@ -0,0 +1,224 @@
+#
+# Gap index
+#
+# Keeps track of which observations we hold, as runs of consecutive sequence
+# numbers with the times they cover:
+#
+#   local     rows in files on the Pi (the daily logged files and the files
+#             downloaded from the OLA), with the file each run is in
+#   upstream  rows the database has confirmed
+#
+# When a line arrives out of sequence, missing() works out which of the rows in
+# between are already in the database, which are in a local file and only need
+# uploading, and which we have not got at all and have to come from the OLA.
+#
+# Sequence numbers start over when the OLA restarts, so a run is a stretch of
+# consecutive sequence numbers with increasing times, and a gap is only looked
+# up between two rows of the same run (later time, higher number).
+#
+# Runs are kept in time order, [seqLo, seqHi, timeLo, timeHi, source].  Rows
+# usually arrive in order and just extend the last run, so the lists stay short.
+# The index is a small JSON file, rewritten atomically at most every
+# saveInterval seconds (the caller calls save_if_due()), and runs older than
+# keepDays are dropped.  Losing the last few rows from it after a crash only
+# means a gap is fetched from the OLA as it was before.
+#
+# Running this file checks missing() against brute force on random histories:
+#   python3 gap_index.py
+#
+
+import bisect
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class IntervalSet:
+    def __init__(self, intervals=()):
+        self.intervals = sorted([list(i) for i in intervals], key=lambda i: i[2])
+        self.starts = [i[2] for i in self.intervals]
+
+    # Add one row.  Returns True if that changed anything.
+    def add(self, seq, t, source=None):
+        iv = self.intervals
+        k = bisect.bisect_right(self.starts, t)     # iv[:k] start at or before t
+        if k > 0:
+            cur = iv[k-1]
+            if cur[0] <= seq <= cur[1] and cur[2] <= t <= cur[3]:
+                return False    # already have it
+            if cur[4] == source and seq == cur[1] + 1 and t > cur[3]:
+                cur[1] = seq
+                cur[3] = t
+                if k < len(iv) and iv[k][4] == source and iv[k][0] == seq + 1:
+                    cur[1] = iv[k][1]   # it joins the next run
+                    cur[3] = iv[k][3]
+                    del iv[k]
+                    del self.starts[k]
+                return True
+        if k < len(iv) and iv[k][4] == source and seq == iv[k][0] - 1 and t < iv[k][2]:
+            iv[k][0] = seq
+            iv[k][2] = t
+            self.starts[k] = t
+            return True
+        iv.insert(k, [seq, seq, t, t, source])
+        self.starts.insert(k, t)
+        return True
+
+    # Runs that have rows strictly between times tA and tB
+    def overlapping(self, tA, tB):
+        k = bisect.bisect_left(self.starts, tB)
+        return [i for i in self.intervals[:k] if i[3] > tA]
+
+    # Drop runs that end before t
+    def prune(self, t):
+        self.intervals = [i for i in self.intervals if i[3] >= t]
+        self.starts = [i[2] for i in self.intervals]
+
+    def to_json(self):
+        return [[lo, hi, tLo.isoformat(), tHi.isoformat(), source] for lo, hi, tLo, tHi, source in self.intervals]
+
+    @staticmethod
+    def from_json(items):
+        return IntervalSet([lo, hi, datetime.fromisoformat(tLo), datetime.fromisoformat(tHi), source]
+                           for lo, hi, tLo, tHi, source in items)
+
+
+# ranges (sorted, disjoint (lo, hi) pairs) with lo..hi taken out
+def _subtract(ranges, lo, hi):
+    result = []
+    for a, b in ranges:
+        if b < lo or a > hi:
+            result.append((a, b))
+            continue
+        if a < lo:
+            result.append((a, lo - 1))
+        if b > hi:
+            result.append((hi + 1, b))
+    return result
+
+
+# the parts of ranges inside lo..hi
+def _intersect(ranges, lo, hi):
+    return [(max(a, lo), min(b, hi)) for a, b in ranges if b >= lo and a <= hi]
+
+
+class GapIndex:
+    def __init__(self, fileName, saveInterval=60, keepDays=60):
+        self.fileName = fileName
+        self.saveInterval = saveInterval
+        self.keepDays = keepDays
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.lastSave = time.monotonic()
+        try:
+            f = open(fileName, 'rt')
+            data = json.load(f)
+            f.close()
+            self.local = IntervalSet.from_json(data['local'])
+            self.upstream = IntervalSet.from_json(data['upstream'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.local = IntervalSet()      # no index yet (or unreadable) - gaps go to the OLA until it fills in
+            self.upstream = IntervalSet()
+
+    # Row seq at time t is in file source
+    def add_local(self, seq, t, source):
+        with self.lock:
+            self.dirty = self.local.add(seq, t, source) or self.dirty
+
+    # Row seq at time t is in the database
+    def add_upstream(self, seq, t):
+        with self.lock:
+            self.dirty = self.upstream.add(seq, t) or self.dirty
+
+    # For the rows missing between (seqA, timeA) and (seqB, timeB), returns
+    # (fromLocal, absent): fromLocal is a list of (seqLo, seqHi, source) that are
+    # in local files but not in the database, absent a list of (seqLo, seqHi)
+    # that we do not have at all.  Rows already in the database are in neither.
+    def missing(self, seqA, timeA, seqB, timeB):
+        need = [(seqA + 1, seqB - 1)] if seqB > seqA + 1 else []
+        with self.lock:
+            for lo, hi, tLo, tHi, source in self.upstream.overlapping(timeA, timeB):
+                need = _subtract(need, lo, hi)
+            fromLocal = []
+            for lo, hi, tLo, tHi, source in self.local.overlapping(timeA, timeB):
+                for a, b in _intersect(need, lo, hi):
+                    fromLocal.append((a, b, source))
+                need = _subtract(need, lo, hi)
+        return fromLocal, need
+
+    def save(self):
+        with self.lock:
+            cutoff = datetime.now() - timedelta(days=self.keepDays)
+            self.local.prune(cutoff)
+            self.upstream.prune(cutoff)
+            data = {'local': self.local.to_json(), 'upstream': self.upstream.to_json()}
+            self.dirty = False
+            self.lastSave = time.monotonic()
+        dirName = os.path.dirname(self.fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        tmpName = self.fileName + '.tmp'
+        f = open(tmpName, 'wt')
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmpName, self.fileName)
+
+    def save_if_due(self):
+        if self.dirty and time.monotonic() - self.lastSave >= self.saveInterval:
+            self.save()
+
+
+# Check missing() against a straight set calculation on random histories
+def self_check(numTrials=300):
+    rnd = random.Random(1)
+    start = datetime(2026, 10, 1)
+    bad = 0
+    for trial in range(numTrials):
+        # two runs of the OLA (sequence numbers start over), one row a minute
+        rows = [(seq, start + timedelta(minutes=i)) for i, seq in enumerate(list(range(200)) + list(range(150)))]
+        local = {}
+        upstream = set()
+        index = GapIndex(os.path.join(tempfile.mkdtemp(), 'gaps.json'))
+        order = list(range(len(rows)))
+        rnd.shuffle(order)
+        for i in order:
+            seq, t = rows[i]
+            r = rnd.random()
+            if r < 0.5:
+                source = 'file%d' % (i // 120)
+                local[i] = source
+                index.add_local(seq, t, source)
+            if r > 0.3:
+                upstream.add(i)
+                index.add_upstream(seq, t)
+        if trial % 10 == 0:     # through the file and back
+            index.save()
+            index = GapIndex(index.fileName)
+        a = rnd.randrange(len(rows))
+        b = rnd.randrange(a, min(len(rows), a + 60))
+        if rows[b][0] <= rows[a][0]:
+            continue    # not the same run
+        fromLocal, absent = index.missing(rows[a][0], rows[a][1], rows[b][0], rows[b][1])
+        gotLocal = set()
+        for lo, hi, source in fromLocal:
+            for seq in range(lo, hi + 1):
+                gotLocal.add((a + seq - rows[a][0], source))
+        gotAbsent = set(a + seq - rows[a][0] for lo, hi in absent for seq in range(lo, hi + 1))
+        between = range(a + 1, b)
+        wantLocal = set((i, local[i]) for i in between if i in local and i not in upstream)
+        wantAbsent = set(i for i in between if i not in local and i not in upstream)
+        if gotLocal != wantLocal or gotAbsent != wantAbsent:
+            bad = bad + 1
+    print('%d trials, %d wrong' % (numTrials, bad))
+    return bad == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
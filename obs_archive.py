@@ -0,0 +1,282 @@
+#
+# Observation archive
+#
+# A compact binary copy of every observation, alongside the text files.  Each
+# day (by obsDateTime) is a directory under the archive directory,
+#   YYYYMMDD/time.bin, press.bin, wtemp.bin, temp.bin, battVolts.bin,
+#            aX.bin, aY.bin, aZ.bin, obsNum.bin
+# each one a fixed-width little-endian array with one entry per observation
+# (COLUMNS below), 40 bytes a row against ~70 for the text line.
+# Within a day the rows are kept sorted by time and unique, so the time column
+# is the index: readers memory-map the columns and binary search it, and load
+# months of data without parsing any text.
+#
+# Rows are appended to the column files.  The number of rows in a day is the
+# length of its shortest column, so a write cut short by a crash is just
+# dropped.  Rows that arrive out of order (a catch-up filling a gap) make the
+# day be rewritten merged, into YYYYMMDD.tmp which then replaces it.
+#
+# ObsArchive batches what it is given and writes it every flushRows rows or
+# flushInterval seconds, whichever comes first, so the columns are not
+# appended to for every sample.
+#
+# Running this file builds an archive from synthetic dataLog files and
+# compares loading it with parsing the text:
+#   python3 obs_archive.py [numDays]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+COLUMNS = [('time', '<M8[us]'),
+           ('press', '<f4'),
+           ('wtemp', '<f4'),
+           ('temp', '<f4'),
+           ('battVolts', '<f4'),
+           ('aX', '<f4'),
+           ('aY', '<f4'),
+           ('aZ', '<f4'),
+           ('obsNum', '<i4')]
+FIELDS = [name for name, dtype in COLUMNS]
+
+
+class ObsArchive:
+    def __init__(self, directory, flushRows=64, flushInterval=300):
+        self.directory = directory
+        self.flushRows = flushRows
+        self.flushInterval = flushInterval
+        self.pending = []
+        self.lastFlush = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Queue OLAdata observations to be written
+    def add(self, observations):
+        with self.lock:
+            self.pending.extend(_columns_from_oladata(observations))
+        self.flush_if_due()
+
+    # Queue rows from ola_bulk (valid rows only)
+    def add_rows(self, rows):
+        rows = rows[rows['valid']]
+        with self.lock:
+            self.pending.append({name: rows[name].astype(dtype) for name, dtype in COLUMNS})
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        numPending = sum(len(cols['time']) for cols in self.pending)
+        if numPending and (numPending >= self.flushRows or time.monotonic() - self.lastFlush >= self.flushInterval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            self.lastFlush = time.monotonic()
+            if not pending:
+                return
+            cols = {name: np.concatenate([p[name] for p in pending]) for name in FIELDS}
+            obsDays = cols['time'].astype('datetime64[D]')
+            for day in np.unique(obsDays):
+                inDay = obsDays == day
+                write_day(self.directory, str(day).replace('-', ''), {name: cols[name][inDay] for name in FIELDS})
+
+
+# [{column: array}] for a list of OLAdata
+def _columns_from_oladata(observations):
+    observations = [o for o in observations if o.inString]
+    if not observations:
+        return []
+    cols = {'time': np.array([o.obsDateTime for o in observations], dtype='datetime64[us]')}
+    for name, dtype in COLUMNS[1:]:
+        cols[name] = np.array([getattr(o, name) for o in observations], dtype=dtype)
+    return [cols]
+
+
+def _day_dir(directory, day):
+    return os.path.join(directory, day)
+
+
+# Number of complete rows in a day directory
+def _day_length(dayDir):
+    n = None
+    for name, dtype in COLUMNS:
+        try:
+            rows = os.path.getsize(os.path.join(dayDir, name + '.bin')) // np.dtype(dtype).itemsize
+        except OSError:
+            return 0
+        n = rows if n is None else min(n, rows)
+    return n
+
+
+# Put a day back together if a rewrite was cut short
+def _recover_day(directory, day):
+    dayDir = _day_dir(directory, day)
+    if not os.path.isdir(dayDir) and os.path.isdir(dayDir + '.old'):
+        os.rename(dayDir + '.old', dayDir)
+    for leftover in (dayDir + '.tmp', dayDir + '.old'):
+        if os.path.isdir(leftover):
+            shutil.rmtree(leftover)
+
+
+def _write_columns(dayDir, cols, mode):
+    for name, dtype in COLUMNS:
+        f = open(os.path.join(dayDir, name + '.bin'), mode)
+        f.write(np.ascontiguousarray(cols[name], dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+
+# Add cols (all rows from one day) to the archive
+def write_day(directory, day, cols):
+    _recover_day(directory, day)
+    dayDir = _day_dir(directory, day)
+    order = np.argsort(cols['time'], kind='stable')
+    cols = {name: cols[name][order] for name in FIELDS}
+    existing = load_day(directory, day)
+    n = len(existing['time']) if existing else 0
+    if n == 0 or cols['time'][0] > existing['time'][-1]:
+        # the usual case: everything is newer than what is there
+        _, first = np.unique(cols['time'], return_index=True)
+        cols = {name: cols[name][first] for name in FIELDS}
+        if not os.path.isdir(dayDir):
+            os.makedirs(dayDir)
+        for name, dtype in COLUMNS:
+            fn = os.path.join(dayDir, name + '.bin')
+            if os.path.exists(fn) and os.path.getsize(fn) > n * np.dtype(dtype).itemsize:
+                os.truncate(fn, n * np.dtype(dtype).itemsize)   # left over from an interrupted append
+        _write_columns(dayDir, cols, 'ab')
+        return
+    # merge, keeping the rows that were already there when a time is repeated
+    merged = {name: np.concatenate((np.array(existing[name]), cols[name])) for name in FIELDS}
+    del existing    # let go of the maps before the files are replaced
+    _, first = np.unique(merged['time'], return_index=True)    # sorted by time
+    merged = {name: merged[name][first] for name in FIELDS}
+    os.makedirs(dayDir + '.tmp')
+    _write_columns(dayDir + '.tmp', merged, 'wb')
+    os.rename(dayDir, dayDir + '.old')
+    os.rename(dayDir + '.tmp', dayDir)
+    shutil.rmtree(dayDir + '.old')
+
+
+# Days in the archive, as sorted 'YYYYMMDD' strings
+def days(directory):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(d for d in names if len(d) == 8 and d.isdigit())
+
+
+# {column: memory-mapped array} for one day, or None if there is nothing for it
+def load_day(directory, day):
+    dayDir = _day_dir(directory, day)
+    n = _day_length(dayDir)
+    if n == 0:
+        return None
+    return {name: np.memmap(os.path.join(dayDir, name + '.bin'), dtype=dtype, mode='r', shape=(n,))
+            for name, dtype in COLUMNS}
+
+
+# {column: array} of the rows with start <= time < end (datetimes, or None for no limit).
+# Within one day the arrays are slices of the maps; across days they are copied together.
+def load(directory, start=None, end=None):
+    first = start.strftime('%Y%m%d') if start is not None else None
+    last = end.strftime('%Y%m%d') if end is not None else None
+    parts = []
+    for day in days(directory):
+        if (first is not None and day < first) or (last is not None and day > last):
+            continue
+        cols = load_day(directory, day)
+        if cols is None:
+            continue
+        lo = 0 if start is None else np.searchsorted(cols['time'], np.datetime64(start, 'us'), 'left')
+        hi = len(cols['time']) if end is None else np.searchsorted(cols['time'], np.datetime64(end, 'us'), 'left')
+        if hi > lo:
+            parts.append({name: cols[name][lo:hi] for name in FIELDS})
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+    return {name: np.concatenate([p[name] for p in parts]) for name in FIELDS}
+
+
+def _disk_usage(directory):
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        total = total + sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def benchmark(numDays=60):
+    import ola_bulk
+    from ola_data import parse_ola_line
+
+    tmp = tempfile.mkdtemp()
+    textDir = os.path.join(tmp, 'text')
+    archiveDir = os.path.join(tmp, 'archive')
+    os.makedirs(textDir)
+    start = datetime(2026, 8, 1)
+    rowsPerDay = 24 * 60        # one a minute
+    n = 0
+    for d in range(numDays):
+        f = open(os.path.join(textDir, 'dataLog%05d.TXT' % d), 'w')
+        for i in range(rowsPerDay):
+            t = start + timedelta(days=d, minutes=i, milliseconds=10 * (i % 100))
+            f.write('%s,%s.%02d,%.2f,%.2f,%.2f,%.2f,%.1f,%.2f,%.1f,%d,\r\n'
+                    % (t.strftime('%m/%d/%Y'), t.strftime('%H:%M:%S'), t.microsecond // 10000, 4.1,
+                       0.01, 0.02, 0.98, 22.5, 1013 + (i % 50) / 10, 21.3, n))
+            n = n + 1
+        f.close()
+    flist = sorted(os.path.join(textDir, fn) for fn in os.listdir(textDir))
+
+    archive = ObsArchive(archiveDir)
+    rows, endOffset, data = ola_bulk.load_data_file(flist[0])
+    archive.add_rows(rows[1::2])    # with gaps, so the full day has to be merged in
+    archive.flush()
+    t0 = time.perf_counter()
+    for fn in flist:
+        rows, endOffset, data = ola_bulk.load_data_file(fn)
+        archive.add_rows(rows)
+    archive.flush()
+    print('%d days, %d rows: archived in %.2f s' % (numDays, n, time.perf_counter() - t0))
+
+    # the same rows again must not add anything
+    archive.add_rows(rows[:10])
+    archive.flush()
+    ok = len(load(archiveDir)['time']) == n
+
+    t0 = time.perf_counter()
+    count = 0
+    for fn in flist:
+        f = open(fn, 'rb')
+        for line in f:
+            if parse_ola_line(line) is not None:
+                count = count + 1
+        f.close()
+    lineTime = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    press = ola_bulk.load_data_files(flist)['press']
+    bulkTime = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    cols = load(archiveDir, start, start + timedelta(days=numDays))
+    total = float(cols['press'].astype(np.float64).sum())
+    archiveTime = time.perf_counter() - t0
+    ok = ok and count == n and len(cols['time']) == n and abs(total - float(press.sum())) < n * 0.001
+    print('load all rows: text line by line %.2f s, text bulk %.2f s, archive %.3f s'
+          % (lineTime, bulkTime, archiveTime))
+    print('disk: text %.1f MB, archive %.1f MB' % (_disk_usage(textDir) / 1e6, _disk_usage(archiveDir) / 1e6))
+    print('checks', 'passed' if ok else 'FAILED')
+    shutil.rmtree(tmp)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 60) else 1)
@@ -0,0 +1,163 @@
+#
+# OLA bulk loader
+#
+# Reads whole OLA dataLog files into a NumPy structured array in one go, for
+# catch-up and backfill where thousands of lines are parsed at a time.  The
+# line-at-a-time parser in ola_data.py is still what the serial loop uses.
+#
+# Line and comma positions are found with array scans of the raw bytes, well
+# formed lines are picked out with one regular expression over the whole file,
+# their numbers are converted by numpy's text reader in a single call, and the
+# date/time columns are turned into datetime64 arithmetically.  No Python
+# objects are built per field or per row.  Rows that do not parse are kept but marked
+# with valid=False instead of raising, so one bad line (a dropped character
+# over BLE, a header line) costs nothing but that row.  Unlike the line parser,
+# which quietly drops non-ASCII bytes, a field with a stray byte in it is
+# rejected rather than read as a different number.
+#
+# Each row also carries the byte offset where its line starts and ends in the
+# file so callers can checkpoint or seek by position.
+#
+
+import io
+import re
+from datetime import timedelta
+
+import numpy as np
+
+from ola_data import OLAdata
+
+OBS_DTYPE = np.dtype([('time', 'datetime64[us]'),
+                      ('battVolts', 'f8'),
+                      ('aX', 'f8'),
+                      ('aY', 'f8'),
+                      ('aZ', 'f8'),
+                      ('temp', 'f8'),
+                      ('press', 'f8'),
+                      ('wtemp', 'f8'),
+                      ('obsNum', 'i8'),
+                      ('offset', 'i8'),     # byte offset of the start of the line
+                      ('end', 'i8'),        # byte offset just past the end of the line
+                      ('valid', '?')])
+
+NUM_COMMAS = 10         # date,time,batt,aX,aY,aZ,temp,press,wtemp,seq,<crlf>
+FLOAT_FIELDS = ('battVolts', 'aX', 'aY', 'aZ', 'temp', 'press', 'wtemp')
+COMMA = ord(',')
+NEWLINE = ord('\n')
+
+# A well formed Bar02 line, end to end.  Anything else is not parsed.
+NUMBER = rb'[-+]?(?:\d+\.?\d*|\.\d+)'
+LINE_RE = re.compile(rb'^\d\d/\d\d/\d{4},\d\d:\d\d:\d\d\.\d{1,6},(?:' + NUMBER + rb',){7}\d+,\r?$', re.M)
+
+
+# Turn columns of month, day, year, hour, minute and seconds (with fraction)
+# into datetime64[us].  Also returns a mask of impossible dates and times.
+def _to_datetime(month, day, year, hour, minute, seconds):
+    bad = (month < 1) | (month > 12) | (year < 1) | (hour > 23) | (minute > 59) | (seconds >= 60)
+    month = np.where(bad, 1, month)
+    year = np.where(bad, 1970, year)
+    monthStart = ((year - 1970) * 12 + (month - 1)).astype('datetime64[M]').astype('datetime64[D]')
+    daysInMonth = ((monthStart.astype('datetime64[M]') + 1).astype('datetime64[D]') - monthStart).astype(np.int64)
+    bad |= (day < 1) | (day > daysInMonth)
+    day = np.where(bad, 1, day)
+
+    us = (hour * 3600 + minute * 60) * 1000000 + np.round(seconds * 1000000).astype(np.int64)
+    times = (monthStart + (day - 1).astype('timedelta64[D]')).astype('datetime64[us]') + us.astype('timedelta64[us]')
+    return np.where(bad, np.datetime64('NaT'), times), bad
+
+
+# Parse a block of bytes from a data file.  baseOffset is the file position of
+# data[0].  Only complete lines (ending in a newline) are parsed.  Returns the
+# rows (one per line that has the right number of commas, with valid set for
+# the ones that parsed) and the file offset just past the last complete line.
+def parse_buffer(data, baseOffset=0):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == NEWLINE) + 1
+    starts = np.concatenate(([0], ends[:-1])).astype(np.int64)
+    endOffset = baseOffset + (int(ends[-1]) if len(ends) else 0)
+    data = data[:endOffset-baseOffset]      # leave any partial last line for next time
+
+    # lines with the right number of commas get a row whether or not they parse
+    commaCum = np.concatenate(([0], np.cumsum(buf == COMMA, dtype=np.int32)))
+    candidate = (commaCum[ends] - commaCum[starts]) == NUM_COMMAS
+    starts = starts[candidate]
+    ends = ends[candidate]
+    rows = np.zeros(len(starts), dtype=OBS_DTYPE)
+    rows['offset'] = baseOffset + starts
+    rows['end'] = baseOffset + ends
+
+    goodStarts = []
+    goodLines = []
+    for m in LINE_RE.finditer(data):
+        goodStarts.append(m.start())
+        goodLines.append(m.group())
+    if not goodLines:
+        return rows, endOffset
+
+    # every good line is now exactly 14 numbers: M,D,Y,h,m,s.ff,batt,aX,aY,aZ,temp,press,wtemp,seq
+    text = b'\n'.join(goodLines).replace(b'/', b',').replace(b':', b',')
+    values = np.loadtxt(io.BytesIO(text), delimiter=',', usecols=range(14), ndmin=2)
+    good = np.searchsorted(starts, np.array(goodStarts, dtype=np.int64))
+
+    ints = values[:, :5].astype(np.int64)
+    times, bad = _to_datetime(ints[:, 0], ints[:, 1], ints[:, 2], ints[:, 3], ints[:, 4], values[:, 5])
+    rows['time'][good] = times
+    for i, name in enumerate(FLOAT_FIELDS):
+        rows[name][good] = values[:, 6+i]
+    rows['obsNum'][good] = values[:, 13].astype(np.int64)
+    rows['valid'][good] = ~bad
+    return rows, endOffset
+
+
+# Read a data file from byte position start to the end and parse it.
+# Returns (rows, endOffset, data) where data is the bytes that were read.
+def load_data_file(fn, start=0):
+    f = open(fn, 'rb')
+    f.seek(start)
+    data = f.read()
+    f.close()
+    rows, endOffset = parse_buffer(data, start)
+    return rows, endOffset, data
+
+
+# Load several files into one array (valid rows only, in file order)
+def load_data_files(flist):
+    parts = []
+    for fn in flist:
+        rows, endOffset, data = load_data_file(fn)
+        parts.append(rows[rows['valid']])
+    if not parts:
+        return np.zeros(0, dtype=OBS_DTYPE)
+    return np.concatenate(parts)
+
+
+# Calibrated pressure for every row
+def calibrated_pressure(rows, sensorOffset, tempFactor):
+    return rows['press'] - sensorOffset - tempFactor * rows['wtemp']
+
+
+# Mask of valid rows more than margin (a timedelta) newer than lastDate (a datetime).
+# Like the line-by-line catch-up, a row only counts if it is also later than
+# everything before it (by any amount), so a stretch where the OLA clock jumped
+# backwards is skipped.
+def newer_than(rows, lastDate, margin=timedelta(0)):
+    times = rows['time'].astype(np.int64)
+    times = np.where(rows['valid'], times, np.iinfo(np.int64).min)
+    start = np.datetime64(lastDate + margin, 'us').astype(np.int64)
+    previousMax = np.maximum.accumulate(np.concatenate(([start], times)))[:-1]
+    return rows['valid'] & (times > previousMax)
+
+
+# Turn rows back into OLAdata objects.  data is the buffer they were parsed
+# from and baseOffset its position in the file (as given to parse_buffer).
+def to_oladata(rows, data, baseOffset=0):
+    result = []
+    times = rows['time'].tolist()
+    values = rows[list(FLOAT_FIELDS) + ['obsNum']].tolist()
+    for i, (offset, end) in enumerate(zip(rows['offset'].tolist(), rows['end'].tolist())):
+        d = OLAdata.__new__(OLAdata)
+        d.inString = data[offset-baseOffset:end-baseOffset].decode('ascii', 'ignore')
+        d.obsDateTime = times[i]
+        (d.battVolts, d.aX, d.aY, d.aZ, d.temp, d.press, d.wtemp, d.obsNum) = values[i]
+        result.append(d)
+    return result
@@ -0,0 +1,115 @@
+#
+# OLA bulk delete
+#
+# Deletes a list of files from the OLA's ZModem menu with the `del` commands
+# pipelined: up to `window` commands are sent ahead and the answers are
+# matched to them in order as they come back, with no fixed sleeps.  A file
+# the OLA says it could not delete is counted as failed and the rest carry on;
+# if the OLA stops answering, whatever was not confirmed is left for next time.
+#
+# Running this file deletes from a fake OLA on a pty, one at a time the old
+# way and pipelined, and prints the times:
+#   python3 ola_delete.py [numFiles]
+#
+
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+from collections import deque
+
+import pexpect
+from pexpect import fdpexpect
+
+DELETED = r'deleted'
+FAILED = r'[Nn]ot found|[Ff]ail|[Ee]rror|[Uu]nknown'
+WINDOW = 4      # commands in flight; each is ~25 bytes so this stays well inside the OLA's input buffer
+
+
+# Returns (deleted, failed) lists of names
+def bulk_delete(ss, names, window=WINDOW, timeout=10, log=print):
+    startTime = time.time()
+    deleted = []
+    failed = []
+    pending = deque()
+    toSend = deque(names)
+    try:
+        while toSend or pending:
+            while toSend and len(pending) < window:
+                fn = toSend.popleft()
+                ss.sendline('del ' + fn)
+                pending.append(fn)
+            i = ss.expect([DELETED, FAILED, pexpect.TIMEOUT], timeout=timeout)
+            if i == 0:
+                deleted.append(pending.popleft())
+            elif i == 1:
+                fn = pending.popleft()
+                log("OLA could not delete " + fn)
+                failed.append(fn)
+            else:
+                log("OLA stopped answering delete commands")
+                break
+    except Exception as ex:
+        log("Exception while deleting old OLA files")
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(ex).__name__, ex.args)
+        log(message)
+    failed.extend(pending)      # no answer - might or might not be gone
+    failed.extend(toSend)
+    log("Deleted " + str(len(deleted)) + " OLA files in " + str(round(time.time() - startTime, 1)) + " s" +
+        ((", " + str(len(failed)) + " not deleted") if failed else ""))
+    return deleted, failed
+
+
+# The loop this replaces
+def _one_at_a_time(ss, names):
+    for fn in names:
+        ss.sendline('del ' + fn)
+        ss.expect('deleted', timeout=10)
+        time.sleep(1)
+
+
+# Answers del commands over the master side of a pty like the OLA does
+def _fake_ola(fd, files, stop):
+    buf = b''
+    while not stop.is_set():
+        try:
+            buf = buf + os.read(fd, 1024)
+        except OSError:
+            return
+        while b'\n' in buf:
+            line, buf = buf.split(b'\n', 1)
+            words = line.strip().split()
+            if len(words) == 2 and words[0] == b'del':
+                time.sleep(0.05)    # time to remove the file from the card
+                name = words[1].decode()
+                if name in files:
+                    files.remove(name)
+                    os.write(fd, (name + ' deleted\r\n').encode())
+                else:
+                    os.write(fd, ('File not found: ' + name + '\r\n').encode())
+
+
+def benchmark(numFiles=20):
+    for name, method in (('one at a time (old)', _one_at_a_time),
+                         ('pipelined', lambda ss, names: bulk_delete(ss, names, log=lambda *a: None))):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        files = set('dataLog%05d.TXT' % i for i in range(numFiles) if i != 3)    # one missing file
+        stop = threading.Event()
+        t = threading.Thread(target=_fake_ola, args=(master, files, stop), daemon=True)
+        t.start()
+        ss = fdpexpect.fdspawn(slave)
+        names = ['dataLog%05d.TXT' % i for i in range(numFiles) if name == 'pipelined' or i != 3]
+        start = time.time()
+        method(ss, names)
+        print('%-20s %d files in %5.2f s, %d left' % (name, numFiles, time.time() - start, len(files)))
+        stop.set()
+        os.close(slave)
+        os.close(master)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
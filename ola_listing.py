@@ -0,0 +1,76 @@
+#
+# OLA listing snapshot
+#
+# The OLA's file list comes over Bluetooth and now and then a line gets
+# garbled.  A bad name can set off an archive and a full download, so a listing
+# used to be read until two in a row matched, which means at least two full
+# transfers of the listing every time.
+#
+# Instead the last good listing is kept on disk and each new one is checked
+# against it entry by entry.  An entry is confirmed if
+#   - it is the same as in the last good listing, or
+#   - it is the file the OLA was writing to then (the newest) and has only
+#     grown, which is what normally happens between downloads, or
+#   - it came out the same in the previous read of the listing.
+# An entry of the last good listing that is missing from the new one has to be
+# confirmed too (a dropped line looks just like that), unless it is old enough
+# to have been deleted from the OLA since: the previous read must be missing it
+# as well.  Only the newest keep entries of the last good listing are checked
+# this way, and always the file the OLA was writing to.
+# Only when something else has changed (new files, a new card, a garbled line)
+# does the listing have to be read again, so the usual case is one read.
+#
+# A listing is a dict of name -> (date, size) in date order, where date is the
+# 'YYYY-MM-DD HH:MM' string from the listing.
+#
+
+import json
+import os
+
+
+class ListingSnapshot:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.entries = {}
+        try:
+            f = open(fileName, 'rt')
+            self.entries = {name: (date, size) for name, date, size in json.load(f)['entries']}
+            f.close()
+        except (OSError, ValueError, KeyError, TypeError):
+            self.entries = {}   # no snapshot yet (or unreadable) - everything needs checking
+
+    # Names in listing that are not confirmed by the snapshot or by previous (an earlier read),
+    # and names missing from listing that should still be on the OLA.  keep is how many of the
+    # newest files the OLA keeps (None: all of them).
+    def unconfirmed(self, listing, previous=None, keep=None):
+        known = list(self.entries.keys())
+        activeFile = known[-1] if known else None
+        recent = known[-keep:] if keep else known
+        names = []
+        for name in recent:
+            if name not in listing and (previous is None or name in previous):
+                names.append(name)
+        for name, entry in listing.items():
+            known = self.entries.get(name)
+            if known == entry:
+                continue
+            if (name == activeFile and known is not None
+                    and entry[0] >= known[0] and entry[1] >= known[1]):
+                continue    # the active file grew
+            if previous is not None and previous.get(name) == entry:
+                continue
+            names.append(name)
+        return names
+
+    def update(self, listing):
+        self.entries = dict(listing)
+        dirName = os.path.dirname(self.fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        tmpName = self.fileName + '.tmp'
+        f = open(tmpName, 'wt')
+        json.dump({'entries': [[name, date, size] for name, (date, size) in self.entries.items()]}, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmpName, self.fileName)
@@ -0,0 +1,110 @@
+#
+# Outbox
+#
+# Durable, append-only queue of observations waiting to go to the database.
+# Every parsed observation is put in the outbox as soon as it arrives and is
+# only removed once the server has confirmed the upload.  The serial read loop
+# never has to wait on the network, and if the program (or the Pi) goes down
+# nothing that was queued is lost - the uploader just carries on from the
+# oldest unacknowledged row when it comes back.
+#
+# Storage is a small SQLite database in WAL mode so that appends are cheap
+# and a crash in the middle of a write leaves the queue consistent.
+#
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class Outbox:
+    def __init__(self, fileName):
+        dirName = os.path.dirname(fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(fileName, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')     # survive a power cut, not just a crash
+        self.db.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                        ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                        ' sensor_ID TEXT NOT NULL,'
+                        ' obs_time TEXT NOT NULL,'
+                        ' seqNum INTEGER,'
+                        ' body TEXT NOT NULL,'
+                        ' enqueued REAL NOT NULL,'
+                        ' attempts INTEGER NOT NULL DEFAULT 0)')
+
+    # Add observations to the end of the queue.  items is a list of
+    # (sensor_ID, obsDateTime, seqNum, post_data) tuples.  Returns the new row ids.
+    def enqueue_many(self, items):
+        now = time.time()
+        ids = []
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for sensorID, obsTime, seqNum, body in items:
+                    cur = self.db.execute('INSERT INTO outbox (sensor_ID, obs_time, seqNum, body, enqueued)'
+                                          ' VALUES (?,?,?,?,?)',
+                                          (sensorID, obsTime.isoformat(), seqNum, json.dumps(body), now))
+                    ids.append(cur.lastrowid)
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+        return ids
+
+    def enqueue(self, sensorID, obsTime, seqNum, body):
+        return self.enqueue_many([(sensorID, obsTime, seqNum, body)])[0]
+
+    # Oldest unacknowledged rows with an id greater than afterId,
+    # as a list of (id, sensor_ID, post_data)
+    def peek(self, limit, afterId=0):
+        with self.lock:
+            rows = self.db.execute('SELECT id, sensor_ID, body FROM outbox WHERE id>? ORDER BY id LIMIT ?',
+                                   (afterId, limit)).fetchall()
+        return [(rowID, sensorID, json.loads(body)) for rowID, sensorID, body in rows]
+
+    # Remove rows that the server has confirmed
+    def ack(self, ids):
+        if not ids:
+            return
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.executemany('DELETE FROM outbox WHERE id=?', [(i,) for i in ids])
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+
+    # Count a failed upload attempt against rows that are still waiting
+    def record_attempt(self, ids):
+        if not ids:
+            return
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.executemany('UPDATE outbox SET attempts=attempts+1 WHERE id=?', [(i,) for i in ids])
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+
+    # seqNums of the rows for sensorID still waiting, with start < obsDateTime < end
+    def waiting_seqnums(self, sensorID, start, end):
+        with self.lock:
+            rows = self.db.execute('SELECT seqNum FROM outbox WHERE sensor_ID=? AND obs_time>? AND obs_time<?',
+                                   (sensorID, start.isoformat(), end.isoformat())).fetchall()
+        return set(seqNum for (seqNum,) in rows)
+
+    # Number of rows waiting to be uploaded
+    def depth(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
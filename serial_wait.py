@@ -0,0 +1,176 @@
+#
+# Serial wait
+#
+# Blocking waits for the Bluetooth serial port, so the main loop sleeps in the
+# kernel instead of polling.
+#
+#   wait_readable(ser, timeout)  returns as soon as the port has input (or an
+#                                error), using poll() on its file descriptor.
+#                                Wake-up is immediate, so grabbing the OLA menu
+#                                is at least as quick as the old 0.1 ms sleep
+#                                loop, and an idle loop uses no CPU.
+#   wait_for_device(path)        waits for /dev/rfcomm0 to (re)appear using
+#                                inotify on its directory, instead of checking
+#                                every 3 seconds.  Falls back to checking every
+#                                POLL_INTERVAL seconds where inotify is not
+#                                available.
+#
+# Running this file benchmarks wake-up latency and CPU use against a pty
+# standing in for the port:
+#   python3 serial_wait.py [numWakes]
+#
+
+import ctypes
+import ctypes.util
+import os
+import pty
+import random
+import select
+import sys
+import tempfile
+import threading
+import time
+
+POLL_INTERVAL = 3       # seconds between checks for the device when inotify is not available
+POLL_INPUT = select.POLLIN | select.POLLPRI
+POLL_ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+# inotify flags from <sys/inotify.h>
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+_libc = None
+
+
+# Wait until the serial port has something to read, or timeout seconds.
+# Returns True if it woke because of the port.  A closed port just sleeps.
+def wait_readable(ser, timeout):
+    try:
+        fd = ser.fileno()
+    except Exception:
+        time.sleep(timeout)     # port is closed - nothing to wait on
+        return False
+    p = select.poll()
+    p.register(fd, POLL_INPUT | POLL_ERROR)
+    events = p.poll(timeout * 1000)
+    if not events:
+        return False
+    if not events[0][1] & POLL_INPUT:
+        # hung up or in error: poll would keep returning at once, so don't spin.
+        # The caller finds out when it next touches the port.
+        time.sleep(timeout)
+    return True
+
+
+# inotify file descriptor watching dirName for new entries, or None if inotify is not available
+def _watch_directory(dirName):
+    global _libc
+    try:
+        if _libc is None:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if _libc.inotify_add_watch(fd, os.fsencode(dirName), IN_CREATE | IN_MOVED_TO | IN_ATTRIB) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+# Wait for path to exist.  timeout is in seconds, None to wait forever.
+# Returns True if it exists.
+def wait_for_device(path, timeout=None):
+    if os.path.exists(path):
+        return True
+    deadline = None if timeout is None else time.monotonic() + timeout
+    fd = _watch_directory(os.path.dirname(path) or '.')
+    try:
+        while not os.path.exists(path):    # checked again after the watch is in place
+            waitTime = POLL_INTERVAL
+            if deadline is not None:
+                waitTime = min(waitTime, deadline - time.monotonic())
+                if waitTime <= 0:
+                    return False
+            if fd is None:
+                time.sleep(waitTime)
+                continue
+            # the events themselves don't matter, only that something changed
+            if select.select([fd], [], [], waitTime)[0]:
+                try:
+                    while os.read(fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+        return True
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+# The loop this replaces: check in_waiting, sleep 0.1 ms, repeat
+def _restless_wait(ser, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ser.in_waiting:
+            return True
+        time.sleep(0.0001)
+    return False
+
+
+def _measure(ser, master, wait, numWakes):
+    latencies = []
+    sent = []
+
+    def writer():
+        rnd = random.Random(1)
+        for i in range(numWakes):
+            time.sleep(rnd.uniform(0.02, 0.1))
+            sent.append(time.perf_counter())
+            os.write(master, b'x')
+
+    t = threading.Thread(target=writer)
+    cpuStart = time.thread_time()
+    wallStart = time.perf_counter()
+    t.start()
+    while len(latencies) < numWakes:
+        if wait(ser, 1):
+            now = time.perf_counter()
+            if ser.in_waiting:
+                ser.read(ser.in_waiting)
+                latencies.append(now - sent[len(latencies)])
+    t.join()
+    cpu = time.thread_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], cpu / wall
+
+
+def benchmark(numWakes=200):
+    import serial
+    master, slave = pty.openpty()
+    ser = serial.Serial(os.ttyname(slave), 115200, timeout=3)
+    print('serial wake-up latency over a pty, %d wakes' % numWakes)
+    for name, wait in (('sleep 0.1 ms (old)', _restless_wait), ('poll', wait_readable)):
+        median, p99, cpu = _measure(ser, master, wait, numWakes)
+        print('%-20s median %7.3f ms  p99 %7.3f ms  CPU %5.1f%% of a core'
+              % (name, median * 1000, p99 * 1000, cpu * 100))
+    ser.close()
+    os.close(master)
+    os.close(slave)
+
+    path = os.path.join(tempfile.mkdtemp(), 'rfcomm0')
+    threading.Timer(0.5, lambda: open(path, 'w').close()).start()
+    start = time.perf_counter()
+    wait_for_device(path)
+    print('device appeared, noticed after %.1f ms (was up to %d s)'
+          % ((time.perf_counter() - start - 0.5) * 1000, POLL_INTERVAL))
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,157 @@
+#
+# Settings
+#
+# The [dataHandler] section of config.ini, read once, checked and converted to
+# the types the program uses, so the rest of the code reads plain attributes
+# (settings.SENSOR_OFFSET is already a float) instead of looking strings up in
+# the config and converting them for every row.
+#
+# A Settings object is never changed after it is built.  To pick up an edited
+# config.ini, load_settings() builds a new one and the caller swaps it in with
+# a single assignment, so anything holding the old one (another thread part way
+# through a post, say) sees a consistent set of values.  If the new file does
+# not read or does not check out, SettingsError lists every problem and the
+# old settings stay in use.
+#
+# ConfigWatch tells when config.ini has been replaced or edited.
+#
+# Every key the program uses is listed in SPEC with its type and its default,
+# or REQUIRED if config.ini must have it.
+#
+
+import os
+
+from configobj import ConfigObj, ConfigObjError
+
+REQUIRED = object()
+
+
+class SettingsError(Exception):
+    pass
+
+
+# Conversions for SPEC: each takes the string from config.ini and returns the value or raises ValueError
+def _text(value):
+    if isinstance(value, list):     # ConfigObj splits unquoted values with commas into lists
+        value = ','.join(value)
+    return str(value)
+
+
+def _positive_int(value):
+    n = int(value)
+    if n < 1:
+        raise ValueError('must be at least 1')
+    return n
+
+
+def _positive_float(value):
+    x = float(value)
+    if x <= 0:
+        raise ValueError('must be more than 0')
+    return x
+
+
+def _db_url(value):
+    value = _text(value).strip()
+    if not value.lower().startswith(('http://', 'https://', 'no')):
+        raise ValueError('must start with http://, https:// or "no"')
+    return value.rstrip('/')
+
+
+def _not_empty(value):
+    value = _text(value).strip()
+    if not value:
+        raise ValueError('must not be empty')
+    return value
+
+
+SPEC = [
+    ('PLACE', _text, REQUIRED),
+    ('SITE_ID', _not_empty, REQUIRED),
+    ('SENSOR_OFFSET', float, REQUIRED),
+    ('SENSOR_TEMP_FACTOR', float, REQUIRED),
+    ('CALIBRATION_FILE', _text, ''),
+    ('MAX_FILES_ON_OLA', _positive_int, REQUIRED),
+    ('DELETE_MIN_BACKLOG', _positive_int, 5),
+    ('LOGGED_FILE_DIR', _not_empty, REQUIRED),
+    ('LOGGED_FILE_SYNC_INTERVAL', _positive_float, 30),
+    ('ARCHIVE_DIR', _not_empty, '/home/pi/data/archive/'),
+    ('ARCHIVE_FLUSH_INTERVAL', _positive_float, 300),
+    ('DOWNLOADED_FILE_DIR', _not_empty, REQUIRED),
+    ('DB_URL', _db_url, REQUIRED),
+    ('API_USER', _text, ''),
+    ('API_PASS', _text, ''),
+    ('DB_BATCH_SIZE', _positive_int, 1),
+    ('OUTBOX_FILE', _not_empty, '/home/pi/data/outbox.sqlite'),
+    ('UPLOAD_WORKERS', _positive_int, 2),
+    ('UPLOAD_MANIFEST_FILE', _not_empty, '/home/pi/data/upload_manifest.json'),
+    ('SYNC_CURSOR_FILE', _not_empty, '/home/pi/data/sync_cursor.json'),
+    ('SYNC_RECONCILE_INTERVAL', _positive_int, 3600),
+    ('OLA_LISTING_FILE', _not_empty, '/home/pi/data/ola_listing.json'),
+    ('GAP_INDEX_FILE', _not_empty, '/home/pi/data/gap_index.json'),
+    ('UPLOADED_KEYS_DIR', _not_empty, '/home/pi/data/uploaded_keys/'),
+    ('MAX_DATA_DELAY', _positive_float, 2400),
+]
+
+
+class Settings:
+    # section is the [dataHandler] section (or any dict of strings)
+    def __init__(self, section):
+        errors = []
+        for key, convert, default in SPEC:
+            if key not in section:
+                if default is REQUIRED:
+                    errors.append(key + ' is missing')
+                    continue
+                value = default
+            else:
+                try:
+                    value = convert(section[key])
+                except (ValueError, TypeError) as ex:
+                    errors.append(key + ' = ' + repr(section[key]) + ': ' + str(ex))
+                    continue
+            object.__setattr__(self, key, value)
+        if errors:
+            raise SettingsError(errors)
+        # worked out once here instead of for every row
+        object.__setattr__(self, 'NO_LOGGING', self.DB_URL.lower().startswith('no'))
+        object.__setattr__(self, 'section', section)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('settings are read-only; load new ones instead')
+
+    # Keys whose values differ from other (a Settings)
+    def changed(self, other):
+        return [key for key, convert, default in SPEC if getattr(self, key) != getattr(other, key)]
+
+
+# Settings from the [dataHandler] section of a config file
+def load_settings(fileName):
+    try:
+        config = ConfigObj(fileName, file_error=True)
+    except (OSError, ConfigObjError) as ex:
+        raise SettingsError([fileName + ': ' + str(ex)])
+    if 'dataHandler' not in config:
+        raise SettingsError([fileName + ' has no [dataHandler] section'])
+    return Settings(config['dataHandler'])
+
+
+# Tells when a file has been edited or replaced since the last time changed() said so
+class ConfigWatch:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.last = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.fileName)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def changed(self):
+        now = self._stat()
+        if now is None or now == self.last:
+            return False    # a missing file is left alone - it is probably being replaced
+        self.last = now
+        return True
@@ -0,0 +1,131 @@
+#
+# Sync cursor
+#
+# Local record, per SITE_ID, of the newest observation known to be in the
+# database (its time and seqNum).  It moves forward every time an upload is
+# acknowledged, so catch-up can start right away from here instead of asking
+# the server with /get_latest_measurement first.  The server is still asked now
+# and then (every reconcileInterval seconds, and after an upload error) and its
+# answer replaces ours, in case rows went missing or were written by someone
+# else.
+#
+# Times are stored in UTC.  Callers give and get naive local times, the same
+# as OLAdata.obsDateTime, and server times are converted with the real local
+# UTC offset (daylight saving included) rather than a fixed number of hours.
+#
+# The cursor is a small JSON file, rewritten atomically.  Advancing it happens
+# for every acknowledged upload, so that only marks it as changed and the caller
+# saves it at most every saveInterval seconds with save_if_due() (losing the
+# last few advances after a crash only means catch-up starts a little early).
+# Marking it stale or reconciling it is saved right away.  A save that fails is
+# logged and tried again later instead of being raised to the caller, which is
+# usually the uploader.
+#
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# Convert a time from the server ('2021-04-27T16:00:00+00:00') to naive local time
+def server_time_to_local(s):
+    t = datetime.strptime(s, "%Y-%m-%dT%H:%M:%S+00:00").replace(tzinfo=timezone.utc)
+    return t.astimezone().replace(tzinfo=None)
+
+
+class SyncCursor:
+    def __init__(self, fileName, reconcileInterval=3600, saveInterval=60, log=print):
+        self.fileName = fileName
+        self.reconcileInterval = reconcileInterval
+        self.saveInterval = saveInterval
+        self.log = log
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.lastSave = time.monotonic()
+        try:
+            f = open(fileName, 'rt')
+            self.sites = json.load(f)
+            f.close()
+        except (OSError, ValueError):
+            self.sites = {}     # no cursor yet (or unreadable) - the server will be asked
+
+    def save(self):
+        with self.lock:
+            self._write()
+
+    def save_if_due(self):
+        if self.dirty and time.monotonic() - self.lastSave >= self.saveInterval:
+            self.save()
+
+    # Write the file (called with the lock held).  On failure it stays dirty for the next try.
+    def _write(self):
+        self.lastSave = time.monotonic()
+        try:
+            dirName = os.path.dirname(self.fileName)
+            if dirName and not os.path.isdir(dirName):
+                os.makedirs(dirName)
+            tmpName = self.fileName + '.tmp'
+            f = open(tmpName, 'wt')
+            json.dump(self.sites, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(tmpName, self.fileName)
+            self.dirty = False
+        except OSError as ex:
+            self.dirty = True
+            self.log("Could not save the sync cursor " + self.fileName)
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            self.log(message)
+
+    # (naive local time, seqNum) of the newest row in the database, or None
+    def get(self, siteID):
+        with self.lock:
+            entry = self.sites.get(siteID)
+            if entry is None:
+                return None
+            t = datetime.fromisoformat(entry['time']).astimezone().replace(tzinfo=None)
+            return t, entry['seqNum']
+
+    # True if the server should be asked before the cursor is trusted
+    def needs_reconcile(self, siteID):
+        with self.lock:
+            entry = self.sites.get(siteID)
+            return (entry is None or entry['stale']
+                    or time.time() - entry['reconciled'] > self.reconcileInterval)
+
+    # An upload for this site failed - check with the server next time
+    def mark_stale(self, siteID):
+        with self.lock:
+            entry = self.sites.get(siteID)
+            if entry is None or entry['stale']:
+                return
+            entry['stale'] = True
+            self._write()
+
+    # Rows up to obsTime (naive local or timezone aware) and seqNum are in the
+    # database.  The cursor only moves forward.
+    def advance(self, siteID, obsTime, seqNum):
+        utc = obsTime.astimezone(timezone.utc)
+        with self.lock:
+            entry = self.sites.get(siteID)
+            if entry is not None and datetime.fromisoformat(entry['time']) >= utc:
+                return
+            if entry is None:
+                entry = {'stale': True, 'reconciled': 0}    # never checked with the server
+                self.sites[siteID] = entry
+            entry['time'] = utc.isoformat()
+            entry['seqNum'] = seqNum
+            self.dirty = True
+
+    # Take the server's latest row as the truth
+    def reconcile(self, siteID, obsTime, seqNum):
+        with self.lock:
+            self.sites[siteID] = {'time': obsTime.astimezone(timezone.utc).isoformat(),
+                                  'seqNum': seqNum,
+                                  'stale': False,
+                                  'reconciled': time.time()}
+            self._write()
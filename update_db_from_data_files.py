@@ -3,6 +3,13 @@
 # for times when some data did not go into the database for unforeseen
 # reasons.  Duplicate entries should be ignored by the database.
 #
+# Rows the database has already confirmed (recorded in UPLOADED_KEYS_DIR by
+# dataHandler and by earlier runs of this program) are not sent again, so a
+# re-run only posts what is missing.
+#
+# For a whole SD card, backfill.py does the same job with several files parsed
+# and several uploads in flight at once, and can be stopped and resumed.
+#
 # Modified 8/18/22 to accept a directory name and optional config file name.
 # This is useful when updating files that were from some other gateway than the
 # one being used to run this program.  (I.E. retrieved a sensor with files that were not uploaded)
@@ -29,51 +36,16 @@ import glob
 from datetime import datetime
 from datetime import timedelta
 from configobj import ConfigObj
+from ola_data import OLAdata, parse_ola_line
+from calibration import load_calibration
+from uploaded_keys import UploadedKeys
 
 # if we catch a signal from the OS, clean up and exit
 def signal_handler(sig, frame):
     print('Intercepted a signal - Stopping!', flush=True)
+    uploaded.save()
     sys.exit(0)
     
-# Class to contain the OLA data.  Attempts to parse the data.
-# If parsing fails, self.inString will be set to empty    
-class OLAdata:
-    def __init__(self, inData):
-        self.obsNum=-999
-        if inData=='':
-            self.inString=''
-        else:
-            # Parse the incoming data into vars if it looks like data
-            self.inString = inData.decode()
-            self.parseData()
-
-    # If the inData look like real data populate the variables
-    # otherwise leave them uninitialized.    
-
-#   This version of parseData is for the Bar02 sensor
-    def parseData(self):
-        l = self.inString.split(',')
-        if len(l)==11:     # num elements+1, split makes a token out of the trailing crlf
-            # If any exception, clear the input.  If it was a bad transmission
-            # the check sequential step should catch it.
-            try:
-                self.obsDateTime = datetime.strptime(l[0]+' '+l[1], "%m/%d/%Y %H:%M:%S.%f")
-                self.battVolts = float(l[2])
-                self.aX = float(l[3])
-                self.aY = float(l[4])
-                self.aZ = float(l[5])
-                self.temp = float(l[6])
-                self.press = float(l[7])
-                self.wtemp = float(l[8])
-                self.obsNum = int(l[9])
-                #print(vars(self))
-            except:
-                self.inString = ''# Clear inString if this fails parsing
-        else:
-            self.inString = ''    # Clear inString if this fails parsing
-            
-
-
 # write the observation to the cloud database
 def write_database(newData):
     # database access is through http "post" for example:
@@ -91,7 +63,8 @@ def write_database(newData):
 
                   # Calibrate pressure value while writing to database
                   'raw_pressure':newData.press,
-                  'pressure':newData.press - float(config['dataHandler']['SENSOR_OFFSET']) - (float(config['dataHandler']['SENSOR_TEMP_FACTOR']) * newData.wtemp),
+                  'pressure':calibration.pressure(config['dataHandler']['SITE_ID'], newData.obsDateTime, newData.press, newData.wtemp,
+                                                  (float(config['dataHandler']['SENSOR_OFFSET']), float(config['dataHandler']['SENSOR_TEMP_FACTOR']))),
                   'voltage':newData.battVolts,
                   'seqNum':newData.obsNum,
                   'aX':newData.aX,
@@ -132,6 +105,8 @@ def update_db_from_data_files():
     # check to see if we have the next sequence number in the data files
     # if so, write it to the db.  Do this until caught up
     prevData = OLAdata('')    
+    siteID = config['dataHandler']['SITE_ID']
+    numSkipped = 0
     print("Attempting to catch database up from ALL data files past the following date:")
     lastDate = datetime.today() - timedelta( days=DAYS_AGO )     # within the last n days
     print(lastDate)
@@ -145,10 +120,17 @@ def update_db_from_data_files():
         # if not, we tried, we failed.  Will have to try again
         f = open(fn, "rt")
         for fline in f:
-            fdata = OLAdata(fline.encode("ascii", "ignore"))
-            if fdata.inString != '':    # if the line fails parsing we will skip it.
-                if fdata.obsDateTime > lastDate:
+            fdata = parse_ola_line(fline)
+            if fdata is not None:    # if the line fails parsing we will skip it.
+                if fdata.obsDateTime > lastDate and (siteID, fdata.obsDateTime, fdata.obsNum) in uploaded:
+                    lastDate = fdata.obsDateTime    # already in the database
+                    prevData = fdata
+                    numSkipped = numSkipped + 1
+                    success = True
+                elif fdata.obsDateTime > lastDate:
                     if write_database(fdata) == True:
+                        uploaded.add(siteID, fdata.obsDateTime, fdata.obsNum)
+                        uploaded.save_if_due()
                         print('Successfully wrote: ', end='')
                         print(fdata.inString, end='', flush=True)
                         lastDate = fdata.obsDateTime
@@ -157,11 +139,14 @@ def update_db_from_data_files():
                     else:
                         success = False
                         f.close()
+                        uploaded.save()
                         print("\nWrite database failed.  Failed attempt to catch database up from downloaded data files.")
                         return prevData   # if we fail, get out and try again later
                 else:
                     success = False
         f.close()
+    uploaded.save()
+    print("\n" + str(numSkipped) + " rows were already in the database and were not sent again.")
             
     if success == True:
         print("\nSuccessfully caught database up using downloaded data files.")
@@ -184,6 +169,10 @@ if __name__ == "__main__":
         config = ConfigObj(sys.argv[2])
     else:
         config = ConfigObj("/home/pi/bin/config.ini")  # Read the config file (current directory)
+    # calibration history, so rows from before a sensor swap get that sensor's calibration
+    calibration = load_calibration(config['dataHandler'].get('CALIBRATION_FILE', ''))
+    # rows already in the database
+    uploaded = UploadedKeys(config['dataHandler'].get('UPLOADED_KEYS_DIR', '/home/pi/data/uploaded_keys/'))
     
     # catch some signals and perform an orderly shutdown
     signal.signal(signal.SIGTERM, signal_handler)
@@ -3,6 +3,10 @@
 # for times when some data did not go into the database for unforeseen
 # reasons.  Duplicate entries should be ignored by the database.
 #
+# Rows the database has already confirmed (recorded in UPLOADED_KEYS_DIR by
+# dataHandler and by earlier runs of this program) are not sent again, so a
+# re-run only posts what is missing.
+#
 # Modified 8/18/22 to accept a directory name and optional config file name.
 # This is useful when updating files that were from some other gateway than the
 # one being used to run this program.  (I.E. retrieved a sensor with files that were not uploaded)
@@ -12,15 +16,22 @@
 #                Set the days_ago variable below if necessary, otherwise leave it big
 #                run
 #
-#   "Usage " + sys.argv[0] + " fileDirectory optionalConfigFile"
+#   "Usage " + sys.argv[0] + " fileDirectory optionalConfigFile [--anchor [N:]LOGGED=TRUE ...] [--reboot [N:]TRUE ...]"
 #   if config file is omitted, uses default config file in ~/bin
 #
+# The OLA clock is corrected with a model fitted from the anchors and reboot
+# times given on the command line (see clock_drift.py), instead of a timedelta
+# edited into this file.  The old fixed offset is a single anchor, e.g.
+#   --anchor "2000-01-05 18:26:27=2024-07-28 07:41:35"
+# The fitted segments are printed before anything is uploaded.
+#
 # Tony Whipple
 #
 
 # Set this to the number of days before now to start pushing data
 DAYS_AGO = 365
 
+import argparse
 import signal
 import sys
 import requests
@@ -29,55 +40,18 @@ import glob
 from datetime import datetime
 from datetime import timedelta
 from configobj import ConfigObj
-
-# establish the timedelta to add to the observations
-# TD = timedelta(0)
-TD = datetime(2024, 7, 28, 7, 41, 35) - datetime(2000, 1, 5, 18, 26, 27)
+from ola_data import OLAdata
+from calibration import load_calibration
+from uploaded_keys import UploadedKeys
+from clock_drift import ClockDriftError, fit_files, parse_anchor, parse_reboot
+import ola_bulk
 
 # if we catch a signal from the OS, clean up and exit
 def signal_handler(sig, frame):
     print('Intercepted a signal - Stopping!', flush=True)
+    uploaded.save()
     sys.exit(0)
     
-# Class to contain the OLA data.  Attempts to parse the data.
-# If parsing fails, self.inString will be set to empty    
-class OLAdata:
-    def __init__(self, inData):
-        self.obsNum=-999
-        if inData=='':
-            self.inString=''
-        else:
-            # Parse the incoming data into vars if it looks like data
-            self.inString = inData.decode()
-            self.parseData()
-
-    # If the inData look like real data populate the variables
-    # otherwise leave them uninitialized.    
-
-#   This version of parseData is for the Bar02 sensor
-    def parseData(self):
-        l = self.inString.split(',')
-        if len(l)==11:     # num elements+1, split makes a token out of the trailing crlf
-            # If any exception, clear the input.  If it was a bad transmission
-            # the check sequential step should catch it.
-            try:
-                self.obsDateTime = datetime.strptime(l[0]+' '+l[1], "%m/%d/%Y %H:%M:%S.%f")
-                self.battVolts = float(l[2])
-                self.aX = float(l[3])
-                self.aY = float(l[4])
-                self.aZ = float(l[5])
-                self.temp = float(l[6])
-                self.press = float(l[7])
-                self.wtemp = float(l[8])
-                self.obsNum = int(l[9])
-                #print(vars(self))
-            except:
-                self.inString = ''# Clear inString if this fails parsing
-        else:
-            self.inString = ''    # Clear inString if this fails parsing
-            
-
-
 # write the observation to the cloud database
 def write_database(newData):
     # database access is through http "post" for example:
@@ -95,7 +69,8 @@ def write_database(newData):
 
                   # Calibrate pressure value while writing to database
                   'raw_pressure':newData.press,
-                  'pressure':newData.press - float(config['dataHandler']['SENSOR_OFFSET']) - (float(config['dataHandler']['SENSOR_TEMP_FACTOR']) * newData.wtemp),
+                  'pressure':calibration.pressure(config['dataHandler']['SITE_ID'], newData.obsDateTime, newData.press, newData.wtemp,
+                                                  (float(config['dataHandler']['SENSOR_OFFSET']), float(config['dataHandler']['SENSOR_TEMP_FACTOR']))),
                   'voltage':newData.battVolts,
                   'seqNum':newData.obsNum,
                   'aX':newData.aX,
@@ -136,6 +111,8 @@ def update_db_from_data_files():
     # check to see if we have the next sequence number in the data files
     # if so, write it to the db.  Do this until caught up
     prevData = OLAdata('')    
+    siteID = config['dataHandler']['SITE_ID']
+    numSkipped = 0
     print("Attempting to catch database up from ALL data files past the following date:")
     lastDate = datetime.today() - timedelta( days=DAYS_AGO )     # within the last n days
     print(lastDate)
@@ -143,33 +120,53 @@ def update_db_from_data_files():
     # get a list of data files - since the dates in them are unknown, have to open them all
     flist = glob.glob(updateFileDir+'/dataLog?????.TXT')
     flist.sort()   # sort the file list ascending
+    # fit the clock correction to all of the files
+    try:
+        model = fit_files(flist, anchors, reboots, resetJump)
+    except ClockDriftError as ex:
+        print("Could not fit the clock correction:")
+        for problem in ex.args[0]:
+            print("    " + problem)
+        return prevData
+    for line in model.summary():
+        print(line)
     for fn in flist:
         # open the file and look for the first date that is greater
         # ignoring seqNum going by date only. insert it and loop to end
         # if not, we tried, we failed.  Will have to try again
-        f = open(fn, "rt")
-        for fline in f:
-            fdata = OLAdata(fline.encode("ascii", "ignore"))
-            if fdata.inString != '':    # if the line fails parsing we will skip it.
-                # add the timedelta to fData
-                fdata.obsDateTime = fdata.obsDateTime + TD
-    
-                if fdata.obsDateTime > lastDate:
-                    if write_database(fdata) == True:
-                        print('Successfully wrote: ', end='')
-                        print(fdata.obsDateTime.strftime('%m/%d/%Y,%H:%M:%S'), end='')
-                        print(fdata.inString[22:], end='', flush=True)
-                        lastDate = fdata.obsDateTime
-                        prevData = fdata
-                        success = True
-                    else:
-                        success = False
-                        f.close()
-                        print("\nWrite database failed.  Failed attempt to catch database up from downloaded data files.")
-                        return prevData   # if we fail, get out and try again later
+        # the same rows the clock correction was fitted to (lines that fail parsing are skipped),
+        # with the whole file's times corrected in one go
+        rows, endOffset, data = ola_bulk.load_data_file(fn)
+        rows = rows[rows['valid']]
+        fdataList = ola_bulk.to_oladata(rows, data)
+        corrected = model.correct(fn, rows['time']).tolist()
+        for fdata, obsDateTime in zip(fdataList, corrected):
+            fdata.obsDateTime = obsDateTime
+
+            if fdata.obsDateTime > lastDate and (siteID, fdata.obsDateTime, fdata.obsNum) in uploaded:
+                lastDate = fdata.obsDateTime    # already in the database
+                prevData = fdata
+                numSkipped = numSkipped + 1
+                success = True
+            elif fdata.obsDateTime > lastDate:
+                if write_database(fdata) == True:
+                    uploaded.add(siteID, fdata.obsDateTime, fdata.obsNum)
+                    uploaded.save_if_due()
+                    print('Successfully wrote: ', end='')
+                    print(fdata.obsDateTime.strftime('%m/%d/%Y,%H:%M:%S'), end='')
+                    print(fdata.inString[22:], end='', flush=True)
+                    lastDate = fdata.obsDateTime
+                    prevData = fdata
+                    success = True
                 else:
                     success = False
-        f.close()
+                    uploaded.save()
+                    print("\nWrite database failed.  Failed attempt to catch database up from downloaded data files.")
+                    return prevData   # if we fail, get out and try again later
+            else:
+                success = False
+    uploaded.save()
+    print("\n" + str(numSkipped) + " rows were already in the database and were not sent again.")
             
     if success == True:
         print("\nSuccessfully caught database up using downloaded data files.")
@@ -182,17 +179,33 @@ def main():
 
 if __name__ == "__main__":
     if len(sys.argv) == 1:
-        print("NOTE: In this version the time delta needs to be manually edited in the source code!\n")
-        print("Usage " + sys.argv[0] + " fileDirectory optionalConfigFile")
+        print("Usage " + sys.argv[0] + " fileDirectory optionalConfigFile [--anchor [N:]LOGGED=TRUE ...] [--reboot [N:]TRUE ...]")
         print("Looks in fileDirectory for files matching dataLog?????.TXT")
         print("  if config file is omitted, uses default config file in ~/bin")
+        print("  each --anchor says the OLA clock read LOGGED at the true time TRUE;")
+        print("  each --reboot gives the true time the OLA restarted (see clock_drift.py)")
         exit()
-    if len(sys.argv) > 1:
-        updateFileDir = sys.argv[1]
-    if len(sys.argv) > 2:
-        config = ConfigObj(sys.argv[2])
-    else:
-        config = ConfigObj("/home/pi/bin/config.ini")  # Read the config file (current directory)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fileDirectory')
+    parser.add_argument('configFile', nargs='?', default='/home/pi/bin/config.ini')
+    parser.add_argument('--anchor', action='append', default=[])
+    parser.add_argument('--reboot', action='append', default=[])
+    parser.add_argument('--reset-jump-hours', type=float, default=24,
+                        help='a backwards step in the logged time larger than this is a clock reset')
+    args = parser.parse_args()
+    updateFileDir = args.fileDirectory
+    config = ConfigObj(args.configFile)  # Read the config file
+    try:
+        anchors = [parse_anchor(a) for a in args.anchor]
+        reboots = [parse_reboot(r) for r in args.reboot]
+    except ClockDriftError as ex:
+        print(ex.args[0][0])
+        exit()
+    resetJump = timedelta(hours=args.reset_jump_hours)
+    # calibration history, so rows from before a sensor swap get that sensor's calibration
+    calibration = load_calibration(config['dataHandler'].get('CALIBRATION_FILE', ''))
+    # rows already in the database
+    uploaded = UploadedKeys(config['dataHandler'].get('UPLOADED_KEYS_DIR', '/home/pi/data/uploaded_keys/'))
     
     # catch some signals and perform an orderly shutdown
     signal.signal(signal.SIGTERM, signal_handler)
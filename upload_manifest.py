@@ -0,0 +1,81 @@
+#
+# Upload manifest
+#
+# Remembers, for each downloaded data file, how far into it the database has
+# been caught up, so a catch-up only has to read what is new:
+#
+#   size, mtime   what the file looked like when we last processed it
+#   offset        byte position just past the last row that was handled
+#                 (uploaded, or older than what the database already had)
+#   lastTime      timestamp of the last row uploaded from the file
+#   complete      the OLA has moved on to a later file and everything in this
+#                 one has been handled
+#
+# A complete file that has not changed is skipped without being opened, and a
+# file that has grown is read from the recorded offset.  If a file is found
+# to be shorter than the recorded offset it has been replaced, and is read from
+# the start again.
+#
+# The manifest is a small JSON file that is rewritten atomically after each
+# update, so a crash leaves either the old or the new version.
+#
+
+import json
+import os
+
+
+class UploadManifest:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.files = {}
+        try:
+            f = open(fileName, 'rt')
+            self.files = json.load(f)
+            f.close()
+        except (OSError, ValueError):
+            self.files = {}     # no manifest yet (or unreadable) - everything gets read in full
+
+    def save(self):
+        dirName = os.path.dirname(self.fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        tmpName = self.fileName + '.tmp'
+        f = open(tmpName, 'wt')
+        json.dump(self.files, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmpName, self.fileName)
+
+    # Where to start reading a file with this size and mtime, or None if it is
+    # complete and unchanged and does not need to be read at all.
+    def start_offset(self, name, size, mtime):
+        entry = self.files.get(name)
+        if entry is None:
+            return 0
+        if entry['complete'] and entry['size'] == size and entry['mtime'] == mtime:
+            return None
+        if size < entry['offset']:
+            return 0        # the file was replaced by a shorter one
+        return entry['offset']
+
+    # Record that everything before offset in the file has been handled
+    def record(self, name, size, mtime, offset, lastTime=None, complete=False):
+        entry = self.files.get(name, {'lastTime': None})
+        entry['size'] = size
+        entry['mtime'] = mtime
+        entry['offset'] = offset
+        entry['complete'] = complete
+        if lastTime is not None:
+            entry['lastTime'] = lastTime.isoformat()
+        self.files[name] = entry
+
+    # Forget a file that has been replaced, so it is read from the start again
+    def forget(self, name):
+        self.files.pop(name, None)
+
+    # Drop entries for files that are no longer there (for example after archiving)
+    def prune(self, names):
+        for name in list(self.files.keys()):
+            if name not in names:
+                del self.files[name]
@@ -0,0 +1,217 @@
+#
+# Uploaded keys
+#
+# Record of every observation the database has confirmed, so the backfill
+# tools (update_db_from_data_files*.py) only send rows it does not have yet
+# instead of posting a whole year again and leaving the server to drop the
+# duplicates.  dataHandler adds to it as its uploads are acknowledged.
+#
+# An observation's key is its time (to the hundredth of a second, like the OLA
+# writes it) and its seqNum packed into one 64 bit integer:
+#   hundredths of a second since 2000-01-01 (local) << 24 | seqNum (low 24 bits)
+# Each site has its own pair of files in the directory:
+#   <site>.keys   the keys, sorted, as little-endian int64 - 8 bytes a row
+#   <site>.new    keys added since, in the order they came, same format
+# Lookups are a binary search of the sorted keys plus a set of the new ones.
+# New keys are appended to .new when save() is called, and once there are
+# more than compactAt of them they are merged into .keys (rewritten
+# atomically, then .new is emptied; a crash in between only leaves keys that
+# are in both).  A lock file keeps dataHandler and a backfill from doing this
+# at the same time.
+#
+# Keys are only added after the server has confirmed the row, so a missing
+# or out of date record only costs extra posts, never a row that is not sent.
+#
+# Running this file checks and times lookups for a year of one-a-minute rows:
+#   python3 uploaded_keys.py
+#
+
+import bisect
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+EPOCH = datetime(2000, 1, 1)
+SEQ_BITS = 24
+
+
+def make_key(obsDateTime, seqNum):
+    dt = obsDateTime - EPOCH
+    hundredths = (dt.days * 86400 + dt.seconds) * 100 + (dt.microseconds + 5000) // 10000
+    return (hundredths << SEQ_BITS) | (seqNum & ((1 << SEQ_BITS) - 1))
+
+
+def _read_keys(fn):
+    keys = array('q')
+    try:
+        f = open(fn, 'rb')
+    except FileNotFoundError:
+        return keys
+    data = f.read()
+    f.close()
+    keys.frombytes(data[:len(data) - len(data) % keys.itemsize])   # drop a partly written key
+    if sys.byteorder != 'little':
+        keys.byteswap()
+    return keys
+
+
+def _key_bytes(keys):
+    keys = array('q', keys)
+    if sys.byteorder != 'little':
+        keys.byteswap()
+    return keys.tobytes()
+
+
+class UploadedKeys:
+    def __init__(self, directory, saveInterval=60, compactAt=50000):
+        self.directory = directory
+        self.saveInterval = saveInterval
+        self.compactAt = compactAt
+        self.lock = threading.Lock()
+        self.sorted = {}        # site -> array of keys from .keys
+        self.new = {}           # site -> set of keys from .new and added since
+        self.numJournal = {}    # site -> number of keys in .new
+        self.pending = {}       # site -> keys added but not saved yet
+        self.lastSave = time.monotonic()
+
+    def _file(self, siteID, suffix):
+        return os.path.join(self.directory, siteID + suffix)
+
+    # Read a site's files the first time it is used (called with the lock held)
+    def _load(self, siteID):
+        if siteID not in self.sorted:
+            journal = _read_keys(self._file(siteID, '.new'))
+            self.sorted[siteID] = _read_keys(self._file(siteID, '.keys'))
+            self.new[siteID] = set(journal)
+            self.numJournal[siteID] = len(journal)
+            self.pending[siteID] = []
+
+    def __contains__(self, item):
+        siteID, obsDateTime, seqNum = item
+        key = make_key(obsDateTime, seqNum)
+        with self.lock:
+            self._load(siteID)
+            if key in self.new[siteID]:
+                return True
+            keys = self.sorted[siteID]
+            i = bisect.bisect_left(keys, key)
+            return i < len(keys) and keys[i] == key
+
+    # The items of rows, a list of (obsDateTime, seqNum, item), whose keys are not recorded for siteID
+    def unseen(self, siteID, rows):
+        with self.lock:
+            self._load(siteID)
+            keys = self.sorted[siteID]
+            new = self.new[siteID]
+            result = []
+            for obsDateTime, seqNum, item in rows:
+                key = make_key(obsDateTime, seqNum)
+                if key in new:
+                    continue
+                i = bisect.bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    continue
+                result.append(item)
+            return result
+
+    # Record confirmed rows, a list of (obsDateTime, seqNum), for siteID
+    def add_many(self, siteID, rows):
+        with self.lock:
+            self._load(siteID)
+            for obsDateTime, seqNum in rows:
+                key = make_key(obsDateTime, seqNum)
+                if key not in self.new[siteID]:
+                    self.new[siteID].add(key)
+                    self.pending[siteID].append(key)
+
+    def add(self, siteID, obsDateTime, seqNum):
+        self.add_many(siteID, [(obsDateTime, seqNum)])
+
+    def save(self):
+        with self.lock:
+            self.lastSave = time.monotonic()
+            toSave = [(siteID, keys) for siteID, keys in self.pending.items() if keys]
+            for siteID, keys in toSave:
+                self.pending[siteID] = []
+        if not toSave:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        lockFile = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            for siteID, keys in toSave:
+                f = open(self._file(siteID, '.new'), 'ab')
+                f.write(_key_bytes(keys))
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+                with self.lock:
+                    self.numJournal[siteID] = self.numJournal[siteID] + len(keys)
+                    compact = self.numJournal[siteID] > self.compactAt
+                if compact:
+                    self._compact(siteID)
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+            lockFile.close()
+
+    def save_if_due(self):
+        if any(self.pending.values()) and time.monotonic() - self.lastSave >= self.saveInterval:
+            self.save()
+
+    # Merge .new into .keys (called with the lock file held).  The files are read
+    # again so keys another process saved since we loaded them are kept.
+    def _compact(self, siteID):
+        keysName = self._file(siteID, '.keys')
+        merged = sorted(set(_read_keys(keysName)).union(_read_keys(self._file(siteID, '.new'))))
+        f = open(keysName + '.tmp', 'wb')
+        f.write(_key_bytes(merged))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(keysName + '.tmp', keysName)
+        os.truncate(self._file(siteID, '.new'), 0)
+        with self.lock:
+            self.sorted[siteID] = array('q', merged)
+            self.new[siteID] = set(self.pending[siteID])
+            self.numJournal[siteID] = 0
+
+
+def benchmark():
+    directory = tempfile.mkdtemp()
+    start = datetime(2025, 10, 1)
+    numRows = 365 * 24 * 60
+    rows = [(start + timedelta(minutes=i, milliseconds=10 * (i % 100)), i) for i in range(numRows)]
+
+    t0 = time.perf_counter()
+    record = UploadedKeys(directory, compactAt=100000)
+    for i in range(0, numRows, 1000):
+        record.add_many('TT_01', rows[i:i+1000])
+        record.save()
+    addTime = time.perf_counter() - t0
+    record.add('TT_01', datetime(2026, 10, 1), 7)   # not saved
+
+    t0 = time.perf_counter()
+    record = UploadedKeys(directory)
+    # the year again with every 100th row missing from the record and one from another site
+    query = [(t, seq, seq) for t, seq in rows if seq % 100] + [(start + timedelta(minutes=5), 5, 'new')]
+    found = record.unseen('TT_01', query)
+    lookupTime = time.perf_counter() - t0
+
+    ok = found == ['new'] and ('TT_01', rows[12345][0], 12345) in record
+    ok = ok and ('TT_01', datetime(2026, 10, 1), 7) not in record and ('CB_02', rows[0][0], 0) not in record
+    ok = ok and len(record.sorted['TT_01']) + len(record.new['TT_01']) == numRows
+    print('a year of rows (%d): recorded in %.2f s, all checked again in %.2f s, %.1f MB on disk, %s'
+          % (numRows, addTime, lookupTime, numRows * 8 / 1e6, 'checks passed' if ok else 'CHECKS FAILED'))
+    shutil.rmtree(directory)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark() else 1)
@@ -0,0 +1,205 @@
+#
+# Uploader
+#
+# Background upload stage that drains the outbox into the database.  The
+# serial read loop only enqueues; the (possibly slow) HTTP posts happen here
+# on a small, bounded pool of worker threads so that serial ingest latency
+# does not depend on how the network behaves.
+#
+# A dispatcher thread reads new rows from the outbox, groups them into
+# batches and hands up to UPLOAD_WORKERS batches to the pool at a time.
+# Batches can finish out of order, but rows are acknowledged (removed from
+# the outbox) strictly in order for each sensor: a row that was written is
+# held until every earlier row for the same sensor has been written too.
+# That way "everything up to here is in the database" is always true of
+# the acknowledged rows.  Rows that fail go back to the front of the line and
+# the dispatcher backs off before trying again.
+#
+
+import bisect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Uploader(threading.Thread):
+    # post_rows(list of post_data) must return how many rows, from the start
+    # of the list and in order, were written to the database.
+    # on_ack(sensorID, post_data), if given, is called with the newest row
+    # acknowledged for a sensor each time acknowledgement moves forward.
+    # on_ack_rows(list of (sensorID, post_data)), if given, is called with every
+    # row acknowledged, in order.
+    def __init__(self, outbox, post_rows, batchSize=50, concurrency=2, log=print, on_ack=None, on_ack_rows=None):
+        threading.Thread.__init__(self, name='uploader', daemon=True)
+        self.outbox = outbox
+        self.post_rows = post_rows
+        self.batchSize = max(1, batchSize)
+        self.concurrency = max(1, concurrency)
+        self.log = log
+        self.on_ack = on_ack
+        self.on_ack_rows = on_ack_rows
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='upload')
+        self.wakeEvent = threading.Event()
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.MIN_BACKOFF = 10       # seconds to wait after the first failure
+        self.MAX_BACKOFF = 300      # longest wait between attempts while the server is down
+        self.IDLE_WAIT = 60         # check the outbox at least this often even if nobody wakes us
+        self.STATUS_INTERVAL = 900  # how often to log the counters while there is a backlog
+        self.backoff = 0
+        self.retryAt = 0
+        self.lastStatus = time.time()
+
+        self.lastQueuedId = 0       # highest outbox id handed to the pool so far
+        self.inFlight = 0           # batches currently being posted
+        self.inFlightRows = 0
+        self.retryRows = []         # (id, sensor_ID, post_data) to send again, kept in id order
+        self.unacked = {}           # sensor_ID -> ids sent but not acknowledged, in id order
+        self.written = {}           # id -> post_data written but waiting on an earlier row
+        self.completed = []         # (rows, numWritten) handed back by the workers
+        self.pendingAck = []        # ids acknowledged but not removed from the outbox yet (it failed)
+
+        # running totals
+        self.numPosted = 0
+        self.numAcked = 0
+        self.numFailed = 0
+
+    # Called by the producer after enqueueing so the rows go out right away
+    def wake(self):
+        self.wakeEvent.set()
+
+    def stop(self):
+        self.stopping = True
+        self.wakeEvent.set()
+
+    # Queue-depth and throughput counters
+    def counters(self):
+        with self.lock:
+            return {'outbox': self.outbox.depth(),
+                    'in_flight': self.inFlightRows,
+                    'retry': len(self.retryRows),
+                    'held': len(self.written),
+                    'posted': self.numPosted,
+                    'acked': self.numAcked,
+                    'failed': self.numFailed}
+
+    def status_line(self):
+        return ', '.join(k + '=' + str(v) for k, v in self.counters().items())
+
+    # Next batch to send: rows waiting for a retry first, then new rows from the outbox
+    def next_batch(self):
+        if self.retryRows:
+            batch = self.retryRows[:self.batchSize]
+            del self.retryRows[:self.batchSize]
+            return batch
+        batch = self.outbox.peek(self.batchSize, self.lastQueuedId)
+        if batch:
+            self.lastQueuedId = batch[-1][0]
+            for rowID, sensorID, body in batch:
+                self.unacked.setdefault(sensorID, []).append(rowID)
+        return batch
+
+    # Runs on a pool thread
+    def post_batch(self, batch):
+        try:
+            numWritten = self.post_rows([body for rowID, sensorID, body in batch])
+        except Exception as ex:
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            self.log(message)
+            numWritten = 0
+        with self.lock:
+            self.completed.append((batch, numWritten))
+        self.wakeEvent.set()
+
+    # Account for finished batches and acknowledge whatever is now in order
+    def collect_finished(self):
+        with self.lock:
+            completed = self.completed
+            self.completed = []
+        if not completed and not self.pendingAck:
+            return
+
+        ackIds = []
+        newestAcked = {}
+        ackedRows = []
+        failedIds = []
+        with self.lock:
+            for batch, numWritten in completed:
+                self.inFlight = self.inFlight - 1
+                self.inFlightRows = self.inFlightRows - len(batch)
+                self.numPosted = self.numPosted + numWritten
+                for rowID, sensorID, body in batch[:numWritten]:
+                    self.written[rowID] = body
+                for row in batch[numWritten:]:
+                    bisect.insort(self.retryRows, row)     # ids are unique so tuples sort by id
+                    failedIds.append(row[0])
+                if numWritten < len(batch):
+                    self.numFailed = self.numFailed + len(batch) - numWritten
+
+            for sensorID, ids in self.unacked.items():
+                n = 0
+                while n < len(ids) and ids[n] in self.written:
+                    newestAcked[sensorID] = self.written.pop(ids[n])
+                    ackedRows.append((sensorID, newestAcked[sensorID]))
+                    n = n + 1
+                ackIds.extend(ids[:n])
+                del ids[:n]
+            self.numAcked = self.numAcked + len(ackIds)
+
+        self.pendingAck.extend(ackIds)
+        self.outbox.ack(self.pendingAck)
+        self.pendingAck = []
+        self.outbox.record_attempt(failedIds)
+        if self.on_ack is not None:
+            for sensorID, body in newestAcked.items():
+                self.on_ack(sensorID, body)
+        if self.on_ack_rows is not None and ackedRows:
+            self.on_ack_rows(ackedRows)
+
+        if failedIds:
+            self.backoff = min(self.MAX_BACKOFF, max(self.MIN_BACKOFF, self.backoff * 2))
+            self.retryAt = time.time() + self.backoff
+            self.log("Upload failed.  Retrying in " + str(self.backoff) + " s.  " + self.status_line())
+        elif self.backoff:
+            self.backoff = 0
+            self.log("Database reachable again.  " + self.status_line())
+
+    # One pass of the dispatcher.  Returns how long to wait before the next one.
+    def dispatch(self):
+        self.collect_finished()
+
+        waitTime = self.IDLE_WAIT
+        now = time.time()
+        if now < self.retryAt:
+            waitTime = self.retryAt - now   # backing off - let in-flight batches finish but send nothing new
+        else:
+            while self.inFlight < self.concurrency:
+                batch = self.next_batch()
+                if not batch:
+                    break
+                with self.lock:
+                    self.inFlight = self.inFlight + 1
+                    self.inFlightRows = self.inFlightRows + len(batch)
+                self.pool.submit(self.post_batch, batch)
+
+        if now - self.lastStatus > self.STATUS_INTERVAL:
+            self.lastStatus = now
+            if self.inFlight or self.retryRows or self.outbox.depth():
+                self.log("Uploader: " + self.status_line())
+        return waitTime
+
+    # The dispatcher must keep going whatever happens (a full disk, a locked outbox),
+    # or nothing more gets uploaded until the program restarts
+    def run(self):
+        while not self.stopping:
+            self.wakeEvent.clear()
+            try:
+                waitTime = self.dispatch()
+            except Exception as ex:
+                self.log("Exception in the uploader.  Trying again in " + str(self.MIN_BACKOFF) + " s.")
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                message = template.format(type(ex).__name__, ex.args)
+                self.log(message)
+                waitTime = self.MIN_BACKOFF
+            self.wakeEvent.wait(waitTime)
@@ -0,0 +1,198 @@
+#
+# OLA wake window
+#
+# The OLA only answers on Bluetooth while it is awake to take a sample.  To get
+# its menu we used to send a space every 0.3 s until it woke up, which with a
+# long sampling interval means minutes of traffic and sensor current.
+#
+# Every observation carries its obsDateTime and sequence number, so the
+# sampling period is known.  WakeScheduler learns from recent observations
+#   - the period (median time between samples, per sequence number),
+#   - when the lines arrive here relative to obsDateTime (this also takes up
+#     any difference between the OLA and Pi clocks), and
+#   - the jitter in both, and
+#   - from the menu entries that hit, how long before its line the OLA
+#     actually answers (starting from WAKE_LEAD, and back to it after a miss),
+# and predicts the window around the next wake-up.  The caller sleeps until the
+# window opens, sends menu requests quickly through it, and only falls back to
+# the old hammering if the window is missed.
+#
+# It also keeps the hit rate and time-to-menu statistics for the log.
+#
+# Running this file simulates menu entry against an OLA with a jittery clock
+# and compares menu requests and time-to-menu with the old hammering:
+#   python3 wake_window.py [numTries]
+#
+
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+HISTORY = 20            # observations to learn from
+MIN_HISTORY = 4         # observations needed before predicting anything
+WAKE_LEAD = 2.0         # most seconds the OLA might be awake before its line arrives here
+MIN_JITTER = 0.5        # seconds either side of the prediction, however steady the OLA looks
+JITTER_FACTOR = 3.0     # window half-width in multiples of the observed jitter
+MAX_PERIOD_ERROR = 0.2  # deviations over this fraction of the period (late lines, missed samples) are not jitter
+SEND_INTERVAL = 0.05    # seconds between menu requests inside the window
+
+
+def _epoch(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+class WakeScheduler:
+    def __init__(self):
+        self.history = deque(maxlen=HISTORY)    # (obs epoch, obsNum, receive time)
+        self.times = deque(maxlen=HISTORY)      # recent times to menu
+        self.leads = deque(maxlen=HISTORY)      # how long before the predicted line the menu answered
+        self.arrive = None                      # predicted line time of the last window handed out
+        self.tries = 0
+        self.hits = 0
+        self.misses = 0
+        self.awake = 0
+
+    # A line just arrived with this obsDateTime and sequence number
+    def observe(self, obsDateTime, obsNum, received=None):
+        if received is None:
+            received = time.time()
+        obs = _epoch(obsDateTime)
+        if self.history and (obsNum <= self.history[-1][1] or obs <= self.history[-1][0]):
+            self.history.clear()    # OLA restarted or its clock was set - start learning again
+        self.history.append((obs, obsNum, received))
+
+    # (period, offset, jitter) in seconds, or None if there is not enough to go on.
+    # offset is how long after obsDateTime (in OLA time) the line arrives here.
+    def model(self):
+        if len(self.history) < MIN_HISTORY:
+            return None
+        h = list(self.history)
+        steps = [(b[0] - a[0]) / (b[1] - a[1]) for a, b in zip(h, h[1:])]
+        period = _median(steps)
+        if period <= 0:
+            return None
+        offsets = [received - obs for obs, obsNum, received in h]
+        offset = _median(offsets)
+        deviations = [abs(o - offset) for o in offsets] + [abs(s - period) for s in steps]
+        deviations = sorted(d for d in deviations if d < period * MAX_PERIOD_ERROR)
+        jitter = deviations[int(len(deviations) * 0.9)]
+        return period, offset, jitter
+
+    # (start, end) of the next wake window as time.time() values, or None to just hammer.
+    # A window that is already open counts as the next one.
+    def next_window(self, now=None):
+        if now is None:
+            now = time.time()
+        m = self.model()
+        if m is None:
+            return None
+        period, offset, jitter = m
+        halfWidth = max(MIN_JITTER, JITTER_FACTOR * jitter)
+        lastObs = self.history[-1][0]
+        n = max(1, int((now - offset - lastObs + halfWidth) // period) + 1)
+        arrive = lastObs + n * period + offset
+        lead = WAKE_LEAD
+        if self.leads:
+            lead = min(WAKE_LEAD, max(0.0, max(self.leads)))
+        start = arrive - lead - halfWidth
+        if start < now and arrive + halfWidth < now:     # only possible for a stale model
+            return None
+        self.arrive = arrive
+        return start, arrive + halfWidth
+
+    # Record how a menu entry went: how='awake' (answered straight away),
+    # 'hit' (in the predicted window), 'miss' (window missed, had to hammer)
+    # or 'hammer' (no prediction yet).  found is when the menu answered.
+    def record(self, how, seconds, found=None):
+        if found is None:
+            found = time.time()
+        self.tries = self.tries + 1
+        if how == 'hit':
+            self.hits = self.hits + 1
+            self.leads.append(self.arrive - found)
+        elif how == 'miss':
+            self.misses = self.misses + 1
+            self.leads.clear()      # back to the widest lead
+        elif how == 'awake':
+            self.awake = self.awake + 1
+        self.times.append(seconds)
+
+    def summary(self):
+        predicted = self.hits + self.misses
+        s = 'wake window hits ' + str(self.hits) + '/' + str(predicted)
+        if predicted:
+            s = s + ' (' + str(round(100 * self.hits / predicted)) + '%)'
+        s = s + ', already awake ' + str(self.awake) + '/' + str(self.tries)
+        if self.times:
+            s = s + ', time to menu median ' + str(round(_median(self.times), 1)) + \
+                ' s, max ' + str(round(max(self.times), 1)) + ' s'
+        return s
+
+
+# Simulated OLA: wakes every period +- jitter for awakeTime seconds, line arrives WAKE_LEAD
+# after waking.  Returns the wake times.
+def _simulated_wakes(period, jitter, count, rnd):
+    return [i * period + rnd.uniform(-jitter, jitter) for i in range(1, count + 1)]
+
+
+# Menu requests and time to menu for one call at time now, sending every interval
+# from the time the sender starts until the OLA is awake
+def _requests_until_awake(now, begin, wakes, awakeTime, interval):
+    t = max(now, begin)
+    for w in wakes:
+        if w + awakeTime < t:
+            continue
+        if t < w:
+            t = t + ((w - t) // interval + 1) * interval
+        if t <= w + awakeTime:
+            return int((t - max(now, begin)) / interval) + 1, t - now
+    return None
+
+
+def simulate(numTries=200, period=360.0, jitter=1.0, awakeTime=3.0):
+    rnd = random.Random(1)
+    wakes = _simulated_wakes(period, jitter, numTries + HISTORY + 2, rnd)
+    sched = WakeScheduler()
+    oldRequests = newRequests = 0
+    oldTimes = []
+    for i, w in enumerate(wakes[:-2]):
+        # the line arrives a little after the OLA wakes; OLA clock is 7 s fast
+        obsTime = w - 7.0
+        sched.observe(datetime.fromtimestamp(obsTime), i, received=w + WAKE_LEAD + rnd.uniform(0, 0.2))
+        if i < HISTORY:
+            continue
+        now = w + awakeTime + rnd.uniform(0.1, 5)   # just missed it
+        n, seconds = _requests_until_awake(now, now, wakes, awakeTime, 0.3)
+        oldRequests = oldRequests + n
+        oldTimes.append(seconds)
+        window = sched.next_window(now)
+        n, seconds = _requests_until_awake(now, window[0], wakes, awakeTime, SEND_INTERVAL)
+        if n * SEND_INTERVAL <= window[1] - window[0] + SEND_INTERVAL:
+            sched.record('hit', seconds, now + seconds)
+            newRequests = newRequests + n
+        else:
+            # missed - count the window's requests then hammer from the end of it
+            n2, seconds = _requests_until_awake(now, window[1], wakes, awakeTime, 0.3)
+            sched.record('miss', seconds, now + seconds)
+            newRequests = newRequests + int((window[1] - window[0]) / SEND_INTERVAL) + n2
+    tries = len(oldTimes)
+    print('%d menu entries, period %d s, jitter +-%.1f s' % (tries, period, jitter))
+    print('%-18s %7.1f requests per entry, median time to menu %5.1f s'
+          % ('hammer (old)', oldRequests / tries, _median(oldTimes)))
+    print('%-18s %7.1f requests per entry, median time to menu %5.1f s'
+          % ('wake window', newRequests / tries, _median(sched.times)))
+    print(sched.summary())
+
+
+if __name__ == "__main__":
+    simulate(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,645 @@
+#
+# ZModem
+#
+# ZModem receiver that runs on the serial port dataHandler already has open,
+# in place of starting `rz -r -U` with a shell for every file.
+#
+#   ZModemReceiver(ser, directory).receive()
+#
+# receives one `sz` session (normally one file from the OLA) into directory and
+# returns True if every file in it arrived complete.  Like `rz -r`, a file that
+# is already partly there is resumed from its current size (crash recovery), so
+# the OLA's active data file only costs the bytes appended since last time.  The
+# receiver asks the sender to start RESUME_OVERLAP bytes early and checks those
+# against the local copy; if they differ the local file is not a prefix of the
+# one being sent (new card, renumbered files) and it starts over from zero.  Data is written to the file
+# as each checked subpacket arrives, so an interrupted transfer keeps everything
+# that got through.  Each file gets a result in receiver.files with its byte
+# counts, time, throughput and error counters.
+#
+# The protocol handled is the usual subset: hex, binary (CRC-16) and binary
+# CRC-32 headers; ZCRCE/G/Q/W data subpackets; ZRPOS to restart after a bad
+# subpacket or a timeout; ZSINIT; ZFIN/"OO"; and the CAN CAN CAN CAN CAN abort.
+#
+# Running this file transfers synthetic files over a pty pair with a small
+# local sender, including a corrupted subpacket, a resume from a partial file,
+# a partial file that turns out to be something else, and a sender that dies in
+# the middle of a file:
+#   python3 zmodem.py
+#
+
+import binascii
+import fcntl
+import os
+import pty
+import random
+import re
+import shutil
+import sys
+import tempfile
+import termios
+import threading
+import time
+import zlib
+
+import serial_wait
+
+# framing characters
+ZPAD = 0x2a             # '*'
+ZDLE = 0x18             # ctrl-X, also CAN
+ZBIN = 0x41             # 'A' binary header, CRC-16
+ZHEX = 0x42             # 'B' hex header
+ZBIN32 = 0x43           # 'C' binary header, CRC-32
+ZCRCE = 0x68            # end of frame, header follows
+ZCRCG = 0x69            # more data follows, no reply
+ZCRCQ = 0x6a            # more data follows, reply with ZACK
+ZCRCW = 0x6b            # end of frame, reply with ZACK
+ZRUB0 = 0x6c            # escaped 0x7f
+ZRUB1 = 0x6d            # escaped 0xff
+FRAME_ENDS = (ZCRCE, ZCRCG, ZCRCQ, ZCRCW)
+FLOW_CONTROL = b'\x11\x13\x91\x93'     # XON/XOFF, always escaped by the sender so raw ones are noise
+
+# frame types
+ZRQINIT = 0
+ZRINIT = 1
+ZSINIT = 2
+ZACK = 3
+ZFILE = 4
+ZSKIP = 5
+ZNAK = 6
+ZABORT = 7
+ZFIN = 8
+ZRPOS = 9
+ZDATA = 10
+ZEOF = 11
+ZFERR = 12
+ZCRC = 13
+ZCHALLENGE = 14
+ZCOMPL = 15
+ZCAN = 16
+ZFREECNT = 17
+ZCOMMAND = 18
+
+# ZRINIT capability flags
+CANFDX = 0x01
+CANOVIO = 0x02
+CANFC32 = 0x20
+
+MAX_SUBPACKET = 8192
+RESUME_OVERLAP = 256    # bytes before the end of a partial file that are received again and checked
+PROGRESS_BYTES = 4096   # how often on_progress hears about a file that is arriving
+ABORT_SEQUENCE = b'\x18' * 8 + b'\x08' * 10
+ESCAPE_RE = re.compile(b'[\x10\x11\x13\x18\x90\x91\x93]')
+
+
+class ZModemTimeout(Exception):
+    pass
+
+
+class ZModemError(Exception):
+    pass
+
+
+class ZModemCancelled(Exception):
+    pass
+
+
+def escape(data):
+    return ESCAPE_RE.sub(lambda m: bytes((ZDLE, m.group()[0] ^ 0x40)), data)
+
+
+def position(p):
+    return int.from_bytes(p, 'little')
+
+
+# Framing shared by the receiver and the test sender.  port needs fileno(),
+# in_waiting, read(n) and write(data), like a pyserial Serial.
+class ZModemPort:
+    def __init__(self, port, timeout=10):
+        self.port = port
+        self.timeout = timeout
+        self.buf = bytearray()
+        self.pos = 0
+
+    def _fill(self, deadline):
+        del self.buf[:self.pos]
+        self.pos = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ZModemTimeout()
+            if serial_wait.wait_readable(self.port, remaining):
+                data = self.port.read(self.port.in_waiting or 1)
+                if data:
+                    self.buf += data
+                    return
+
+    # next byte from the port, ignoring XON/XOFF
+    def _raw(self, deadline):
+        while True:
+            if self.pos >= len(self.buf):
+                self._fill(deadline)
+            c = self.buf[self.pos]
+            self.pos = self.pos + 1
+            if c not in FLOW_CONTROL:
+                return c
+
+    # Five CANs in a row is a cancel.  Called after two have been read.
+    def _check_cancel(self, deadline):
+        for i in range(3):
+            if self._raw(deadline) != ZDLE:
+                raise ZModemError('bad escape')
+        raise ZModemCancelled()
+
+    # next ZDLE-decoded byte; frame ends come back as 0x100 | the frame end
+    def _zdl(self, deadline):
+        c = self._raw(deadline)
+        if c != ZDLE:
+            return c
+        c = self._raw(deadline)
+        if c in FRAME_ENDS:
+            return 0x100 | c
+        if c == ZRUB0:
+            return 0x7f
+        if c == ZRUB1:
+            return 0xff
+        if c == ZDLE:
+            self._check_cancel(deadline)
+        if c & 0x60 != 0x40:
+            raise ZModemError('bad escape')
+        return c ^ 0x40
+
+    # Wait for a header.  Returns (frame type, 4 header bytes, uses CRC-32).
+    # Anything before the header is skipped.
+    def read_header(self, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        seenPad = False
+        numCan = 0
+        while True:
+            c = self._raw(deadline)
+            numCan = numCan + 1 if c == ZDLE else 0
+            if numCan >= 5:
+                raise ZModemCancelled()
+            if c == ZPAD:
+                seenPad = True
+                continue
+            if c != ZDLE or not seenPad:
+                seenPad = False
+                continue
+            kind = self._raw(deadline)
+            numCan = numCan + 1 if kind == ZDLE else 0
+            if kind == ZHEX:
+                digits = bytes(self._raw(deadline) for i in range(14))
+                try:
+                    header = bytes.fromhex(digits.decode('ascii'))
+                except ValueError:
+                    raise ZModemError('bad hex header')
+                if binascii.crc_hqx(header[:5], 0) != int.from_bytes(header[5:], 'big'):
+                    raise ZModemError('bad header CRC')
+                return header[0], header[1:5], False
+            if kind in (ZBIN, ZBIN32):
+                n = 9 if kind == ZBIN32 else 7
+                header = bytes(self._zdl(deadline) & 0xff for i in range(n))
+                if kind == ZBIN32:
+                    ok = zlib.crc32(header[:5]) == int.from_bytes(header[5:], 'little')
+                else:
+                    ok = binascii.crc_hqx(header[:5], 0) == int.from_bytes(header[5:], 'big')
+                if not ok:
+                    raise ZModemError('bad header CRC')
+                return header[0], header[1:5], kind == ZBIN32
+            seenPad = False
+
+    # Read one data subpacket.  Returns (data, frame end).
+    def read_subpacket(self, use32, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        data = bytearray()
+        while True:
+            i = self.buf.find(ZDLE, self.pos)
+            if i < 0:
+                data += self.buf[self.pos:].translate(None, FLOW_CONTROL)
+                self.pos = len(self.buf)
+                self._fill(deadline)
+                continue
+            data += self.buf[self.pos:i].translate(None, FLOW_CONTROL)
+            self.pos = i + 1
+            c = self._raw(deadline)
+            if c in FRAME_ENDS:
+                frameEnd = c
+                break
+            if c == ZRUB0:
+                data.append(0x7f)
+            elif c == ZRUB1:
+                data.append(0xff)
+            elif c == ZDLE:
+                self._check_cancel(deadline)
+            elif c & 0x60 == 0x40:
+                data.append(c ^ 0x40)
+            else:
+                raise ZModemError('bad escape')
+            if len(data) > MAX_SUBPACKET:
+                raise ZModemError('subpacket too long')
+
+        crc = bytes(self._zdl(deadline) for i in range(4 if use32 else 2))
+        data.append(frameEnd)
+        if use32:
+            ok = zlib.crc32(data) == int.from_bytes(crc, 'little')
+        else:
+            ok = binascii.crc_hqx(data, 0) == int.from_bytes(crc, 'big')
+        if not ok:
+            raise ZModemError('bad data CRC')
+        del data[-1]
+        return bytes(data), frameEnd
+
+    def write(self, data):
+        self.port.write(data)
+
+    def send_hex_header(self, ftype, p=b'\0\0\0\0'):
+        header = bytes((ftype,)) + p
+        header = header + binascii.crc_hqx(header, 0).to_bytes(2, 'big')
+        s = b'**\x18B' + header.hex().encode() + b'\r\x8a'
+        if ftype not in (ZACK, ZFIN):
+            s = s + b'\x11'
+        self.write(s)
+
+    def send_binary_header(self, ftype, p, use32):
+        header = bytes((ftype,)) + p
+        if use32:
+            self.write(b'*\x18C' + escape(header + zlib.crc32(header).to_bytes(4, 'little')))
+        else:
+            self.write(b'*\x18A' + escape(header + binascii.crc_hqx(header, 0).to_bytes(2, 'big')))
+
+    def send_subpacket(self, data, frameEnd, use32):
+        if use32:
+            crc = zlib.crc32(data + bytes((frameEnd,))).to_bytes(4, 'little')
+        else:
+            crc = binascii.crc_hqx(data + bytes((frameEnd,)), 0).to_bytes(2, 'big')
+        self.write(escape(data) + bytes((ZDLE, frameEnd)) + escape(crc))
+
+
+class ZModemReceiver(ZModemPort):
+    # on_progress(path, final, restart), if given, is called every PROGRESS_BYTES
+    # or so while a file is arriving (after the data is flushed to disk), with
+    # final=True when the file is complete, and with restart=True when a partial
+    # file turned out to be something else and was emptied.
+    def __init__(self, port, directory='.', resume=True, timeout=10, maxErrors=10, log=print,
+                 overlap=RESUME_OVERLAP, on_progress=None):
+        ZModemPort.__init__(self, port, timeout)
+        self.directory = directory
+        self.resume = resume
+        self.overlap = overlap
+        self.on_progress = on_progress
+        self.lastProgress = 0
+        self.maxErrors = maxErrors
+        self.log = log
+        self.files = []         # one result per file, see start_file
+        self.file = None        # the file being received and its result
+        self.result = None
+        self.offset = 0
+        self.verifyUntil = 0    # bytes before this are already on disk and are compared, not written
+
+    def send_rinit(self):
+        self.send_hex_header(ZRINIT, bytes((0, 0, 0, CANFDX | CANOVIO | CANFC32)))
+
+    def send_rpos(self):
+        self.send_hex_header(ZRPOS, self.offset.to_bytes(4, 'little'))
+
+    # ZFILE data is "name\0size mtime mode ...\0"
+    def start_file(self, info):
+        self.close_file()
+        name, rest = (info.split(b'\0') + [b''])[:2]
+        name = os.path.basename(name.decode('ascii', 'replace'))
+        fields = rest.split()
+        size = int(fields[0]) if fields else None
+        mtime = int(fields[1], 8) if len(fields) > 1 else 0
+        path = os.path.join(self.directory, name)
+
+        have = 0
+        if self.resume and os.path.isfile(path):
+            have = os.path.getsize(path)
+            if size is not None and have > size:
+                have = 0                # not the same file - start over
+        # pick up where the last attempt stopped, re-reading a little to check
+        # that what we have really is the start of this file
+        self.offset = max(0, have - self.overlap)
+        self.verifyUntil = have
+        self.file = open(path, 'r+b' if have else 'wb')
+        self.file.seek(have)
+        self.file.truncate()
+        self.file.seek(self.offset)
+        self.lastProgress = have
+        self.result = {'name': name, 'path': path, 'size': size, 'mtime': mtime,
+                       'start': have, 'received': 0, 'verified': 0, 'seconds': 0.0, 'rate': 0.0,
+                       'crcErrors': 0, 'timeouts': 0, 'restarts': 0, 'mismatch': False,
+                       'complete': False, 'startTime': time.monotonic()}
+        self.files.append(self.result)
+
+    def close_file(self, complete=False):
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        r = self.result
+        r['complete'] = complete
+        r['seconds'] = time.monotonic() - r.pop('startTime')
+        r['rate'] = r['received'] / r['seconds'] if r['seconds'] > 0 else 0.0
+        if complete and r['mtime']:
+            os.utime(r['path'], (r['mtime'], r['mtime']))
+        self.log(self.summary(r))
+        if complete and self.on_progress is not None:
+            self.on_progress(r['path'], True, False)
+
+    @staticmethod
+    def summary(r):
+        return ('%s %s: %d bytes in %.1f s (%.0f bytes/s), started at %d (%d bytes checked), '
+                '%d CRC errors, %d timeouts, %d restarts'
+                % ('Received' if r['complete'] else 'Incomplete', r['name'], r['received'],
+                   r['seconds'], r['rate'], r['start'], r['verified'], r['crcErrors'], r['timeouts'], r['restarts']))
+
+    def count_error(self, key):
+        if self.result is not None:
+            self.result[key] = self.result[key] + 1
+
+    # Take data subpackets until the end of the frame.  Returns False on an error.
+    def receive_data(self, use32):
+        while True:
+            try:
+                data, frameEnd = self.read_subpacket(use32)
+            except ZModemTimeout:
+                self.count_error('timeouts')
+                return False
+            except ZModemError:
+                self.count_error('crcErrors')
+                return False
+            if self.offset < self.verifyUntil:
+                n = min(len(data), self.verifyUntil - self.offset)
+                if self.file.read(n) != data[:n]:
+                    self.log('Local ' + self.result['name'] + ' does not match the start of the file being sent.  Starting over.')
+                    self.file.seek(0)
+                    self.file.truncate()
+                    self.offset = 0
+                    self.verifyUntil = 0
+                    self.result['start'] = 0
+                    self.result['mismatch'] = True
+                    self.lastProgress = 0
+                    if self.on_progress is not None:
+                        self.on_progress(self.result['path'], False, True)
+                    return False
+                self.offset = self.offset + n
+                self.result['verified'] = self.result['verified'] + n
+                data = data[n:]
+            self.file.write(data)
+            self.offset = self.offset + len(data)
+            self.result['received'] = self.result['received'] + len(data)
+            if self.on_progress is not None and self.offset - self.lastProgress >= PROGRESS_BYTES:
+                self.file.flush()
+                self.lastProgress = self.offset
+                self.on_progress(self.result['path'], False, False)
+            if frameEnd == ZCRCW:
+                self.send_hex_header(ZACK, self.offset.to_bytes(4, 'little'))
+                return True
+            if frameEnd == ZCRCQ:
+                self.send_hex_header(ZACK, self.offset.to_bytes(4, 'little'))
+            elif frameEnd == ZCRCE:
+                return True
+
+    # Receive one session.  Returns True if it ended normally with every file complete.
+    def receive(self):
+        errors = 0
+        self.send_rinit()
+        try:
+            while True:
+                if errors > self.maxErrors:
+                    self.log('ZModem receive giving up after ' + str(errors) + ' errors in a row')
+                    self.write(ABORT_SEQUENCE)
+                    return False
+                try:
+                    ftype, p, use32 = self.read_header()
+                except (ZModemTimeout, ZModemError) as ex:
+                    self.count_error('timeouts' if isinstance(ex, ZModemTimeout) else 'crcErrors')
+                    errors = errors + 1
+                    if self.file is not None:
+                        self.send_rpos()
+                        self.count_error('restarts')
+                    else:
+                        self.send_rinit()
+                    continue
+
+                if ftype == ZRQINIT:
+                    self.send_rinit()
+                elif ftype == ZSINIT:
+                    try:
+                        self.read_subpacket(use32)     # attention string - not used
+                        self.send_hex_header(ZACK)
+                    except (ZModemTimeout, ZModemError):
+                        self.send_hex_header(ZNAK)
+                elif ftype == ZFILE:
+                    try:
+                        info, frameEnd = self.read_subpacket(use32)
+                    except (ZModemTimeout, ZModemError):
+                        errors = errors + 1
+                        self.send_hex_header(ZNAK)
+                        continue
+                    self.start_file(info)
+                    self.send_rpos()
+                elif ftype == ZDATA:
+                    if self.file is None:
+                        self.send_rinit()
+                    elif position(p) != self.offset:
+                        self.send_rpos()    # left over from before a restart, or out of step
+                    elif self.receive_data(use32):
+                        errors = 0
+                    else:
+                        errors = errors + 1
+                        self.send_rpos()
+                        self.count_error('restarts')
+                elif ftype == ZEOF:
+                    if self.file is not None and position(p) == self.offset:
+                        self.close_file(True)
+                        self.send_rinit()
+                    # otherwise the sender is ahead of us - it will hear our ZRPOS
+                elif ftype == ZFIN:
+                    self.send_hex_header(ZFIN)
+                    try:
+                        self._raw(time.monotonic() + 1)    # the "OO" over and out, if it comes
+                        self._raw(time.monotonic() + 1)
+                    except ZModemTimeout:
+                        pass
+                    self.close_file()
+                    return len(self.files) > 0 and all(r['complete'] for r in self.files)
+                elif ftype in (ZCAN, ZABORT, ZFERR):
+                    self.log('ZModem transfer cancelled by sender')
+                    return False
+                elif ftype == ZCOMMAND:
+                    self.send_hex_header(ZCOMPL)    # we don't run commands
+                elif ftype == ZFREECNT:
+                    self.send_hex_header(ZACK)
+        except ZModemCancelled:
+            self.log('ZModem transfer cancelled')
+            return False
+        finally:
+            self.close_file()
+
+
+# Just enough of a sender to test the receiver
+class _TestSender(ZModemPort):
+    def __init__(self, port, files, use32=True, corruptAt=None, dieAt=None, blockSize=1024):
+        ZModemPort.__init__(self, port, timeout=5)
+        self.files = files
+        self.use32 = use32
+        self.corruptAt = corruptAt      # flip a byte in the subpacket starting at this offset, once
+        self.dieAt = dieAt              # stop sending altogether at this offset
+        self.blockSize = blockSize
+        self.ok = False
+
+    def send_file(self, name, data):
+        info = name.encode() + b'\0' + ('%d %o 100644' % (len(data), 1700000000)).encode() + b'\0'
+        self.send_binary_header(ZFILE, b'\0\0\0\0', self.use32)
+        self.send_subpacket(info, ZCRCW, self.use32)
+        sentEof = False
+        while True:
+            ftype, p, x = self.read_header()
+            if ftype == ZRINIT and sentEof:
+                return True
+            if ftype != ZRPOS:
+                continue
+            pos = position(p)
+            if pos < len(data):
+                self.send_binary_header(ZDATA, p, self.use32)
+            restarted = False
+            while pos < len(data):
+                if self.dieAt is not None and pos >= self.dieAt:
+                    return False
+                block = data[pos:pos+self.blockSize]
+                last = pos + len(block) >= len(data)
+                if self.corruptAt is not None and pos <= self.corruptAt < pos + len(block):
+                    self.corruptAt = None
+                    sent = bytearray(escape(block))
+                    sent[len(sent) // 2] ^= 0x01
+                    crc = zlib.crc32(block + bytes((ZCRCG,))) if self.use32 else binascii.crc_hqx(block + bytes((ZCRCG,)), 0)
+                    self.write(bytes(sent) + bytes((ZDLE, ZCRCG)) +
+                               escape(crc.to_bytes(4, 'little') if self.use32 else crc.to_bytes(2, 'big')))
+                else:
+                    self.send_subpacket(block, ZCRCE if last else ZCRCG, self.use32)
+                pos = pos + len(block)
+                if self.port.in_waiting:
+                    restarted = True    # the receiver wants something - probably a ZRPOS
+                    break
+            if not restarted:
+                self.send_binary_header(ZEOF, len(data).to_bytes(4, 'little'), self.use32)
+                sentEof = True
+
+    def run(self):
+        self.write(b'rz\r')
+        self.send_hex_header(ZRQINIT)
+        while self.read_header()[0] != ZRINIT:
+            pass
+        for name, data in self.files:
+            if not self.send_file(name, data):
+                return
+        self.send_hex_header(ZFIN)
+        while self.read_header()[0] != ZFIN:
+            pass
+        self.write(b'OO')
+        self.ok = True
+
+
+# A pty end with what ZModemPort needs
+class _FdPort:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        return int.from_bytes(fcntl.ioctl(self.fd, termios.FIONREAD, b'\0\0\0\0'), sys.byteorder)
+
+    def read(self, n):
+        return os.read(self.fd, n)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+def _transfer(directory, files, **senderOptions):
+    import serial
+    master, slave = pty.openpty()
+    ser = serial.Serial(os.ttyname(slave), 115200)
+    sender = _TestSender(_FdPort(master), files, **senderOptions)
+    t = threading.Thread(target=lambda: _ignore_errors(sender.run), daemon=True)
+    t.start()
+    receiver = ZModemReceiver(ser, directory, timeout=0.5, maxErrors=3, log=lambda *a: None)
+    ok = receiver.receive()
+    t.join(10)
+    ser.close()
+    os.close(master)
+    os.close(slave)
+    return ok, receiver.files
+
+
+def _ignore_errors(fn):
+    try:
+        fn()
+    except (ZModemTimeout, ZModemError, ZModemCancelled, OSError):
+        pass
+
+
+def self_check():
+    rnd = random.Random(1)
+    directory = tempfile.mkdtemp()
+    files = [('dataLog%05d.TXT' % i, bytes(rnd.randrange(256) for j in range(n)))
+             for i, n in enumerate((0, 1, 30000, 100000))]
+
+    def same(name, data):
+        f = open(os.path.join(directory, name), 'rb')
+        ok = f.read() == data
+        f.close()
+        return ok
+
+    checks = []
+    ok, results = _transfer(directory, files)
+    checks.append(('clean transfer, CRC-32', ok and all(same(n, d) for n, d in files)))
+    print('  ' + ZModemReceiver.summary(results[-1]))
+
+    name, data = files[3]
+    os.remove(os.path.join(directory, name))
+    ok, results = _transfer(directory, [files[3]], use32=False, corruptAt=40000)
+    checks.append(('corrupted subpacket, CRC-16', ok and same(name, data) and results[0]['crcErrors'] == 1))
+    print('  ' + ZModemReceiver.summary(results[0]))
+
+    f = open(os.path.join(directory, name), 'r+b')
+    f.truncate(12345)
+    f.close()
+    ok, results = _transfer(directory, [files[3]])
+    checks.append(('resume from a partial file', ok and same(name, data) and results[0]['start'] == 12345
+                   and results[0]['received'] == len(data) - 12345 and results[0]['verified'] == RESUME_OVERLAP))
+    print('  ' + ZModemReceiver.summary(results[0]))
+
+    f = open(os.path.join(directory, name), 'wb')
+    f.write(data[:5000] + b'a different file')
+    f.close()
+    ok, results = _transfer(directory, [files[3]])
+    checks.append(('partial file that differs', ok and same(name, data) and results[0]['mismatch']))
+    print('  ' + ZModemReceiver.summary(results[0]))
+
+    os.remove(os.path.join(directory, name))
+    ok, results = _transfer(directory, [files[3]], dieAt=60000)
+    partial = os.path.getsize(os.path.join(directory, name))
+    died = not ok and 0 < partial < len(data)
+    ok, results = _transfer(directory, [files[3]])
+    checks.append(('sender dies, then resume', died and ok and same(name, data) and results[0]['start'] == partial))
+    print('  ' + ZModemReceiver.summary(results[0]))
+
+    shutil.rmtree(directory)
+    for name, ok in checks:
+        print('%-30s %s' % (name, 'ok' if ok else 'FAILED'))
+    return all(ok for name, ok in checks)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)